@@ -17,17 +17,23 @@ import {
 import { db } from "./firebase"
 import { JournalEntry } from "./types"
 import { getCurrentUser } from "./firebase"
-import { encrypt, decrypt } from "./crypto/encryption"
+import { encrypt, decrypt, getUserDataKey } from "./crypto/encryption"
+
+// Data key of a user migrated to v2 envelopes, or null for v1-only users
+async function loadUserDataKey(userId: string, userEmail: string): Promise<CryptoKey | null> {
+  const userSnap = await getDoc(doc(db, "users", userId))
+  return userSnap.exists() ? getUserDataKey(userSnap.data(), userEmail) : null
+}
 
 // Helper function to convert Firestore data to JournalEntry
-async function convertFirestoreEntry(docData: any, docId: string, userId: string, userEmail: string): Promise<JournalEntry> {
+async function convertFirestoreEntry(docData: any, docId: string, userId: string, userEmail: string, dataKey?: CryptoKey | null): Promise<JournalEntry> {
   let title = ""
   let content = ""
   
   try {
     // Decrypt the encrypted fields
-    title = docData.encryptedTitle ? await decrypt(docData.encryptedTitle, userEmail) : docData.title || ""
-    content = docData.encryptedContent ? await decrypt(docData.encryptedContent, userEmail) : docData.content || ""
+    title = docData.encryptedTitle ? await decrypt(docData.encryptedTitle, userEmail, dataKey) : docData.title || ""
+    content = docData.encryptedContent ? await decrypt(docData.encryptedContent, userEmail, dataKey) : docData.content || ""
   } catch (error) {
     console.error("Error decrypting journal entry:", error)
     // Fallback to non-encrypted data if decryption fails
@@ -77,8 +83,10 @@ export async function createJournalEntry(
     const date = new Date(dateStr)
     const now = new Date()
 
-    const encryptedTitle = await encrypt(title, email)
-    const encryptedContent = await encrypt(content, email)
+    // Migrated users get v2 envelopes, without the per-field PBKDF2 cost
+    const dataKey = await loadUserDataKey(userId, email)
+    const encryptedTitle = await encrypt(title, email, dataKey)
+    const encryptedContent = await encrypt(content, email, dataKey)
 
     const entry = {
       encryptedTitle,
@@ -121,10 +129,11 @@ export async function getJournalEntries(userId: string, userEmail: string) {
 
     const querySnapshot = await getDocs(q)
     const entries: JournalEntry[] = []
+    const dataKey = await loadUserDataKey(userId, userEmail)
 
     // Process entries sequentially to handle async decryption
     for (const doc of querySnapshot.docs) {
-      const entry = await convertFirestoreEntry(doc.data(), doc.id, userId, userEmail)
+      const entry = await convertFirestoreEntry(doc.data(), doc.id, userId, userEmail, dataKey)
       entries.push(entry)
     }
 
@@ -150,7 +159,8 @@ export async function getJournalEntryById(userId: string, entryId: string, userE
       return { success: false, entry: null, message: "Entry not found" }
     }
 
-    const entry = await convertFirestoreEntry(docSnap.data(), docSnap.id, userId, userEmail)
+    const dataKey = await loadUserDataKey(userId, userEmail)
+    const entry = await convertFirestoreEntry(docSnap.data(), docSnap.id, userId, userEmail, dataKey)
     console.log("meow,",entry)
     return { success: true, entry }
   } catch (error) {
@@ -200,8 +210,9 @@ export async function updateJournalEntry(
 
     const date = new Date(dateStr)
 
-    const encryptedTitle = await encrypt(title, email)
-    const encryptedContent = await encrypt(content, email)
+    const dataKey = await loadUserDataKey(userId, email)
+    const encryptedTitle = await encrypt(title, email, dataKey)
+    const encryptedContent = await encrypt(content, email, dataKey)
 
     await updateDoc(docRef, {
       encryptedTitle,
@@ -270,6 +281,7 @@ export async function getEntriesByMonth(userId: string, year: number, month: num
 
     const querySnapshot = await getDocs(q)
     const entries: JournalEntry[] = []
+    const dataKey = await loadUserDataKey(userId, userEmail)
 
     // Filter entries by date range and decrypt them
     for (const doc of querySnapshot.docs) {
@@ -277,7 +289,7 @@ export async function getEntriesByMonth(userId: string, year: number, month: num
       const entryDate = entryData.date.toDate()
       
       if (entryDate >= startDate && entryDate <= endDate) {
-        const entry = await convertFirestoreEntry(entryData, doc.id, userId, userEmail)
+        const entry = await convertFirestoreEntry(entryData, doc.id, userId, userEmail, dataKey)
         entries.push(entry)
       }
     }
@@ -1,5 +1,44 @@
 const masterKey = process.env.NEXT_PUBLIC_ENCRYPTION_KEY;
 
+// v2 envelope: version byte + IV + AES-GCM payload under a per-user data key.
+// Legacy v1 blobs (salt + IV + payload) carry no version byte.
+const ENVELOPE_V2 = 2;
+
+// User document field holding the per-user data key, wrapped as a v1 blob
+const WRAPPED_DATA_KEY_FIELD = 'wrappedDataKey';
+
+function fromBase64(data: string): Uint8Array {
+  return new Uint8Array(
+    atob(data)
+      .split('')
+      .map(char => char.charCodeAt(0))
+  );
+}
+
+/**
+ * Decrypts a decoded v2 envelope, returning null if it is not one.
+ * A v1 salt can start with the version byte by chance, so an envelope that
+ * fails authentication is handed back to the v1 path instead of throwing.
+ */
+async function tryDecryptV2(combined: Uint8Array, dataKey?: CryptoKey | null): Promise<Uint8Array | null> {
+  if (!dataKey || combined.length < 13 || combined[0] !== ENVELOPE_V2) {
+    return null;
+  }
+  try {
+    const decrypted = await crypto.subtle.decrypt(
+      {
+        name: 'AES-GCM',
+        iv: combined.slice(1, 13),
+      },
+      dataKey,
+      combined.slice(13)
+    );
+    return new Uint8Array(decrypted);
+  } catch {
+    return null;
+  }
+}
+
 /**
  * Derives a crypto key from a password using PBKDF2
  */
@@ -28,20 +67,34 @@ async function deriveKey(password: string, salt: Uint8Array): Promise<CryptoKey>
 }
 
 /**
- * Encrypts data using AES-GCM with Web Crypto API
+ * Encrypts data using AES-GCM with Web Crypto API. With the user's data key
+ * the result is a v2 envelope; without one it is a legacy v1 blob under a
+ * key derived from encryptionKey
  * @param data - The string data to encrypt
  * @param encryptionKey - The password/key to use for encryption
- * @returns Promise<string> - Base64 encoded encrypted data with salt and IV
+ * @param dataKey - The user's unwrapped data key, if they have been migrated to v2
+ * @returns Promise<string> - Base64 encoded encrypted data
  */
-const encrypt = async (data:string , encryptionKey: string): Promise<string> => {
+const encrypt = async (data:string , encryptionKey: string, dataKey?: CryptoKey | null): Promise<string> => {
   if (!data || !encryptionKey) {
     throw new Error('Data and encryption key are required');
   }
 
   const encoder = new TextEncoder();
-  const salt = crypto.getRandomValues(new Uint8Array(16));
   const iv = crypto.getRandomValues(new Uint8Array(12)); // 12 bytes for AES-GCM
-  
+
+  if (dataKey) {
+    const encrypted = await crypto.subtle.encrypt({ name: 'AES-GCM', iv: iv }, dataKey, encoder.encode(data));
+
+    // Combine version byte + iv + encrypted data
+    const envelope = new Uint8Array(1 + iv.length + encrypted.byteLength);
+    envelope[0] = ENVELOPE_V2;
+    envelope.set(iv, 1);
+    envelope.set(new Uint8Array(encrypted), 1 + iv.length);
+    return btoa(String.fromCharCode(...envelope));
+  }
+
+  const salt = crypto.getRandomValues(new Uint8Array(16));
   const key = await deriveKey(encryptionKey, salt);
   
   const encrypted = await crypto.subtle.encrypt(
@@ -64,23 +117,27 @@ const encrypt = async (data:string , encryptionKey: string): Promise<string> =>
 };
 
 /**
- * Decrypts data using AES-GCM with Web Crypto API
+ * Decrypts data using AES-GCM with Web Crypto API, accepting both v2
+ * envelopes and legacy v1 blobs
  * @param encryptedData - Base64 encoded encrypted data
  * @param encryptionKey - The password/key used for encryption
+ * @param dataKey - The user's unwrapped data key, required to read v2 envelopes
  * @returns Promise<string> - The decrypted string
  */
-const decrypt = async (encryptedData:string, encryptionKey:string ): Promise<string> => {
+const decrypt = async (encryptedData:string, encryptionKey:string, dataKey?: CryptoKey | null): Promise<string> => {
   if (!encryptedData || !encryptionKey) {
     throw new Error('Encrypted data and encryption key are required');
   }
 
   try {
     // Convert from base64
-    const combined = new Uint8Array(
-      atob(encryptedData)
-        .split('')
-        .map(char => char.charCodeAt(0))
-    );
+    const combined = fromBase64(encryptedData);
+
+    // v2 envelopes only need AES-GCM under the data key
+    const decryptedV2 = await tryDecryptV2(combined, dataKey);
+    if (decryptedV2) {
+      return new TextDecoder().decode(decryptedV2);
+    }
 
     // Extract salt, iv, and encrypted data
     const salt = combined.slice(0, 16);
@@ -105,5 +162,49 @@ const decrypt = async (encryptedData:string, encryptionKey:string ): Promise<str
   }
 };
 
-export { encrypt, decrypt, masterKey };
+/**
+ * Decrypts a base64 v2 envelope back to raw bytes
+ * @param encryptedData - Base64 encoded v2 envelope
+ * @param dataKey - The user's unwrapped data key
+ * @returns Promise<Uint8Array> - The decrypted bytes
+ */
+const decryptV2Bytes = async (encryptedData: string, dataKey: CryptoKey): Promise<Uint8Array> => {
+  const decrypted = await tryDecryptV2(fromBase64(encryptedData), dataKey);
+  if (!decrypted) {
+    throw new Error('Decryption failed: Not a v2 envelope or wrong key');
+  }
+  return decrypted;
+};
+
+/**
+ * Unwraps a per-user data key stored as a v1 blob (base64 of the raw key)
+ * @param wrappedKey - The wrappedDataKey field of the user document
+ * @param encryptionKey - The password/key the user's data is encrypted with
+ * @returns Promise<CryptoKey> - The AES-GCM data key
+ */
+const unwrapDataKey = async (wrappedKey: string, encryptionKey: string): Promise<CryptoKey> => {
+  const rawKey = fromBase64(await decrypt(wrappedKey, encryptionKey));
+  return crypto.subtle.importKey('raw', rawKey, { name: 'AES-GCM' }, false, ['encrypt', 'decrypt']);
+};
+
+/**
+ * Returns the unwrapped data key stored on a user document, or null if the
+ * user has not been migrated to v2 or the key cannot be unwrapped
+ * @param userData - The user document data
+ * @param encryptionKey - The password/key the user's data is encrypted with
+ */
+const getUserDataKey = async (userData: any, encryptionKey: string): Promise<CryptoKey | null> => {
+  const wrappedKey = userData?.[WRAPPED_DATA_KEY_FIELD];
+  if (!wrappedKey || !encryptionKey) {
+    return null;
+  }
+  try {
+    return await unwrapDataKey(wrappedKey, encryptionKey);
+  } catch (error) {
+    console.error('Failed to unwrap data key:', error);
+    return null;
+  }
+};
+
+export { encrypt, decrypt, decryptV2Bytes, unwrapDataKey, getUserDataKey, WRAPPED_DATA_KEY_FIELD, masterKey };
 
@@ -12,10 +12,17 @@ import {
   doc, 
   setDoc, 
   getDoc, 
+  getDocs,
   updateDoc,
+  collection,
+  query,
+  orderBy,
+  limit,
+  startAfter,
+  runTransaction,
   serverTimestamp 
 } from 'firebase/firestore';
-import { encrypt, decrypt } from './crypto/encryption';
+import { encrypt, decrypt, decryptV2Bytes, getUserDataKey } from './crypto/encryption';
 
 // Firebase configuration
 const firebaseConfig = {
@@ -99,17 +106,45 @@ export interface MessageHistoryItem {
   role: 'user' | 'assistant';
 }
 
+// Packed history segment: a v2 envelope holding zlib-compressed JSON of
+// {message, role} entries, written by the backend (see history.py)
+async function unpackSegment(segment: any, dataKey?: CryptoKey | null): Promise<MessageHistoryItem[]> {
+  if (!dataKey) {
+    throw new Error('Data key is required to read history segments')
+  }
+  if ((segment.codec || 'zlib') !== 'zlib') {
+    throw new Error(`Unsupported history segment codec: ${segment.codec}`)
+  }
+  const compressed = await decryptV2Bytes(segment.encryptedSegment, dataKey)
+  const stream = new Blob([compressed]).stream().pipeThrough(new DecompressionStream('deflate'))
+  const entries = JSON.parse(await new Response(stream).text())
+  return entries.map((entry: any) => ({ message: entry.message, role: entry.role }))
+}
+
 // Helper function to decrypt message history
-async function decryptMessageHistory(encryptedHistory: any[], userEmail: string): Promise<MessageHistoryItem[]> {
+async function decryptMessageHistory(encryptedHistory: any[], userEmail: string, dataKey?: CryptoKey | null): Promise<MessageHistoryItem[]> {
   const decryptedHistory: MessageHistoryItem[] = []
   
   for (const item of encryptedHistory) {
+    if (item.encryptedSegment) {
+      try {
+        decryptedHistory.push(...await unpackSegment(item, dataKey))
+      } catch (error) {
+        console.error("Error decrypting history segment:", error)
+        decryptedHistory.push({
+          message: "Unable to decrypt message",
+          role: 'assistant'
+        })
+      }
+      continue
+    }
+
     try {
       let message = ""
       
       // Decrypt the message if it's encrypted
       if (item.encryptedMessage) {
-        message = await decrypt(item.encryptedMessage, userEmail)
+        message = await decrypt(item.encryptedMessage, userEmail, dataKey)
       } else {
         // Fallback to unencrypted message for backward compatibility
         message = item.message || "Unable to decrypt message"
@@ -133,12 +168,12 @@ async function decryptMessageHistory(encryptedHistory: any[], userEmail: string)
 }
 
 // Helper function to encrypt message history
-async function encryptMessageHistory(history: MessageHistoryItem[], userEmail: string): Promise<any[]> {
+async function encryptMessageHistory(history: MessageHistoryItem[], userEmail: string, dataKey?: CryptoKey | null): Promise<any[]> {
   const encryptedHistory = []
   
   for (const item of history) {
     try {
-      const encryptedMessage = await encrypt(item.message, userEmail)
+      const encryptedMessage = await encrypt(item.message, userEmail, dataKey)
       encryptedHistory.push({
         encryptedMessage,
         role: item.role
@@ -157,6 +192,42 @@ async function encryptMessageHistory(history: MessageHistoryItem[], userEmail: s
 }
 
 
+// Messages fetched per subcollection query
+const HISTORY_PAGE_SIZE = 200
+
+// Reads the messages subcollection in seq order, HISTORY_PAGE_SIZE documents
+// per query, so no single read pulls the whole history
+async function readMessagePages(userId: string): Promise<any[]> {
+  const messagesRef = collection(db, 'users', userId, 'messages')
+  const entries: any[] = []
+  let lastDoc: any = null
+  while (true) {
+    const pageQuery = lastDoc
+      ? query(messagesRef, orderBy('seq'), startAfter(lastDoc), limit(HISTORY_PAGE_SIZE))
+      : query(messagesRef, orderBy('seq'), limit(HISTORY_PAGE_SIZE))
+    const page = await getDocs(pageQuery)
+    entries.push(...page.docs.map((messageDoc) => messageDoc.data()))
+    if (page.docs.length < HISTORY_PAGE_SIZE) {
+      return entries
+    }
+    lastDoc = page.docs[page.docs.length - 1]
+  }
+}
+
+// The newest `count` raw history entries, oldest first, without reading the
+// rest of the history
+async function readLatestEntries(userId: string, userData: any, count: number): Promise<any[]> {
+  const latest = await getDocs(
+    query(collection(db, 'users', userId, 'messages'), orderBy('seq', 'desc'), limit(count))
+  )
+  const entries = latest.docs.map((messageDoc) => messageDoc.data()).reverse()
+  if (entries.length >= count) {
+    return entries
+  }
+  // Legacy userHistory entries are older than the messages subcollection
+  return [...(userData.userHistory || []).slice(entries.length - count), ...entries]
+}
+
 // Get message history for a user
 export const getMessageHistory = async (
 ): Promise<MessageHistoryItem[]> => {
@@ -178,14 +249,20 @@ export const getMessageHistory = async (
     
     if (userSnapshot.exists()) {
       const userData = userSnapshot.data();
-      const encryptedHistory = userData.userHistory || [];
+      // Legacy userHistory entries are older than the messages subcollection
+      const encryptedHistory = [
+        ...(userData.userHistory || []),
+        ...await readMessagePages(userId),
+      ];
       if(!userEmail){
       console.log('No user document found');
 
         return []
       }
-      // Decrypt the message history before returning
-      return await decryptMessageHistory(encryptedHistory, userEmail);
+      // Decrypt the message history before returning; migrated users'
+      // messages are v2 envelopes under their wrapped data key
+      const dataKey = await getUserDataKey(userData, userEmail);
+      return await decryptMessageHistory(encryptedHistory, userEmail, dataKey);
     } else {
       console.log('No user document found');
       return [];
@@ -208,7 +285,13 @@ export const addMessageToHistory = async (
     if (!userId || !userEmail) {
       throw new Error('User is not authenticated');
     }
-    const prevMessage = await getMessageHistory();
+    // Only the last two messages are compared, so only those are read
+    const userSnapshot = await getDoc(doc(db, 'users', userId));
+    const userData = userSnapshot.exists() ? userSnapshot.data() : {};
+    const dataKey = await getUserDataKey(userData, userEmail);
+    const prevMessage = await decryptMessageHistory(
+      await readLatestEntries(userId, userData, 2), userEmail, dataKey
+    );
     console.log(prevMessage)
     if(newMessage == prevMessage[prevMessage.length - 1] || (prevMessage.length >= 2 && newMessage == prevMessage[prevMessage.length - 2])){
       console.log("Message already exists in history, skipping addition.");
@@ -216,30 +299,30 @@ export const addMessageToHistory = async (
     }
     console.log(prevMessage[prevMessage.length - 1], newMessage)
     
-    // Get the current encrypted history directly from Firestore
     const userDocRef = doc(db, 'users', userId);
-    const userSnapshot = await getDoc(userDocRef);
-    
-    let currentEncryptedHistory = [];
-    if (userSnapshot.exists()) {
-      const userData = userSnapshot.data();
-      currentEncryptedHistory = userData.userHistory || [];
-    }
     
-    // Encrypt only the new message
-    const encryptedNewMessage = await encrypt(newMessage.message, userEmail);
+    // Encrypt only the new message, as a v2 envelope once the user has a data key
+    const encryptedNewMessage = await encrypt(newMessage.message, userEmail, dataKey);
     const newEncryptedItem = {
       encryptedMessage: encryptedNewMessage,
       role: newMessage.role
     };
     
-    // Add the new encrypted message to the existing encrypted history
-    const updatedEncryptedHistory = [...currentEncryptedHistory, newEncryptedItem];
-    
-    await setDoc(userDocRef, {
-      userHistory: updatedEncryptedHistory,
-      updatedAt: serverTimestamp()
-    }, { merge: true });
+    // Store the message in its own document; messageSeq on the user document
+    // hands out the next position in the history
+    await runTransaction(db, async (transaction) => {
+      const userSnapshot = await transaction.get(userDocRef);
+      const seq = userSnapshot.exists() ? (userSnapshot.data().messageSeq || 0) : 0;
+      transaction.set(doc(collection(db, 'users', userId, 'messages')), {
+        ...newEncryptedItem,
+        seq,
+        createdAt: serverTimestamp()
+      });
+      transaction.set(userDocRef, {
+        messageSeq: seq + 1,
+        updatedAt: serverTimestamp()
+      }, { merge: true });
+    });
     console.log('Message added to history successfully');
     const updateRef = doc(db, "users", userId)
 
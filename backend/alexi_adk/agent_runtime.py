@@ -0,0 +1,125 @@
+import os
+import time
+import uuid
+import threading
+import logging
+
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+# Sessions unused for this long are deleted
+AGENT_SESSION_IDLE_SECONDS = float(os.getenv("AGENT_SESSION_IDLE_SECONDS", 1800))
+# A session is replaced once it holds more events than this, so the history
+# the agent sees (and pays for in prompt tokens) stays bounded
+AGENT_SESSION_MAX_EVENTS = int(os.getenv("AGENT_SESSION_MAX_EVENTS", 20))
+
+
+class _UserSession:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.events = 0
+        self.last_used = time.monotonic()
+
+
+class AgentRuntime:
+    """
+    Process-wide Runner for one agent, with one session per real user.
+
+    The Runner and session service are created once instead of per request.
+    Sessions are keyed by the caller's user_id, so concurrent users never
+    share a session; a user's session is reused across requests until it
+    holds more than `max_session_events` events (0 means a fresh session
+    for every run) or has been idle for `idle_seconds`. Agents are driven
+    with `run_async`, so the request's event loop is never blocked by the
+    model calls.
+    """
+
+    def __init__(self, agent, app_name: str, max_session_events: int = AGENT_SESSION_MAX_EVENTS,
+                 idle_seconds: float = AGENT_SESSION_IDLE_SECONDS, session_service=None):
+        self.app_name = app_name
+        self.max_session_events = max_session_events
+        self.idle_seconds = idle_seconds
+        self.session_service = session_service or InMemorySessionService()
+        self.runner = Runner(agent=agent, app_name=app_name, session_service=self.session_service)
+        self._sessions = {}
+        # Flask runs each async view on its own event loop, so plain locks guard shared state
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    async def _session_for(self, user_id: str) -> _UserSession:
+        stale = []
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_sweep >= min(self.idle_seconds, 60):
+                self._last_sweep = now
+                for key, entry in list(self._sessions.items()):
+                    if now - entry.last_used >= self.idle_seconds:
+                        stale.append((key, self._sessions.pop(key)))
+            entry = self._sessions.get(user_id)
+            if entry is not None and entry.events > self.max_session_events:
+                stale.append((user_id, self._sessions.pop(user_id)))
+                entry = None
+            if entry is not None:
+                entry.last_used = now
+
+        for key, old in stale:
+            await self._delete(key, old.session_id)
+        if entry is not None:
+            return entry
+
+        # Create the session before publishing it, so a concurrent request
+        # for the same user never runs against a session that does not exist yet
+        created = _UserSession(uuid.uuid4().hex)
+        await self.session_service.create_session(
+            app_name=self.app_name, user_id=user_id, session_id=created.session_id
+        )
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            if entry is None:
+                entry = self._sessions[user_id] = created
+                created = None
+            entry.last_used = time.monotonic()
+        if created is not None:
+            # Another request for this user won the race
+            await self._delete(user_id, created.session_id)
+        return entry
+
+    async def _delete(self, user_id: str, session_id: str) -> None:
+        try:
+            await self.session_service.delete_session(
+                app_name=self.app_name, user_id=user_id, session_id=session_id
+            )
+        except Exception as e:
+            logger.warning(f"Failed to delete {self.app_name} session for user {user_id}: {e}")
+
+    async def run(self, user_id: str, query: str):
+        """
+        Runs the agent on `query` in the user's session
+
+        Args:
+            user_id (str): The real user ID the session belongs to
+            query (str): The message for the agent
+
+        Returns:
+            Optional[str]: The text of the agent's final response
+        """
+        entry = await self._session_for(user_id)
+        content = types.Content(role="user", parts=[types.Part(text=query)])
+        final_response = None
+        events = 1
+        async for event in self.runner.run_async(
+            user_id=user_id, session_id=entry.session_id, new_message=content
+        ):
+            events += 1
+            if event.is_final_response() and event.content and event.content.parts:
+                final_response = event.content.parts[0].text
+        with self._lock:
+            entry.events += events
+        return final_response
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._sessions)}
@@ -0,0 +1,58 @@
+"""
+Prompts and verdict parsing for the answer review. They live outside
+next_ques_agent, whose package import starts Firebase, so benchmarks and
+tests can use them without credentials.
+"""
+import json
+
+REVIEWER_INSTRUCTION = """
+You are a helper agent to a mental therapist. The mental therapist has asked the user some question, and the user has provided an answer. Your task is to review the user's answer and tell if the answer is complete or not. That is, you have to check if the user has answered all parts of the question asked by the therapist.
+If the answer is not complete, call the follow_up_generator agent tool to generate a follow-up question based on the user's answer. Provide the therapist's question and user's answer as it is to the follow_up_generator tool (provide it as a single string).
+
+If the answer is complete and satisfactory, (or the user tells they don't want to answer the question) call the get_next_question tool to get the next question for the user. If the next question is not available, return empty string.
+
+return only the question to be asked as a string and nothing else or empty string if no question provided.
+"""
+
+FOLLOW_UP_INSTRUCTION = """
+You are a follow-up question generator AI. The user has answered a question asked by the therapist, but not completely. Your task is to generate a follow-up question based on the user's answer to a therapy question.
+"""
+
+VERDICT_INSTRUCTION = """
+You are a helper agent to a mental therapist. The mental therapist has asked the user some question, and the user has provided an answer. Review the user's answer and tell if it is complete, that is, if the user has answered all parts of the question asked by the therapist. An answer where the user tells they don't want to answer the question counts as complete.
+
+If the answer is not complete, write one short follow-up question that asks for the missing part, based on the user's answer. If it is complete, leave follow_up empty.
+
+Return only in the following format:
+{
+    "complete": <true or false>,
+    "follow_up": <follow-up question, or empty string>
+}
+"""
+
+
+def verdict_query(current_question: dict, expected_answer, user_response) -> str:
+    """Query for the single-shot answer review of the current question"""
+    return f"""
+Therapist's question: {(current_question or {}).get('questionText', '')}
+Expected answer: {expected_answer or ''}
+User's answer: {user_response}
+"""
+
+
+def parse_verdict(verdict_result):
+    """
+    The {"complete", "follow_up"} verdict from the agent's reply (a dict or
+    JSON text), or None if the reply is not a usable verdict
+    """
+    if isinstance(verdict_result, str):
+        try:
+            verdict_result = json.loads(verdict_result)
+        except json.JSONDecodeError:
+            return None
+    if not isinstance(verdict_result, dict) or not isinstance(verdict_result.get("complete"), bool):
+        return None
+    follow_up = str(verdict_result.get("follow_up") or "").strip()
+    if not verdict_result["complete"] and not follow_up:
+        return None
+    return {"complete": verdict_result["complete"], "follow_up": follow_up}
@@ -0,0 +1,475 @@
+"""
+Micro-benchmarks for the question and progress agents.
+
+Run from the alexi_adk directory, e.g.:
+    python benchmarks.py progress-checkpoint --conversations 20
+"""
+import argparse
+import os
+import random
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _estimate_tokens(text):
+    return max(1, len(str(text)) // 4)
+
+
+# Answers per question of questions_flat.json: clear ones, vague ones that
+# need a follow-up, and skips. The data is made up, so a mistake count of 0
+# only shows the matcher handles these phrasings; tests/test_matcher.py
+# holds the cases it must leave to the model.
+_ANSWERS = [
+    (["I'm feeling good, thanks", "Okay I guess", "Not well today"], ["hmm", "it's complicated"]),
+    (["Yes, I had breakfast", "No, I skipped it", "yes", "I did not skip it"], ["sort of", "I don't know"]),
+    (["Slept at 11 pm and woke up at 6 am", "I went to bed around midnight, up at 7"], ["late", "went to bed late"]),
+    (["No, I feel normal", "A bit tired", "I'm stressed today"], ["maybe"]),
+    (["Zone B near the substation", "At the north site area"], ["somewhere"]),
+    (["Yes, I have worked there before", "No, first time there"], ["not sure"]),
+    (["Yes, all my equipment is in good condition", "My gloves are missing"], ["some of it"]),
+    (["Yes, the area is safe", "There is a hazard near the cables"], ["I think"]),
+    (["Yes, I know the tasks and precautions", "No, it's unclear to me"], ["kind of"]),
+    (["Yes, I'm ready to start", "Not ready, feeling unwell"], ["almost"]),
+    (["Yes, there's water nearby", "No drinking water here"], ["hmm"]),
+    (["Thank you!", "Thanks, will do"], ["..."]),
+]
+_SKIPS = ["I don't want to answer that", "skip this one", "I'd rather not say"]
+# Questions back to the therapist, given in place of any answer
+_QUESTIONS_BACK = ["what do you mean?", "why do you ask", "can you repeat the question"]
+
+
+def _synthetic_conversations(conversations=20, seed=11):
+    """
+    Synthetic conversations over questions_flat.json
+
+    Each is a list of {"role", "message"} entries. Some answers are vague and
+    get a follow-up, some are skipped, and some conversations stop early.
+    Every user entry carries the question it answers and whether it
+    completes it, under "_question" and "_complete", for checking results.
+    """
+    from progress_agent.progress import load_question_list
+
+    rng = random.Random(seed)
+    questions = load_question_list()
+    recorded = []
+    for _ in range(conversations):
+        history = []
+        stop = rng.randint(len(questions) // 2, len(questions))
+        for index, question in enumerate(questions[:stop]):
+            clear, vague = _ANSWERS[index]
+            history.append({"role": "assistant", "message": question})
+            roll = rng.random()
+            if roll < 0.2:
+                vague_answer = rng.choice(vague + _QUESTIONS_BACK)
+                history.append({"role": "user", "message": vague_answer, "_question": index, "_complete": False})
+                history.append({"role": "assistant", "message": "Could you tell me a bit more about that?"})
+            if roll > 0.93:
+                history.append({"role": "user", "message": rng.choice(_SKIPS), "_question": index, "_complete": True})
+            else:
+                history.append({"role": "user", "message": rng.choice(clear), "_question": index, "_complete": True})
+        recorded.append(history)
+    return recorded
+
+
+def _strip(history):
+    return [{"role": entry["role"], "message": entry["message"]} for entry in history]
+
+
+def _expected_answered(history, questions):
+    answered = {entry["_question"] for entry in history if entry.get("_complete")}
+    prefix = []
+    for index, question in enumerate(questions):
+        if index not in answered:
+            break
+        prefix.append(question)
+    return prefix
+
+
+def bench_progress_checkpoint(conversations=20):
+    """
+    Total ProgressAgent query tokens over whole conversations when progress
+    is tracked after every message, sending the full history each time vs
+    only the messages after the checkpoint.
+    """
+    from progress_agent.progress import (
+        load_question_list, full_query, incremental_query, advance_checkpoint, empty_checkpoint, has_new_answers,
+    )
+
+    questions = load_question_list()
+    full_tokens, incremental_tokens, full_calls, incremental_calls = 0, 0, 0, 0
+    for history in _synthetic_conversations(conversations):
+        checkpoint = empty_checkpoint()
+        for end in range(1, len(history) + 1):
+            messages = _strip(history[:end])
+            full_tokens += _estimate_tokens(full_query(messages))
+            full_calls += 1
+            if not has_new_answers(messages, checkpoint):
+                checkpoint = {**checkpoint, "messageCount": end}
+            else:
+                incremental_tokens += _estimate_tokens(incremental_query(messages, checkpoint, questions))
+                incremental_calls += 1
+                # stand-in for the agent: report what the new messages answer
+                answered = _expected_answered(history[:end], questions)[len(checkpoint["answeredQuestions"]):]
+                checkpoint = advance_checkpoint(checkpoint, answered, end, questions)
+        assert checkpoint["answeredQuestions"] == _expected_answered(history, questions)
+
+    print(f"progress checkpoint: {conversations} conversations, progress tracked after every message")
+    print(f"  full history: {full_calls} calls, {full_tokens} query tokens")
+    print(f"  checkpoint:   {incremental_calls} calls, {incremental_tokens} query tokens "
+          f"({full_tokens / incremental_tokens:.1f}x fewer)")
+
+
+def bench_progress_matcher(conversations=50):
+    """
+    Replays synthetic conversations through checkpointed progress tracking
+    with the local matcher as the first stage, counting the ProgressAgent
+    calls it avoids and checking its verdicts against the known truth.
+    """
+    from progress_agent.matcher import QuestionMatcher
+    from progress_agent.progress import (
+        load_question_list, settle_locally, advance_checkpoint, empty_checkpoint, has_new_answers,
+    )
+
+    questions = load_question_list()
+    matcher = QuestionMatcher.from_file()
+    calls, local, wrong, local_seconds = 0, 0, 0, 0.0
+    for history in _synthetic_conversations(conversations, seed=23):
+        checkpoint = empty_checkpoint()
+        for end in range(1, len(history) + 1):
+            messages = _strip(history[:end])
+            if not has_new_answers(messages, checkpoint):
+                checkpoint = {**checkpoint, "messageCount": end}
+                continue
+            calls += 1
+            truth = _expected_answered(history[:end], questions)
+            start = time.perf_counter()
+            answered = settle_locally(matcher, messages, checkpoint)
+            local_seconds += time.perf_counter() - start
+            if answered is None:
+                # stand-in for ProgressAgent
+                answered = truth[len(checkpoint["answeredQuestions"]):]
+            else:
+                local += 1
+            checkpoint = advance_checkpoint(checkpoint, answered, end, questions)
+            if checkpoint["answeredQuestions"] != truth:
+                wrong += 1
+                checkpoint = {**checkpoint, "answeredQuestions": truth}
+
+    print(f"progress matcher: {conversations} synthetic conversations, {calls} progress updates with new answers")
+    print(f"  settled locally: {local} ({local / calls:.0%}), ProgressAgent calls avoided")
+    print(f"  sent to agent:   {calls - local}")
+    print(f"  local mistakes:  {wrong}")
+    print(f"  local latency:   {local_seconds * 1000 / calls:.3f}ms per update")
+
+
+def bench_answer_precheck(conversations=50, hop_ms=900.0, firestore_ms=40.0):
+    """
+    Per-turn latency of /api/questions/next with every answer going through
+    AnswerReviewerAgent vs the local pre-classifier first. Model hops and
+    Firestore writes are simulated with fixed latencies; the classifier runs
+    for real. A complete answer costs the agent two model calls (review +
+    get_next_question tool round), an incomplete one three (review,
+    followUpAgent, final text).
+    """
+    from progress_agent.matcher import QuestionMatcher, COMPLETE
+
+    matcher = QuestionMatcher.from_file()
+    agent_only, with_precheck, local_times = [], [], []
+    false_advances = 0
+    for history in _synthetic_conversations(conversations, seed=5):
+        for entry in history:
+            if entry["role"] != "user":
+                continue
+            agent_turn = (2 if entry["_complete"] else 3) * hop_ms + firestore_ms
+            agent_only.append(agent_turn)
+
+            start = time.perf_counter()
+            settled = matcher.classify(entry["_question"], entry["message"]) == COMPLETE
+            classify_ms = (time.perf_counter() - start) * 1000
+            if settled:
+                local_times.append(classify_ms + firestore_ms)
+                with_precheck.append(classify_ms + firestore_ms)
+                false_advances += not entry["_complete"]
+            else:
+                with_precheck.append(classify_ms + agent_turn)
+
+    def mean(values):
+        return sum(values) / len(values) if values else 0.0
+
+    turns = len(agent_only)
+    print(f"answer precheck: {turns} answers from {conversations} synthetic conversations "
+          f"(simulated {hop_ms:.0f}ms per model hop, {firestore_ms:.0f}ms Firestore write)")
+    print(f"  agent only:    {mean(agent_only):.0f}ms per turn")
+    print(f"  with precheck: {mean(with_precheck):.0f}ms per turn, "
+          f"{len(local_times)}/{turns} turns settled locally at {mean(local_times):.1f}ms")
+    print(f"  incomplete answers advanced locally: {false_advances}")
+
+
+# Function declarations the reviewer agent sends with every request, as ADK
+# builds them from get_next_question and the followUpAgent AgentTool
+_REVIEWER_TOOLS = [
+    {"name": "get_next_question",
+     "description": "Gets the next question for a user based on their current question state. "
+                    "@PARAMS: userId (str): The ID of the user for whom to get the next question. "
+                    "Returns: Dict[str, Any]: The next question data or empty dict if no more questions are available.",
+     "parameters": {"type": "OBJECT", "properties": {"user_id": {"type": "STRING"}}, "required": ["user_id"]}},
+    {"name": "followUpAgent",
+     "description": "Generates a follow-up question based on the user's answer to a therapy question.",
+     "parameters": {"type": "OBJECT", "properties": {"request": {"type": "STRING"}}, "required": ["request"]}},
+]
+
+
+def bench_answer_review(conversations=50, hop_ms=600.0, output_token_ms=8.0):
+    """
+    Latency and tokens of the answers that reach the model (the precheck
+    could not settle them), reviewed by the tool-calling AnswerReviewerAgent
+    loop vs the single-shot verdict. Prompts are built from the real
+    instructions and queries; each model call is simulated as `hop_ms` plus
+    `output_token_ms` per generated token.
+
+    Agent loop, complete answer: review -> get_next_question call, then the
+    tool result -> final text. Incomplete: review -> followUpAgent call, the
+    follow-up agent's own call, then the tool result -> final text.
+    Single shot: one verdict call; the advance is a local lookup and a write.
+    """
+    import json
+    from progress_agent.matcher import QuestionMatcher, COMPLETE
+    from answer_review import (
+        REVIEWER_INSTRUCTION, FOLLOW_UP_INSTRUCTION, VERDICT_INSTRUCTION, verdict_query,
+    )
+
+    matcher = QuestionMatcher.from_file()
+    with open(os.path.join(BASE_DIR, "progress_agent", "questions_flat.json"), encoding="utf-8") as file:
+        items = json.load(file)["questions"]
+    tools = _estimate_tokens(json.dumps(_REVIEWER_TOOLS))
+    follow_up = "Could you tell me a bit more about that?"
+
+    def call(prompt_tokens, output_tokens):
+        return prompt_tokens, output_tokens, hop_ms + output_tokens * output_token_ms
+
+    agent_calls, single_calls = [], []
+    reviewed = 0
+    for history in _synthetic_conversations(conversations, seed=5):
+        for entry in history:
+            if entry["role"] != "user" or matcher.classify(entry["_question"], entry["message"]) == COMPLETE:
+                continue
+            reviewed += 1
+            index = entry["_question"]
+            current = {"questionText": items[index]["question"]}
+            next_text = items[index + 1]["question"] if index + 1 < len(items) else ""
+
+            query = f"\nuser_id: u123\nTherapist's question: {current['questionText']}\nUser's answer: {entry['message']}\n"
+            reviewer = _estimate_tokens(REVIEWER_INSTRUCTION) + tools + _estimate_tokens(query)
+            function_call = 20
+            if entry["_complete"]:
+                turn = [
+                    call(reviewer, function_call),
+                    call(reviewer + function_call + _estimate_tokens(next_text) + 10, _estimate_tokens(next_text)),
+                ]
+            else:
+                request = f"{current['questionText']} {entry['message']}"
+                turn = [
+                    call(reviewer, function_call + _estimate_tokens(request)),
+                    call(_estimate_tokens(FOLLOW_UP_INSTRUCTION) + _estimate_tokens(request), _estimate_tokens(follow_up)),
+                    call(reviewer + function_call + _estimate_tokens(follow_up) + 10, _estimate_tokens(follow_up)),
+                ]
+            agent_calls.append(turn)
+
+            verdict = json.dumps({"complete": entry["_complete"], "follow_up": "" if entry["_complete"] else follow_up})
+            prompt = _estimate_tokens(VERDICT_INSTRUCTION) + _estimate_tokens(
+                verdict_query(current, items[index].get("expected_answer"), entry["message"]))
+            single_calls.append([call(prompt, _estimate_tokens(verdict))])
+
+    def totals(turns):
+        calls = sum(len(turn) for turn in turns)
+        prompt = sum(hop[0] for turn in turns for hop in turn)
+        output = sum(hop[1] for turn in turns for hop in turn)
+        latency = sum(hop[2] for turn in turns for hop in turn) / len(turns)
+        return calls, prompt, output, latency
+
+    print(f"answer review: {reviewed} answers the precheck left to the model, from {conversations} synthetic "
+          f"conversations (simulated {hop_ms:.0f}ms per call + {output_token_ms:.0f}ms per output token)")
+    for label, turns in (("agent loop: ", agent_calls), ("single shot:", single_calls)):
+        calls, prompt, output, latency = totals(turns)
+        print(f"  {label} {calls} model calls, {prompt} prompt + {output} output tokens, {latency:.0f}ms per answer")
+
+
+def bench_turn(conversations=20, read_ms=40.0, write_ms=40.0, hop_ms=750.0, page_messages=200):
+    """
+    Per-turn latency and Firestore reads of /api/questions/next followed by
+    /track_progress vs one /api/turn. Firestore reads/writes and model calls
+    are simulated with fixed latencies; whether a turn needs the answer
+    review call (precheck) or the ProgressAgent call (local matcher) is
+    decided by the real classifiers over synthetic conversations.
+
+    Separate requests read the user document three times (current question,
+    history fields, checkpoint). The combined turn reads it once and loads
+    the history pages while the answer review runs.
+    """
+    import asyncio
+    import math
+    from progress_agent.matcher import QuestionMatcher, COMPLETE
+    from progress_agent.progress import load_question_list, settle_locally, advance_checkpoint, empty_checkpoint
+
+    questions = load_question_list()
+    matcher = QuestionMatcher.from_file()
+
+    async def wait(ms):
+        await asyncio.sleep(ms / 1000)
+
+    async def review(model_call):
+        if model_call:
+            await wait(hop_ms)
+        await wait(write_ms)
+
+    async def progress(pages, model_call, reads):
+        await wait(reads * read_ms + pages * read_ms)
+        if model_call:
+            await wait(hop_ms)
+        await wait(write_ms)
+
+    async def separate(pages, review_call, progress_call):
+        await wait(read_ms)
+        await review(review_call)
+        await progress(pages, progress_call, reads=2)
+
+    async def combined(pages, review_call, progress_call):
+        await wait(read_ms)
+        await asyncio.gather(review(review_call), progress(pages, progress_call, reads=0))
+
+    turns = []
+    for history in _synthetic_conversations(conversations, seed=5):
+        checkpoint = empty_checkpoint()
+        for end, entry in enumerate(history, start=1):
+            if entry["role"] != "user":
+                continue
+            messages = _strip(history[:end])
+            review_call = matcher.classify(entry["_question"], entry["message"]) != COMPLETE
+            answered = settle_locally(matcher, messages, checkpoint)
+            progress_call = answered is None
+            if answered is None:
+                answered = _expected_answered(history[:end], questions)[len(checkpoint["answeredQuestions"]):]
+            checkpoint = advance_checkpoint(checkpoint, answered, end, questions)
+            turns.append((math.ceil(end / page_messages), review_call, progress_call))
+
+    async def timed(handler, turn):
+        start = time.perf_counter()
+        await handler(*turn)
+        return (time.perf_counter() - start) * 1000
+
+    async def run(handler):
+        # Turns run concurrently, so the whole replay takes about one slow turn
+        latencies = await asyncio.gather(*(timed(handler, turn) for turn in turns))
+        return sum(latencies) / len(latencies), max(latencies)
+
+    separate_ms, separate_max = asyncio.run(run(separate))
+    combined_ms, combined_max = asyncio.run(run(combined))
+    reads = sum(pages for pages, _, _ in turns)
+    print(f"conversation turn: {len(turns)} user messages from {conversations} synthetic conversations "
+          f"(simulated {read_ms:.0f}ms Firestore read, {hop_ms:.0f}ms model call)")
+    print(f"  review calls: {sum(turn[1] for turn in turns)}, progress calls: {sum(turn[2] for turn in turns)}")
+    print(f"  next + track_progress: {3 * len(turns) + reads} user document/page reads, "
+          f"{separate_ms:.0f}ms per turn, slowest {separate_max:.0f}ms")
+    print(f"  /api/turn:             {len(turns) + reads} user document/page reads, "
+          f"{combined_ms:.0f}ms per turn, slowest {combined_max:.0f}ms")
+
+
+def bench_agent_sessions(users=100, turns=3, model_ms=200.0):
+    """
+    Concurrency check for AgentRuntime: `users` simultaneous users each run
+    `turns` messages through one shared runtime. The agent is a stand-in
+    that sleeps for `model_ms` and echoes the message and the session's
+    user, so every reply can be checked against the user that sent it.
+    Requires google-adk.
+    """
+    import asyncio
+    from google.adk.agents import BaseAgent
+    from google.adk.events import Event
+    from google.genai import types
+    from agent_runtime import AgentRuntime
+
+    class EchoAgent(BaseAgent):
+        async def _run_async_impl(self, ctx):
+            await asyncio.sleep(model_ms / 1000)
+            text = f"{ctx.session.user_id}|{ctx.session.id}|{ctx.user_content.parts[0].text}"
+            yield Event(
+                author=self.name,
+                invocation_id=ctx.invocation_id,
+                content=types.Content(role="model", parts=[types.Part(text=text)]),
+            )
+
+    runtime = AgentRuntime(EchoAgent(name="echo_agent"), "AgentSessionsBenchmark")
+
+    async def conversation(user_id):
+        sessions = set()
+        for turn in range(turns):
+            reply = await runtime.run(user_id, f"message {turn} from {user_id}")
+            replied_user, session_id, echoed = reply.split("|")
+            assert replied_user == user_id and echoed == f"message {turn} from {user_id}", reply
+            sessions.add(session_id)
+        return sessions
+
+    async def run_all():
+        return await asyncio.gather(*(conversation(f"user-{index}") for index in range(users)))
+
+    start = time.perf_counter()
+    sessions = asyncio.run(run_all())
+    elapsed = time.perf_counter() - start
+
+    # Each user keeps one session across turns, and no two users share one
+    assert all(len(user_sessions) == 1 for user_sessions in sessions)
+    assert len(set().union(*sessions)) == users
+    print(f"agent sessions: {users} simultaneous users x {turns} turns, {model_ms:.0f}ms per agent run")
+    print(f"  wall time: {elapsed * 1000:.0f}ms (serial would be {users * turns * model_ms:.0f}ms)")
+    print(f"  replies matched their user, {runtime.stats()['sessions']} sessions, none shared")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    checkpoint_parser = subparsers.add_parser("progress-checkpoint", help="full history vs checkpointed progress queries")
+    checkpoint_parser.add_argument("--conversations", type=int, default=20)
+
+    matcher_parser = subparsers.add_parser("progress-matcher", help="progress updates settled by the local matcher")
+    matcher_parser.add_argument("--conversations", type=int, default=50)
+
+    precheck_parser = subparsers.add_parser("answer-precheck", help="agent-only vs pre-classified answer review latency")
+    precheck_parser.add_argument("--conversations", type=int, default=50)
+    precheck_parser.add_argument("--hop-ms", type=float, default=900.0)
+    precheck_parser.add_argument("--firestore-ms", type=float, default=40.0)
+
+    review_parser = subparsers.add_parser("answer-review", help="agent loop vs single-shot answer review")
+    review_parser.add_argument("--conversations", type=int, default=50)
+    review_parser.add_argument("--hop-ms", type=float, default=600.0)
+    review_parser.add_argument("--output-token-ms", type=float, default=8.0)
+
+    turn_parser = subparsers.add_parser("turn", help="separate next-question and progress requests vs /api/turn")
+    turn_parser.add_argument("--conversations", type=int, default=20)
+    turn_parser.add_argument("--read-ms", type=float, default=40.0)
+    turn_parser.add_argument("--write-ms", type=float, default=40.0)
+    turn_parser.add_argument("--hop-ms", type=float, default=750.0)
+
+    sessions_parser = subparsers.add_parser("agent-sessions", help="simultaneous users through one AgentRuntime")
+    sessions_parser.add_argument("--users", type=int, default=100)
+    sessions_parser.add_argument("--turns", type=int, default=3)
+    sessions_parser.add_argument("--model-ms", type=float, default=200.0)
+
+    args = parser.parse_args()
+    if args.command == "progress-checkpoint":
+        bench_progress_checkpoint(args.conversations)
+    elif args.command == "progress-matcher":
+        bench_progress_matcher(args.conversations)
+    elif args.command == "answer-precheck":
+        bench_answer_precheck(args.conversations, args.hop_ms, args.firestore_ms)
+    elif args.command == "answer-review":
+        bench_answer_review(args.conversations, args.hop_ms, args.output_token_ms)
+    elif args.command == "turn":
+        bench_turn(args.conversations, args.read_ms, args.write_ms, args.hop_ms)
+    elif args.command == "agent-sessions":
+        bench_agent_sessions(args.users, args.turns, args.model_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
+import asyncio
 import logging
 from next_ques_agent.tools import FirebaseQuestionManager
 from dotenv import load_dotenv
 from next_ques_agent.agent import analyze_user_response
-from progress_agent.agent import track_progress
+from progress_agent.agent import track_progress_incremental
+from progress_agent.progress import history_start, read_checkpoint
 import json
 
 load_dotenv()  # Load environment variables from .env file
@@ -70,6 +72,15 @@ def validate_user_id(user_id):
     return user_id.strip()
 
 
+# Utility function to read a boolean flag; JSON true, "true" and "1" count as set
+def parse_flag(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1")
+    return value == 1
+
+
 @app.route("/", methods=["GET"])
 def health_check():
     """Health check endpoint"""
@@ -89,6 +100,8 @@ async def track_progress_route():
 
     Expects JSON body with:
         user_id (str): User ID to track progress for
+        full (bool): Recompute from the whole history instead of the
+            stored checkpoint (optional)
 
     Returns:
         JSON response with progress tracking result
@@ -102,10 +115,11 @@ async def track_progress_route():
         user_id = data.get("user_id")
         user_id = validate_user_id(user_id)
 
-        # Import track_progress function
+        full = parse_flag(data.get("full", False))
 
-        # Get message history from Firebase
-        message_history = question_manager.getMessageHistory(user_id)
+        # Get the last checkpoint and the message history after it from Firebase
+        checkpoint = read_checkpoint(question_manager.getProgressCheckpoint(user_id))
+        message_history = read_progress_history(user_id, checkpoint, full=full)
 
         if not message_history:
             return (
@@ -115,17 +129,13 @@ async def track_progress_route():
                 404,
             )
 
-        # Call track_progress function
-        progress_result = await track_progress(user_id, message_history)
-        if type(progress_result) is str:
-            try:
-                progress_result = json.loads(progress_result)
-            except json.JSONDecodeError:
-                progress_result = {"answered_questions": []}
-        # Update progress field in Firebase
-        question_manager.updateProgress(
-            user_id, progress_result.get("answered_questions", []).__len__()
+        # Only the messages after the checkpoint go to the progress agent
+        progress_result, new_checkpoint = await track_progress_incremental(
+            user_id, message_history, checkpoint, full=full
         )
+        # Update progress field and checkpoint in Firebase
+        if new_checkpoint != checkpoint:
+            question_manager.saveProgressCheckpoint(user_id, new_checkpoint)
 
         return jsonify(
             {
@@ -216,7 +226,9 @@ async def get_next_question(user_id):
             # Get next question
             next_question = question_manager.getNextQuestion(user_id)
         else:
-            next_question = await analyze_user_response(user_id, user_response or "")
+            next_question = await analyze_user_response(
+                user_id, user_response or "", current_question=current_question
+            )
 
         if next_question:
             return jsonify(
@@ -248,6 +260,120 @@ async def get_next_question(user_id):
         )
 
 
+def read_progress_history(user_id, checkpoint, user_data=None, full=False):
+    """
+    Message history for a progress update
+
+    Only the messages from the checkpoint on (and the context before them)
+    are decrypted; the earlier ones are None. A history shorter than the
+    checkpoint was rewritten and is read again in full.
+    """
+    start = history_start(checkpoint, full)
+    message_history = question_manager.getMessageHistory(user_id, user_data, start=start)
+    if start and message_history is not None and len(message_history) < checkpoint["messageCount"]:
+        message_history = question_manager.getMessageHistory(user_id, user_data)
+    return message_history
+
+
+async def turn_progress(user_id, user_data):
+    """
+    Progress update for a turn, from the already loaded user document
+
+    History pages are read and decrypted in a worker thread so the answer
+    review runs meanwhile. A failure here is logged and does not fail the turn.
+
+    Returns:
+        tuple: (progress result or None, checkpoint to store)
+    """
+    checkpoint = read_checkpoint(user_data)
+    try:
+        message_history = await asyncio.to_thread(
+            read_progress_history, user_id, checkpoint, user_data
+        )
+        if not message_history:
+            return None, checkpoint
+        return await track_progress_incremental(user_id, message_history, checkpoint)
+    except Exception as e:
+        logger.error(f"Error tracking progress for user {user_id}: {e}")
+        return None, checkpoint
+
+
+@app.route("/api/turn/<user_id>", methods=["POST"])
+async def conversation_turn(user_id):
+    """
+    Handle one conversation turn: review the user's answer, advance the
+    question and update progress, from a single read of the user document
+
+    The user's message is expected to be in their history already, as for
+    /track_progress. Progress is computed concurrently with the answer review.
+
+    Args:
+        user_id (str): User ID from URL path
+        user_response (str): User's response to the current question (optional)
+    Returns:
+        JSON response with the next question and progress, or error
+    """
+    try:
+        # Validate user_id
+        user_id = validate_user_id(user_id)
+        user_response = (
+            request.json.get("user_response", "").strip() if request.json else ""
+        )
+
+        user_data = question_manager.getTurnState(user_id)
+        if user_data is None:
+            return (
+                jsonify({"success": False, "data": None, "message": "User not found"}),
+                404,
+            )
+        current_question = question_manager.currentQuestionFrom(user_data)
+        checkpoint = read_checkpoint(user_data)
+
+        # Firestore calls run in worker threads so they do not hold up the
+        # progress update gathered alongside the review
+        async def review():
+            if not current_question:
+                return await asyncio.to_thread(question_manager.getNextQuestion, user_id, {})
+            return await analyze_user_response(
+                user_id, user_response or "", current_question=current_question
+            )
+
+        next_question, (progress_result, new_checkpoint) = await asyncio.gather(
+            review(), turn_progress(user_id, user_data)
+        )
+        # Update progress field and checkpoint in Firebase
+        if new_checkpoint != checkpoint:
+            question_manager.saveProgressCheckpoint(user_id, new_checkpoint)
+
+        progress = None
+        if progress_result is not None:
+            answered_questions = progress_result.get("answered_questions", [])
+            progress = {
+                "count": len(answered_questions),
+                "answered_questions": answered_questions,
+            }
+
+        return jsonify(
+            {
+                "success": True,
+                "data": {
+                    "next_question": next_question or None,
+                    "progress": progress,
+                },
+                "message": "Turn processed successfully",
+            }
+        )
+
+    except ValidationError as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Error processing turn for user {user_id}: {e}")
+        return (
+            jsonify({"success": False, "error": "Failed to process turn"}),
+            500,
+        )
+
+
 # Initialize the question manager when the app starts
 @app.before_request
 def startup():
@@ -1,22 +1,32 @@
 from google.adk.agents import LlmAgent, SequentialAgent
 from google.adk.tools.agent_tool import AgentTool
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.genai import types
-from .tools import get_next_question, get_current_question
+from pydantic import BaseModel
+from .tools import get_next_question, get_current_question, question_manager
+from answer_review import REVIEWER_INSTRUCTION, FOLLOW_UP_INSTRUCTION, VERDICT_INSTRUCTION, verdict_query, parse_verdict
+from progress_agent.matcher import QuestionMatcher, COMPLETE
+from agent_runtime import AgentRuntime
 from dotenv import load_dotenv
+import asyncio
+import os
 
 load_dotenv()
 
 GEMINI_MODEL = "gemini-2.0-flash"
 
+# Advance clearly complete answers locally instead of running AnswerReviewerAgent
+ANSWER_PRECHECK = os.getenv("ANSWER_PRECHECK", "true").lower() == "true"
+
+# How answers the precheck cannot settle are reviewed:
+#   "agent"       - the tool-calling AnswerReviewerAgent loop (default)
+#   "single_shot" - one structured {complete, follow_up} verdict call, with the
+#                   question advance done here instead of by a tool call; opt-in
+ANSWER_REVIEW_MODE = os.getenv("ANSWER_REVIEW_MODE", "agent").lower()
+
 
 follow_up_generator = LlmAgent(
     name="followUpAgent",
     model=GEMINI_MODEL,
-    instruction="""
-You are a follow-up question generator AI. The user has answered a question asked by the therapist, but not completely. Your task is to generate a follow-up question based on the user's answer to a therapy question. 
-""",
+    instruction=FOLLOW_UP_INSTRUCTION,
     description="Generates a follow-up question based on the user's answer to a therapy question.",
     output_key="follow_up",  # Stores output in state['follow_up']
 )
@@ -24,14 +34,7 @@ You are a follow-up question generator AI. The user has answered a question aske
 answer_reviewer_agent = LlmAgent(
     name="AnswerReviewerAgent",
     model=GEMINI_MODEL,
-    instruction="""
-You are a helper agent to a mental therapist. The mental therapist has asked the user some question, and the user has provided an answer. Your task is to review the user's answer and tell if the answer is complete or not. That is, you have to check if the user has answered all parts of the question asked by the therapist.
-If the answer is not complete, call the follow_up_generator agent tool to generate a follow-up question based on the user's answer. Provide the therapist's question and user's answer as it is to the follow_up_generator tool (provide it as a single string).
-
-If the answer is complete and satisfactory, (or the user tells they don't want to answer the question) call the get_next_question tool to get the next question for the user. If the next question is not available, return empty string.
-
-return only the question to be asked as a string and nothing else or empty string if no question provided.
-""",
+    instruction=REVIEWER_INSTRUCTION,
     description="Reviews user provided answers to therapy questions and determines if they are complete and provides the next question if available",
     output_key="answer_review",
     tools=[
@@ -41,39 +44,112 @@ return only the question to be asked as a string and nothing else or empty strin
 )
 
 
+class AnswerVerdict(BaseModel):
+    complete: bool
+    follow_up: str
+
+
+answer_verdict_agent = LlmAgent(
+    name="AnswerVerdictAgent",
+    model=GEMINI_MODEL,
+    instruction=VERDICT_INSTRUCTION,
+    description="Decides in one call whether the user's answer is complete, with a follow-up question if it is not",
+    output_key="answer_verdict",
+    output_schema=AnswerVerdict,
+)
+
+
 # For ADK tools compatibility, the root agent must be named `root_agent`
 root_agent = answer_reviewer_agent
 
 
+# One Runner per process; each user gets their own session
+agent_runtime = AgentRuntime(root_agent, "TherapistQuestionManager")
+
+
+# Verdicts are self-contained, so every run starts a fresh session
+verdict_runtime = AgentRuntime(answer_verdict_agent, "AnswerVerdict", max_session_events=0)
+
+
 # Agent Interaction
-async def call_agent(query):
-    APP_NAME = "TherapistQuestionManager"
-    USER_ID = "user1234"
-    SESSION_ID = "1234"
-
-    # Session and Runner
-    session_service = InMemorySessionService()
-    session = await session_service.create_session(
-        app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID
-    )
-    runner = Runner(
-        agent=root_agent, app_name=APP_NAME, session_service=session_service
-    )
-
-    content = types.Content(role="user", parts=[types.Part(text=query)])
-    events = runner.run(user_id=USER_ID, session_id=SESSION_ID, new_message=content)
-
-    for event in events:
-        if event.is_final_response():
-            final_response = event.content.parts[0].text
-            return final_response
-
-
-async def analyze_user_response(user_id, user_response):
+async def call_agent(user_id, query):
+    return await agent_runtime.run(user_id, query)
+
+
+def expected_answer(current_question):
+    """The expected_answer of the current question in questions.json, if known"""
+    theme_questions = question_manager.questions_data.get((current_question or {}).get("questionTheme")) or []
+    index = (current_question or {}).get("questionIndex")
+    if isinstance(index, int) and 0 <= index < len(theme_questions):
+        return theme_questions[index].get("expected_answer")
+    return None
+
+
+async def review_single_shot(user_id, user_response, current_question):
+    """
+    Reviews the answer with one structured verdict call
+
+    The next question is worked out up front from the loaded questions, so
+    a complete answer is advanced here rather than through a get_next_question
+    tool round, and an incomplete one returns the verdict's follow-up.
+
+    Returns:
+        Optional[str]: The question to ask next ("" if all are done), or None
+        if the model's reply was not a usable verdict
+    """
+    next_question = question_manager.peekNextQuestion(current_question)
+    query = verdict_query(current_question, expected_answer(current_question), user_response)
+    verdict = parse_verdict(await verdict_runtime.run(user_id, query))
+    if verdict is None:
+        return None
+    if not verdict["complete"]:
+        return verdict["follow_up"]
+    if next_question is None:
+        return ""
+    await asyncio.to_thread(question_manager.saveCurrentQuestion, user_id, next_question)
+    return next_question["questionText"]
+
+
+# One matcher per questionnaire theme, built on first use
+_theme_matchers = {}
+
+
+def precheck_answer(current_question, user_response) -> bool:
+    """
+    Returns True if the answer clearly completes the current question: a
+    refusal, or an answer matching the question's expected_answer shape.
+    Anything else (incomplete, uncertain or unknown question) is False and
+    goes to AnswerReviewerAgent.
+    """
+    theme = (current_question or {}).get("questionTheme")
+    index = (current_question or {}).get("questionIndex")
+    theme_questions = question_manager.questions_data.get(theme)
+    if not theme_questions or not isinstance(index, int) or not 0 <= index < len(theme_questions):
+        return False
+    matcher = _theme_matchers.get(theme)
+    if matcher is None:
+        matcher = _theme_matchers[theme] = QuestionMatcher(theme_questions)
+    return matcher.classify(index, user_response) == COMPLETE
+
+
+async def analyze_user_response(user_id, user_response, current_question=None):
+    # Firestore calls are blocking, so they run in worker threads and the
+    # event loop stays free for work gathered alongside, e.g. /api/turn's progress update
+    current_question = current_question or await asyncio.to_thread(get_current_question, user_id) or {}
+    if ANSWER_PRECHECK and precheck_answer(current_question, user_response):
+        # Clear answer: advance without the review / follow-up / tool-call hops
+        return await asyncio.to_thread(question_manager.getNextQuestion, user_id, current_question) or ""
+
+    if ANSWER_REVIEW_MODE == "single_shot":
+        res = await review_single_shot(user_id, user_response, current_question)
+        if res is not None:
+            return res
+        # Unusable verdict: fall back to the agent loop
+
     query = f"""
 user_id: {user_id}
-Therapist's question: {get_current_question(user_id).get('questionText', '')}
+Therapist's question: {current_question.get('questionText', '')}
 User's answer: {user_response}
 """
-    res = await call_agent(query)
+    res = await call_agent(user_id, query)
     return res
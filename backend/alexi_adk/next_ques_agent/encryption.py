@@ -2,16 +2,42 @@ import os
 import base64
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 import secrets
+import threading
+import time
+import atexit
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 # Get master key from environment variable
 MASTER_KEY = os.getenv('NEXT_PUBLIC_ENCRYPTION_KEY')
 
-def derive_key(password: str, salt: bytes) -> bytes:
+# Derived key cache configuration
+KEY_CACHE_MAX_ENTRIES = int(os.getenv('KEY_CACHE_MAX_ENTRIES', 4096))
+KEY_CACHE_IDLE_SECONDS = float(os.getenv('KEY_CACHE_IDLE_SECONDS', 900))
+
+# Bulk decryption configuration
+DECRYPT_POOL_WORKERS = int(os.getenv('DECRYPT_POOL_WORKERS', os.cpu_count() or 1))
+DECRYPT_POOL_MIN_BATCH = int(os.getenv('DECRYPT_POOL_MIN_BATCH', 8))
+
+# Marker returned in place of items that could not be decrypted
+DECRYPT_FAILED_MARKER = "[ENCRYPTED_DATA_COULD_NOT_DECRYPT]"
+
+# v2 envelope: version byte + nonce + AES-GCM payload under a per-user data key.
+# Legacy v1 blobs (salt + nonce + payload) carry no version byte.
+ENVELOPE_V2 = 2
+
+# User document field holding the per-user data key, wrapped as a v1 blob
+WRAPPED_DATA_KEY_FIELD = 'wrappedDataKey'
+
+
+def _derive_key_uncached(password: str, salt: bytes) -> bytes:
     """
-    Derives a crypto key from a password using PBKDF2
+    Derives a crypto key from a password using PBKDF2, bypassing the cache
     
     Args:
         password: The password string
@@ -29,6 +55,109 @@ def derive_key(password: str, salt: bytes) -> bytes:
     )
     return kdf.derive(password.encode('utf-8'))
 
+class DerivedKeyCache:
+    """
+    Bounded, thread-safe LRU cache of PBKDF2 derived keys keyed on (password, salt).
+
+    Entries that have not been used for `idle_seconds` are treated as expired
+    and dropped on the next lookup or insert.
+    """
+
+    def __init__(self, max_entries: int = KEY_CACHE_MAX_ENTRIES, idle_seconds: float = KEY_CACHE_IDLE_SECONDS):
+        self.max_entries = max_entries
+        self.idle_seconds = idle_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, password: str, salt: bytes) -> bytes:
+        """
+        Returns the derived key for (password, salt), deriving and caching it on a miss
+        """
+        key = self.lookup(password, salt)
+        if key is not None:
+            return key
+
+        # Derive outside the lock so concurrent misses don't serialize on PBKDF2
+        key = _derive_key_uncached(password, salt)
+        self.put(password, salt, key)
+        return key
+
+    def lookup(self, password: str, salt: bytes):
+        """
+        Returns the cached key for (password, salt) or None, counting a hit or miss
+        """
+        cache_key = (password, bytes(salt))
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and now - entry[1] <= self.idle_seconds:
+                self._entries[cache_key] = (entry[0], now)
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, password: str, salt: bytes, key: bytes) -> None:
+        """Stores a key derived elsewhere (e.g. in a worker process)"""
+        if self.max_entries <= 0:
+            return
+
+        cache_key = (password, bytes(salt))
+        now = time.monotonic()
+        with self._lock:
+            self._entries[cache_key] = (key, now)
+            self._entries.move_to_end(cache_key)
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        # Oldest entries sit at the front, so stop at the first one still fresh
+        while self._entries:
+            oldest_key, (_, last_used) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - last_used <= self.idle_seconds:
+                break
+            del self._entries[oldest_key]
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Drops all cached keys and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters and the current cache size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+# Process-wide cache shared by every decrypt() call
+key_cache = DerivedKeyCache()
+
+def derive_key(password: str, salt: bytes) -> bytes:
+    """
+    Derives a crypto key from a password using PBKDF2, reusing cached keys
+    
+    Args:
+        password: The password string
+        salt: Random salt bytes
+        
+    Returns:
+        bytes: 32-byte derived key
+    """
+    return key_cache.get(password, salt)
+
 def encrypt(data: str, encryption_key: str) -> str:
     """
     Encrypts data using AES-GCM
@@ -50,8 +179,9 @@ def encrypt(data: str, encryption_key: str) -> str:
     salt = secrets.token_bytes(16)  # 16 bytes salt
     nonce = secrets.token_bytes(12)  # 12 bytes nonce for AES-GCM
     
-    # Derive key from password
-    key = derive_key(encryption_key, salt)
+    # Derive key from password; the salt is fresh, so caching it would only
+    # push keys that decrypt() reuses out of the cache
+    key = _derive_key_uncached(encryption_key, salt)
     
     # Create AESGCM instance and encrypt
     aesgcm = AESGCM(key)
@@ -63,13 +193,14 @@ def encrypt(data: str, encryption_key: str) -> str:
     # Convert to base64 for easy storage/transmission
     return base64.b64encode(combined).decode('utf-8')
 
-def decrypt(encrypted_data: str, encryption_key: str) -> str:
+def decrypt(encrypted_data: str, encryption_key: str, data_key: bytes = None) -> str:
     """
-    Decrypts data using AES-GCM
+    Decrypts data using AES-GCM, accepting both v2 envelopes and legacy v1 blobs
     
     Args:
         encrypted_data: Base64 encoded encrypted data
         encryption_key: The password/key used for encryption
+        data_key: The user's unwrapped data key, required to read v2 envelopes
         
     Returns:
         str: The decrypted string
@@ -84,11 +215,14 @@ def decrypt(encrypted_data: str, encryption_key: str) -> str:
     try:
         # Convert from base64
         combined = base64.b64decode(encrypted_data.encode('utf-8'))
+
+        # v2 envelopes only need AES-GCM under the data key
+        decrypted = _try_decrypt_v2(combined, data_key)
+        if decrypted is not None:
+            return decrypted
         
         # Extract salt, nonce, and encrypted data
-        salt = combined[:16]
-        nonce = combined[16:28]
-        encrypted = combined[28:]
+        salt, nonce, encrypted = _split_v1(combined)
         
         # Derive key from password
         key = derive_key(encryption_key, salt)
@@ -102,5 +236,226 @@ def decrypt(encrypted_data: str, encryption_key: str) -> str:
     except Exception as error:
         raise Exception(f'Decryption failed: Invalid data or wrong key - {str(error)}')
 
+def _split_v1(combined: bytes):
+    """Splits a decoded v1 blob into (salt, nonce, encrypted)"""
+    return combined[:16], combined[16:28], combined[28:]
+
+def _split_blob(encrypted_data: str):
+    """Splits a base64 v1 blob into (salt, nonce, encrypted)"""
+    return _split_v1(base64.b64decode(encrypted_data.encode('utf-8')))
+
+def _try_decrypt_v2(combined: bytes, data_key: bytes):
+    """
+    Decrypts a decoded v2 envelope, returning None if it is not one.
+
+    A v1 salt can start with the version byte by chance, so an envelope that
+    fails authentication is handed back to the v1 path instead of raising.
+    """
+    if data_key is None or len(combined) < 13 or combined[0] != ENVELOPE_V2:
+        return None
+    try:
+        return AESGCM(data_key).decrypt(combined[1:13], combined[13:], None).decode('utf-8')
+    except InvalidTag:
+        return None
+
+def is_v2(encrypted_data: str) -> bool:
+    """Returns True if the blob starts with the v2 version byte"""
+    try:
+        combined = base64.b64decode(encrypted_data.encode('utf-8'))
+    except Exception:
+        return False
+    return len(combined) > 13 and combined[0] == ENVELOPE_V2
+
+def encrypt_v2(data: str, data_key: bytes) -> str:
+    """
+    Encrypts data into a v2 envelope using the user's data key
+    
+    Args:
+        data: The string data to encrypt
+        data_key: The user's unwrapped 32-byte data key
+        
+    Returns:
+        str: Base64 encoded version byte + nonce + encrypted data
+        
+    Raises:
+        ValueError: If data or data_key is empty
+    """
+    if not data or not data_key:
+        raise ValueError('Data and data key are required')
+
+    return encrypt_v2_bytes(data.encode('utf-8'), data_key)
+
+def encrypt_v2_bytes(data: bytes, data_key: bytes) -> str:
+    """Encrypts raw bytes into a base64 v2 envelope"""
+    nonce = secrets.token_bytes(12)
+    encrypted = AESGCM(data_key).encrypt(nonce, data, None)
+    return base64.b64encode(bytes([ENVELOPE_V2]) + nonce + encrypted).decode('utf-8')
+
+def decrypt_v2_bytes(encrypted_data: str, data_key: bytes) -> bytes:
+    """
+    Decrypts a base64 v2 envelope back to raw bytes
+    
+    Raises:
+        ValueError: If the blob is not a v2 envelope
+        InvalidTag: If the data key is wrong or the blob was tampered with
+    """
+    combined = base64.b64decode(encrypted_data.encode('utf-8'))
+    if len(combined) < 13 or combined[0] != ENVELOPE_V2:
+        raise ValueError('Not a v2 envelope')
+    return AESGCM(data_key).decrypt(combined[1:13], combined[13:], None)
+
+def generate_data_key() -> bytes:
+    """Generates a random 256-bit per-user data key"""
+    return AESGCM.generate_key(bit_length=256)
+
+def wrap_data_key(data_key: bytes, encryption_key: str) -> str:
+    """
+    Wraps a data key as a v1 blob so it can be stored on the user document
+    
+    Args:
+        data_key: The raw data key
+        encryption_key: The password/key the user's data is encrypted with
+        
+    Returns:
+        str: Base64 encoded wrapped key
+    """
+    return encrypt(base64.b64encode(data_key).decode('utf-8'), encryption_key)
+
+def unwrap_data_key(wrapped_key: str, encryption_key: str) -> bytes:
+    """
+    Unwraps a data key produced by wrap_data_key(). The PBKDF2 step goes
+    through the key cache, so repeated unwraps for a user are cheap.
+    """
+    return base64.b64decode(decrypt(wrapped_key, encryption_key))
+
+def get_user_data_key(user_data: dict, encryption_key: str):
+    """
+    Returns the unwrapped data key stored on a user document, or None if the
+    user has not been migrated to v2 or the key cannot be unwrapped
+    """
+    wrapped_key = (user_data or {}).get(WRAPPED_DATA_KEY_FIELD)
+    if not wrapped_key or not encryption_key:
+        return None
+    try:
+        return unwrap_data_key(wrapped_key, encryption_key)
+    except Exception as error:
+        print(f"Failed to unwrap data key: {error}")
+        return None
+
+def _decrypt_in_worker(encrypted_data: str, encryption_key: str):
+    """
+    Process pool task: derives the key and decrypts one item.
+
+    Returns (plaintext, salt, key, error) so the parent process can warm its
+    own key cache; plaintext and key are None when decryption fails.
+    """
+    try:
+        salt, nonce, encrypted = _split_blob(encrypted_data)
+        key = _derive_key_uncached(encryption_key, salt)
+        decrypted = AESGCM(key).decrypt(nonce, encrypted, None)
+        return decrypted.decode('utf-8'), salt, key, None
+    except Exception as error:
+        return None, None, None, str(error)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    """Lazily creates the process pool shared by all decrypt_many() calls"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn keeps workers free of the parent's gRPC/event-loop threads
+            _pool = ProcessPoolExecutor(
+                max_workers=DECRYPT_POOL_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+def _shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+atexit.register(_shutdown_pool)
+
+def decrypt_many(encrypted_items: list, encryption_key: str, failure_marker: str = DECRYPT_FAILED_MARKER, data_key: bytes = None) -> list:
+    """
+    Decrypts a list of AES-GCM blobs that share one key, spreading the
+    PBKDF2 and AES-GCM work over a process pool
+    
+    Args:
+        encrypted_items: Base64 encoded encrypted blobs (v1 or v2)
+        encryption_key: The password/key used for encryption
+        failure_marker: Value returned for items that cannot be decrypted
+        data_key: The user's unwrapped data key, required to read v2 envelopes
+        
+    Returns:
+        list: Decrypted strings in the same order as encrypted_items
+        
+    Raises:
+        ValueError: If encryption_key is empty
+    """
+    if not encryption_key:
+        raise ValueError('Encryption key is required')
+
+    results = [failure_marker] * len(encrypted_items)
+    pending = []
+
+    # Serve v2 envelopes and anything whose key is already cached without
+    # leaving the process
+    for index, encrypted_data in enumerate(encrypted_items):
+        if not encrypted_data:
+            continue
+        try:
+            combined = base64.b64decode(encrypted_data.encode('utf-8'))
+            decrypted = _try_decrypt_v2(combined, data_key)
+        except Exception as error:
+            print(f"Failed to decrypt item {index}: {error}")
+            continue
+        if decrypted is not None:
+            results[index] = decrypted
+            continue
+        salt, nonce, encrypted = _split_v1(combined)
+        key = key_cache.lookup(encryption_key, salt)
+        if key is None:
+            pending.append(index)
+            continue
+        try:
+            results[index] = AESGCM(key).decrypt(nonce, encrypted, None).decode('utf-8')
+        except Exception as error:
+            print(f"Failed to decrypt item {index}: {error}")
+
+    if not pending:
+        return results
+
+    pending_items = [encrypted_items[index] for index in pending]
+    if len(pending) < DECRYPT_POOL_MIN_BATCH or DECRYPT_POOL_WORKERS <= 1:
+        outcomes = [_decrypt_in_worker(item, encryption_key) for item in pending_items]
+    else:
+        chunksize = max(1, len(pending) // (DECRYPT_POOL_WORKERS * 4))
+        outcomes = _get_pool().map(
+            _decrypt_in_worker,
+            pending_items,
+            [encryption_key] * len(pending_items),
+            chunksize=chunksize,
+        )
+
+    for index, (plaintext, salt, key, error) in zip(pending, outcomes):
+        if error is not None:
+            print(f"Failed to decrypt item {index}: {error}")
+            continue
+        key_cache.put(encryption_key, salt, key)
+        results[index] = plaintext
+
+    return results
+
 # Export the functions and master key
-__all__ = ['encrypt', 'decrypt', 'MASTER_KEY']
\ No newline at end of file
+__all__ = [
+    'encrypt', 'decrypt', 'decrypt_many', 'encrypt_v2', 'is_v2',
+    'encrypt_v2_bytes', 'decrypt_v2_bytes',
+    'generate_data_key', 'wrap_data_key', 'unwrap_data_key', 'get_user_data_key',
+    'key_cache', 'DECRYPT_FAILED_MARKER', 'WRAPPED_DATA_KEY_FIELD', 'MASTER_KEY',
+]
\ No newline at end of file
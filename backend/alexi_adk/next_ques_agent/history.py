@@ -0,0 +1,213 @@
+import os
+import json
+import zlib
+
+from .encryption import decrypt_many, encrypt_v2_bytes, decrypt_v2_bytes, DECRYPT_FAILED_MARKER
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Packed history configuration
+HISTORY_SEGMENT_MAX_MESSAGES = int(os.getenv('HISTORY_SEGMENT_MAX_MESSAGES', 50))
+HISTORY_SEGMENT_CODEC = os.getenv('HISTORY_SEGMENT_CODEC', 'zlib')
+
+# userHistory entries holding a packed segment instead of a single message
+SEGMENT_FIELD = 'encryptedSegment'
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    return zlib.compress(data, 9)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read zstd history segments')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def is_segment(entry) -> bool:
+    """Returns True if a userHistory entry is a packed segment"""
+    return isinstance(entry, dict) and bool(entry.get(SEGMENT_FIELD))
+
+
+def pack_segment(messages: list, data_key: bytes, sealed: bool = False, codec: str = None) -> dict:
+    """
+    Packs decrypted history entries ({"message", "role", ...}) into one
+    compressed segment encrypted once under the user's data key
+
+    Args:
+        messages: Decrypted history entries, oldest first
+        data_key: The user's unwrapped data key
+        sealed: Whether the segment is full and must not be appended to
+        codec: "zlib" or "zstd"; defaults to HISTORY_SEGMENT_CODEC
+
+    Returns:
+        dict: A userHistory entry holding the segment
+    """
+    codec = codec or HISTORY_SEGMENT_CODEC
+    if codec == 'zstd' and zstandard is None:
+        codec = 'zlib'
+
+    payload = json.dumps(messages, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return {
+        SEGMENT_FIELD: encrypt_v2_bytes(_compress(payload, codec), data_key),
+        'codec': codec,
+        'count': len(messages),
+        'sealed': sealed,
+    }
+
+
+def unpack_segment(segment: dict, data_key: bytes) -> list:
+    """
+    Decrypts and decompresses a segment back into its history entries
+
+    Raises:
+        Exception: If the data key is missing/wrong or the segment is corrupt
+    """
+    if data_key is None:
+        raise ValueError('Data key is required to read history segments')
+    compressed = decrypt_v2_bytes(segment[SEGMENT_FIELD], data_key)
+    return json.loads(_decompress(compressed, segment.get('codec', 'zlib')))
+
+
+def decode_history(user_history: list, encryption_key: str, data_key: bytes = None) -> list:
+    """
+    Decrypts a userHistory array that may mix legacy per-message entries and
+    packed segments, returning the flat list of entries in order
+
+    All legacy messages go through one decrypt_many() call and each segment
+    is decrypted and decompressed once. A segment that cannot be read is
+    replaced by one DECRYPT_FAILED_MARKER entry per message it holds, so
+    message counts and indexes stay the same.
+    """
+    encrypted_messages = [
+        entry['encryptedMessage'] for entry in user_history
+        if isinstance(entry, dict) and entry.get('encryptedMessage') and not is_segment(entry)
+    ]
+    decrypted_messages = iter(decrypt_many(encrypted_messages, encryption_key, data_key=data_key))
+
+    decoded = []
+    for entry in user_history:
+        if is_segment(entry):
+            try:
+                decoded.extend(unpack_segment(entry, data_key))
+            except Exception as error:
+                print(f"Failed to decrypt history segment: {error}")
+                decoded.extend({'message': DECRYPT_FAILED_MARKER} for _ in range(_entry_size(entry) or 1))
+        elif isinstance(entry, dict):
+            decoded_entry = {}
+            for key, value in entry.items():
+                if key == 'encryptedMessage' and value:
+                    decoded_entry['message'] = next(decrypted_messages)
+                else:
+                    decoded_entry[key] = value
+            decoded.append(decoded_entry)
+        else:
+            # If entry is not a dict, keep as-is
+            decoded.append(entry)
+    return decoded
+
+
+def iter_decoded_history(pages, encryption_key: str, data_key: bytes = None, start: int = 0):
+    """
+    Decrypts history one page at a time, yielding entries in order
+
+    Args:
+        pages: Iterable of raw userHistory entry lists, e.g. from the
+            repository's paged history reader
+        encryption_key: The user's email, used for legacy v1 messages
+        data_key: The user's unwrapped data key, if any
+        start: Entries before this index are yielded as None without being
+            decrypted, e.g. the messages a progress checkpoint already covers
+
+    Each page goes through decode_history(), so a caller that stops
+    iterating early never reads or decrypts the remaining pages.
+    """
+    position = 0
+    for page in pages:
+        skipped = 0
+        for entry in page:
+            size = _entry_size(entry)
+            # A segment reaching past `start` is decoded as a whole
+            if size is None or position + size > start:
+                break
+            position += size
+            skipped += 1
+            yield from [None] * size
+        decoded = decode_history(page[skipped:], encryption_key, data_key)
+        position += len(decoded)
+        yield from decoded
+
+
+def _entry_size(entry):
+    # Number of messages an undecoded userHistory entry holds, None if unknown
+    if is_segment(entry):
+        return entry.get('count')
+    return 1
+
+
+def pack_history(user_history: list, encryption_key: str, data_key: bytes, max_messages: int = None,
+                 codec: str = None) -> list:
+    """
+    Folds runs of legacy per-message entries into packed segments
+
+    Sealed segments are kept as they are. The trailing open segment is
+    reopened and topped up with the messages appended after it, and a
+    segment is sealed as soon as it holds max_messages entries. Entries that
+    cannot be decrypted are left in place as legacy entries. New segments
+    use `codec`, defaulting to HISTORY_SEGMENT_CODEC.
+
+    Returns:
+        list: The new userHistory array
+    """
+    max_messages = max_messages or HISTORY_SEGMENT_MAX_MESSAGES
+
+    encrypted_messages = [
+        entry['encryptedMessage'] for entry in user_history
+        if isinstance(entry, dict) and entry.get('encryptedMessage') and not is_segment(entry)
+    ]
+    decrypted_messages = iter(decrypt_many(encrypted_messages, encryption_key, data_key=data_key))
+
+    packed = []
+    run = []
+
+    def flush(final=False):
+        while len(run) >= max_messages:
+            packed.append(pack_segment(run[:max_messages], data_key, sealed=True, codec=codec))
+            del run[:max_messages]
+        if run and final:
+            packed.append(pack_segment(run, data_key, sealed=False, codec=codec))
+            run.clear()
+
+    for entry in user_history:
+        if is_segment(entry):
+            if entry.get('sealed'):
+                flush(final=True)
+                packed.append(entry)
+            else:
+                run.extend(unpack_segment(entry, data_key))
+                flush()
+        elif isinstance(entry, dict) and entry.get('encryptedMessage'):
+            message = next(decrypted_messages)
+            if message == DECRYPT_FAILED_MARKER:
+                flush(final=True)
+                packed.append(entry)
+                continue
+            plain_entry = {key: value for key, value in entry.items() if key != 'encryptedMessage'}
+            run.append({'message': message, **plain_entry})
+            flush()
+        else:
+            flush(final=True)
+            packed.append(entry)
+
+    flush(final=True)
+    return packed
+
+
+__all__ = ['decode_history', 'iter_decoded_history', 'pack_history', 'pack_segment', 'unpack_segment', 'is_segment']
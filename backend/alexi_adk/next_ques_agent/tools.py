@@ -2,11 +2,26 @@ import json
 import firebase_admin
 from firebase_admin import credentials, firestore
 from typing import Dict, Optional, Any
-from .encryption import decrypt
+from .encryption import get_user_data_key
+from .history import iter_decoded_history
 import os
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Field projections for user document reads; the document also carries the
+# whole encrypted userHistory array, which most reads do not need
+CURRENT_QUESTION_FIELDS = ["currentQuestion"]
+HISTORY_FIELDS = ["userHistory", "email", "wrappedDataKey"]
+PROGRESS_CHECKPOINT_FIELD = "progressCheckpoint"
+# Everything one conversation turn needs, read together
+TURN_FIELDS = CURRENT_QUESTION_FIELDS + [PROGRESS_CHECKPOINT_FIELD] + HISTORY_FIELDS
+
+# Chat history subcollection, one document per message ordered by `seq`;
+# entries still in the legacy userHistory array are older than all of them
+MESSAGES_COLLECTION = "messages"
+MESSAGE_META_FIELDS = ("seq", "createdAt")
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 200))
+
 
 class FirebaseQuestionManager:
 
@@ -45,59 +60,146 @@ class FirebaseQuestionManager:
             print(f"Error updating progress for user {userId}: {e}")
             return False
 
-    def getMessageHistory(self, userId: str) -> Optional[list]:
+    def getProgressCheckpoint(self, userId: str) -> Optional[Dict[str, Any]]:
         """
-        Gets the message history for a user from Firebase, decrypting messages if necessary.
+        Reads the progress checkpoint stored on a user document.
 
         Args:
-            userId (str): The ID of the user whose message history to retrieve
+            userId (str): The ID of the user whose checkpoint to read
 
         Returns:
-            Optional[list]: The user's decrypted message history or None if not found
+            Optional[Dict[str, Any]]: The projected {"progressCheckpoint": ...} fields,
+            or None if the user was not found
+        """
+        return self.getUserFields(userId, [PROGRESS_CHECKPOINT_FIELD])
+
+    def saveProgressCheckpoint(self, userId: str, checkpoint: Dict[str, Any]) -> bool:
+        """
+        Stores the progress count and the checkpoint it was computed from in one write.
+
+        Args:
+            userId (str): The ID of the user whose progress to update
+            checkpoint (Dict[str, Any]): {"messageCount": int, "answeredQuestions": [...]}
+
+        Returns:
+            bool: True if successful, False otherwise
         """
         try:
             user_ref = self.db.collection("users").document(userId)
-            user_doc = user_ref.get()
-
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
-                user_history = user_data.get("userHistory", [])
-                user_email = user_data.get("email")
-
-                if not user_email:
-                    print(f"User email not found for user {userId} - required for decryption")
-
-                if not user_history:
-                    return []
-
-                if not user_email:
-                    print(f"Warning: Email not found for user {userId}. Encrypted messages will not be decrypted.")
-                    return user_history
-
-
-                decrypted_user_history = []
-                for entry in user_history:
-                    if isinstance(entry, dict):
-                        decrypted_entry = {}
-                        for key, value in entry.items():
-                            if key == 'encryptedMessage' and value and user_email:
-                                try:
-                                    decrypted_message = decrypt(value, user_email)
-                                    decrypted_entry['message'] = decrypted_message
-                                except Exception as e:
-                                    print(f"Failed to decrypt message for user {userId}: {e}")
-                                    decrypted_entry['message'] = "[ENCRYPTED_DATA_COULD_NOT_DECRYPT]"
-                            else:
-                                decrypted_entry[key] = value
-                                
-                        decrypted_user_history.append(decrypted_entry)
-                    else:
-                        decrypted_user_history.append(entry)
-
-                return decrypted_user_history
+            user_ref.set(
+                {
+                    "progress": len(checkpoint["answeredQuestions"]),
+                    PROGRESS_CHECKPOINT_FIELD: checkpoint,
+                },
+                merge=True,
+            )
+            print(f"Updated progress checkpoint for user {userId}")
+            return True
+        except Exception as e:
+            print(f"Error updating progress checkpoint for user {userId}: {e}")
+            return False
 
+    def getUserFields(self, userId: str, field_paths: list) -> Optional[Dict[str, Any]]:
+        """
+        Reads only the given field paths of a user document from Firebase.
+
+        Args:
+            userId (str): The ID of the user whose document to read
+            field_paths (list): The field paths to fetch, e.g. ["currentQuestion"]
+
+        Returns:
+            Optional[Dict[str, Any]]: The projected fields or None if the user was not found
+        """
+        user_ref = self.db.collection("users").document(userId)
+        user_doc = user_ref.get(field_paths=field_paths)
+        return user_doc.to_dict() if user_doc.exists else None
+
+    def iterHistoryPages(self, userId: str, user_history: list, page_size: int = HISTORY_PAGE_SIZE):
+        """
+        Yields a user's raw history entries page by page, oldest first.
+
+        Args:
+            userId (str): The ID of the user whose history to read
+            user_history (list): The legacy userHistory array, yielded first
+            page_size (int): Messages fetched per subcollection query
+
+        Returns:
+            Iterator[list]: Pages of encrypted history entries; pages are
+            fetched lazily with limit/start_after, so stopping early skips
+            the remaining reads
+        """
+        if user_history:
+            yield list(user_history)
+
+        messages_ref = self.db.collection("users").document(userId).collection(MESSAGES_COLLECTION)
+        query = messages_ref.order_by("seq").limit(page_size)
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc is not None else query
+            docs = list(page_query.stream())
+            if not docs:
+                return
+            yield [
+                {key: value for key, value in doc.to_dict().items() if key not in MESSAGE_META_FIELDS}
+                for doc in docs
+            ]
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+
+    def iterMessageHistory(self, userId: str, user_data: Optional[Dict[str, Any]] = None, start: int = 0):
+        """
+        Iterates over a user's decrypted message history, oldest first.
+
+        Args:
+            userId (str): The ID of the user whose message history to retrieve
+            user_data (Optional[Dict[str, Any]]): The user document, already read
+                with at least HISTORY_FIELDS; read here if not given
+            start (int): Messages before this index are yielded as None
+                without being decrypted
+
+        Returns:
+            Optional[Iterator[dict]]: Decrypted history entries, or None if the
+            user was not found. Messages are read and decrypted one page at a
+            time as the iterator advances.
+        """
+        if user_data is None:
+            user_data = self.getUserFields(userId, HISTORY_FIELDS)
+        if user_data is None:
             return None
 
+        user_email = user_data.get("email")
+        pages = self.iterHistoryPages(userId, user_data.get("userHistory") or [])
+
+        if not user_email:
+            print(f"Warning: Email not found for user {userId}. Encrypted messages will not be decrypted.")
+            return (entry for page in pages for entry in page)
+
+        # Decrypt legacy messages and packed segments page by page
+        data_key = get_user_data_key(user_data, user_email)
+        return iter_decoded_history(pages, user_email, data_key, start=start)
+
+    def getMessageHistory(self, userId: str, user_data: Optional[Dict[str, Any]] = None,
+                          start: int = 0) -> Optional[list]:
+        """
+        Gets the message history for a user from Firebase, decrypting messages if necessary.
+
+        Args:
+            userId (str): The ID of the user whose message history to retrieve
+            user_data (Optional[Dict[str, Any]]): The user document, already read
+                with at least HISTORY_FIELDS; read here if not given
+            start (int): Messages before this index are returned as None
+                without being decrypted
+
+        Returns:
+            Optional[list]: The user's decrypted message history or None if not found
+        """
+        try:
+            message_history = self.iterMessageHistory(userId, user_data, start)
+            if message_history is None:
+                return None
+            return list(message_history)
+
         except Exception as e:
             print(f"Error getting message history for user {userId}: {e}")
             return None
@@ -117,77 +219,124 @@ class FirebaseQuestionManager:
 
         self.questions_data = questions_dict
 
-    def getCurrentQuestion(self, userId: str) -> Optional[Dict[str, Any]]:
+    def getTurnState(self, userId: str) -> Optional[Dict[str, Any]]:
+        """
+        Reads everything a conversation turn needs from the user document in one read.
 
-        try:
-            # Get user document from Firebase
-            user_ref = self.db.collection("users").document(userId)
-            user_doc = user_ref.get()
+        Args:
+            userId (str): The ID of the user whose state to read
 
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
-                current_question = user_data.get("currentQuestion")
+        Returns:
+            Optional[Dict[str, Any]]: The TURN_FIELDS of the user document, or None
+            if the user was not found
+        """
+        return self.getUserFields(userId, TURN_FIELDS)
+
+    @staticmethod
+    def currentQuestionFrom(user_data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Extracts the current question from a user document read with CURRENT_QUESTION_FIELDS.
 
-                if current_question:
-                    return {
-                        "questionTheme": current_question.get("questionTheme"),
-                        "questionIndex": current_question.get("questionIndex"),
-                        "questionText": current_question.get("questionText"),
-                    }
+        Args:
+            user_data (Optional[Dict[str, Any]]): The user document fields
 
+        Returns:
+            Optional[Dict[str, Any]]: The current question or None if none is set
+        """
+        current_question = (user_data or {}).get("currentQuestion")
+        if not current_question:
             return None
+        return {
+            "questionTheme": current_question.get("questionTheme"),
+            "questionIndex": current_question.get("questionIndex"),
+            "questionText": current_question.get("questionText"),
+        }
+
+    def getCurrentQuestion(self, userId: str) -> Optional[Dict[str, Any]]:
+
+        try:
+            # Get only the question state from Firebase
+            user_data = self.getUserFields(userId, CURRENT_QUESTION_FIELDS)
+            return self.currentQuestionFrom(user_data)
 
         except Exception as e:
             print(f"Error getting current question for user {userId}: {e}")
             return None
 
-    def getNextQuestion(self, userId: str) -> Dict[str, Any]:
+    def peekNextQuestion(self, current_question: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Works out the question after `current_question` without touching Firebase.
+
+        Args:
+            current_question (Optional[Dict[str, Any]]): The user's current question,
+                or None if they have not been asked one yet
+
+        Returns:
+            Optional[Dict[str, Any]]: The next {"questionTheme", "questionIndex",
+            "questionText"}, or None if all questions are done or the theme is unknown
+        """
+        themes = list(self.questions_data.keys())
+        if not current_question:
+            # set next theme.
+            current_theme = themes[0]
+            current_index = -1
+        else:
+            current_theme = current_question["questionTheme"]
+            current_index = current_question["questionIndex"]
+
+        # Check if theme exists in questions data
+        if current_theme not in self.questions_data:
+            print(f"Theme '{current_theme}' not found in questions data")
+            return None
+
+        theme_questions = self.questions_data[current_theme]
+        next_index = current_index + 1
 
-        try:
-            # First get current question
-            current_question = self.getCurrentQuestion(userId)
-            themes = list(self.questions_data.keys())
-            if not current_question:
-                # set next theme.
-                current_theme = themes[0]
-                current_index = -1
+        # Check if next question exists
+        if next_index >= len(theme_questions):
+            # If no more questions in current theme, move to next theme
+            current_theme_index = themes.index(current_theme)
+            if current_theme_index + 1 < len(themes):
+                current_theme = themes[current_theme_index + 1]
+                next_index = 0
             else:
-                current_theme = current_question["questionTheme"]
-                current_index = current_question["questionIndex"]
+                return None
+        # Get next question
+        next_question_data = self.questions_data[current_theme][next_index]
+        return {
+            "questionTheme": current_theme,
+            "questionIndex": next_index,
+            "questionText": next_question_data.get("question", ""),
+        }
+
+    def saveCurrentQuestion(self, userId: str, question: Dict[str, Any]) -> None:
+        """
+        Stores `question` as the user's current question.
 
-            # Check if theme exists in questions data
-            if current_theme not in self.questions_data:
-                print(f"Theme '{current_theme}' not found in questions data")
-                return {}
+        Args:
+            userId (str): The ID of the user to update
+            question (Dict[str, Any]): {"questionTheme", "questionIndex", "questionText"}
+        """
+        user_ref = self.db.collection("users").document(userId)
+        user_ref.set({"currentQuestion": question}, merge=True)
 
-            theme_questions = self.questions_data[current_theme]
-            next_index = current_index + 1
-
-            # Check if next question exists
-            if next_index >= len(theme_questions):
-                # If no more questions in current theme, move to next theme
-                current_theme_index = themes.index(current_theme)
-                if current_theme_index + 1 < len(themes):
-                    current_theme = themes[current_theme_index + 1]
-                    next_index = 0
-                else:
-                    print(f"All questions done for user {userId}")
-                    return {}
-            # Get next question
-            next_question_data = theme_questions[next_index]
-            next_question = {
-                "questionTheme": current_theme,
-                "questionIndex": next_index,
-                "questionText": next_question_data.get("question", ""),
-            }
+        print(
+            f"Updated user {userId} to question {question['questionIndex']} in theme '{question['questionTheme']}'"
+        )
 
-            # Update Firebase with new current question
-            user_ref = self.db.collection("users").document(userId)
-            user_ref.set({"progress": progress}, merge=True)
+    def getNextQuestion(self, userId: str, current_question: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
 
-            print(
-                f"Updated user {userId} to question {next_index} in theme '{current_theme}'"
-            )
+        try:
+            # First get current question, unless the caller already read it
+            if current_question is None:
+                current_question = self.getCurrentQuestion(userId)
+            next_question = self.peekNextQuestion(current_question)
+            if next_question is None:
+                print(f"No next question for user {userId}")
+                return {}
+
+            # Update Firebase with new current question
+            self.saveCurrentQuestion(userId, next_question)
             return next_question["questionText"]
 
         except Exception as e:
@@ -1,12 +1,22 @@
 from google.adk.agents import LlmAgent, SequentialAgent
 from google.adk.tools.agent_tool import AgentTool
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.genai import types
 from dotenv import load_dotenv
 from pydantic import BaseModel
 import json
 import os
+from agent_runtime import AgentRuntime
+from .progress import (
+    load_question_list,
+    incremental_query,
+    full_query,
+    parse_progress,
+    has_new_answers,
+    settle_locally,
+    advance_checkpoint,
+    empty_checkpoint,
+    PROGRESS_LOCAL_MATCHER,
+)
+from .matcher import QuestionMatcher
 
 load_dotenv()
 
@@ -23,6 +33,8 @@ class Progress(BaseModel):
 questions_json_path = os.path.join(BASE_DIR, "questions_flat.json")
 with open(questions_json_path, "r", encoding="utf-8") as file:
     questions_data = json.load(file)
+questions_list = load_question_list(questions_json_path)
+question_matcher = QuestionMatcher(questions_data["questions"])
 progress_agent = LlmAgent(
     name="ProgressAgent",
     model=GEMINI_MODEL,
@@ -35,6 +47,7 @@ progress_agent = LlmAgent(
         "answered_questions": <array of answered questions from full questoin set>,
     }}
     Note that the answered questions should be continuous, meaning if a question is not answered, any question after that should not be counted as answered. The conversation will be provided in the next message.
+    The message may instead give the number of questions already answered, the next question to be answered, a few earlier messages for context and only the new part of the conversation. In that case return only the questions the new conversation answers, in order, starting with the next question to be answered.
   
 """,
     description="Analyzes a set of questions, and a conversation between a user and therapist, and determines the number of questions completely answered by the user.",
@@ -47,35 +60,66 @@ progress_agent = LlmAgent(
 root_agent = progress_agent
 
 
-# Agent Interaction
-async def call_agent(query):
-    APP_NAME = "ProgressAgent"
-    USER_ID = "user1234"
-    SESSION_ID = "1234"
-
-    # Session and Runner
-    session_service = InMemorySessionService()
-    session = await session_service.create_session(
-        app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID
-    )
-    runner = Runner(
-        agent=root_agent, app_name=APP_NAME, session_service=session_service
-    )
+# One Runner per process. Progress queries are self-contained, so every run
+# starts a fresh session (keyed by the real user, never shared between users)
+agent_runtime = AgentRuntime(root_agent, "ProgressAgent", max_session_events=0)
 
-    content = types.Content(role="user", parts=[types.Part(text=query)])
-    events = runner.run(user_id=USER_ID, session_id=SESSION_ID, new_message=content)
 
-    for event in events:
-        if event.is_final_response():
-            final_response = event.content.parts[0].text
-            return final_response
+# Agent Interaction
+async def call_agent(user_id, query):
+    return await agent_runtime.run(user_id, query)
 
 
 async def track_progress(user_id, message_history):
     # load questions_flat.json as questions
 
-    query = f"""
-therapist user conversation: {message_history} 
-"""
-    res = await call_agent(query)
+    query = full_query(message_history)
+    res = await call_agent(user_id, query)
     return res
+
+
+async def track_progress_incremental(user_id, message_history, checkpoint=None, full=False):
+    """
+    Tracks progress from the user's checkpoint instead of the whole history
+
+    Only the messages after the checkpoint (plus the current question
+    context) are sent to the agent, so each call costs the size of the new
+    messages rather than the whole conversation. If nothing new was said,
+    the agent is not called at all.
+
+    Args:
+        user_id (str): The user's ID
+        message_history (list): The user's full decrypted message history
+        checkpoint (dict): The stored checkpoint, see progress.read_checkpoint
+        full (bool): Recompute from the whole history; the result still
+            never goes below the checkpoint
+
+    Returns:
+        tuple: ({"answered_questions": [...]}, new checkpoint). If the agent
+        gives no usable reply the checkpoint is returned unchanged, so the
+        new messages are looked at again next time.
+    """
+    checkpoint = checkpoint or empty_checkpoint()
+    message_count = len(message_history)
+    if full or message_count < checkpoint["messageCount"]:
+        # Forced recompute, or the history was rewritten behind the checkpoint
+        query = full_query(message_history)
+    elif not has_new_answers(message_history, checkpoint):
+        # Nothing new from the user; just move the checkpoint past the new messages
+        checkpoint = {**checkpoint, "messageCount": message_count}
+        return {"answered_questions": checkpoint["answeredQuestions"]}, checkpoint
+    else:
+        answered = settle_locally(question_matcher, message_history, checkpoint) if PROGRESS_LOCAL_MATCHER else None
+        if answered is not None:
+            # Clear-cut answers are settled without a model round trip
+            new_checkpoint = advance_checkpoint(checkpoint, answered, message_count, questions_list)
+            return {"answered_questions": new_checkpoint["answeredQuestions"]}, new_checkpoint
+        query = incremental_query(message_history, checkpoint, questions_list)
+
+    res = await call_agent(user_id, query)
+    answered = parse_progress(res)
+    if answered is None:
+        print(f"Unusable progress reply for user {user_id}, keeping the checkpoint")
+        return {"answered_questions": checkpoint["answeredQuestions"]}, checkpoint
+    new_checkpoint = advance_checkpoint(checkpoint, answered, message_count, questions_list)
+    return {"answered_questions": new_checkpoint["answeredQuestions"]}, new_checkpoint
@@ -0,0 +1,259 @@
+import os
+import re
+import json
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Minimum cosine similarity for a therapist message to count as asking a question of the set
+PROGRESS_ALIGN_THRESHOLD = float(os.getenv("PROGRESS_ALIGN_THRESHOLD", 0.55))
+# Answers to free-text questions need at least this many words to count as complete
+FREE_TEXT_MIN_WORDS = int(os.getenv("FREE_TEXT_MIN_WORDS", 3))
+
+COMPLETE = "complete"
+INCOMPLETE = "incomplete"
+AMBIGUOUS = "ambiguous"
+
+# Refusals anywhere in the answer
+SKIP_PHRASES = (
+    "don't want to answer", "dont want to answer", "do not want to answer", "don't want to say",
+    "dont want to say", "don't want to talk about", "dont want to talk about", "rather not say",
+    "rather not answer", "rather not share", "rather not talk", "prefer not to say", "prefer not to answer",
+    "prefer not to share", "won't answer", "wont answer", "not comfortable answering",
+    "not comfortable sharing", "pass on this", "no comment",
+)
+# Refusals that are the whole answer, e.g. "skip this one please"; "I did skip it" is not one
+SKIP_COMMAND = re.compile(
+    r"^(?:please )?(?:skip|pass|next question|next)(?: (?:this|that|it|one|question|please|for now))*$"
+)
+# Questions back to the therapist instead of an answer
+CLARIFY_PHRASES = (
+    "what do you mean", "what does that mean", "why do you ask", "why are you asking", "why do you want to know",
+    "repeat the question", "repeat that", "say that again", "say again", "come again",
+    "don't understand", "dont understand", "do not understand", "didn't understand", "didnt understand",
+    "didn't get", "didnt get", "not sure what you mean",
+)
+CLARIFY_START = re.compile(r"^(?:what|why|how come|can you|could you|would you|will you|pardon|sorry|huh)\b")
+# Not knowing the answer is not an answer
+UNSURE_PHRASES = (
+    "don't know", "dont know", "do not know", "not sure", "unsure", "no idea", "not certain", "idk", "dunno",
+    "can't remember", "cant remember", "don't remember", "dont remember", "do not remember", "can't say",
+    "cant say", "hard to say",
+)
+HEDGE_WORDS = {
+    "hmm", "hm", "um", "uh", "maybe", "perhaps", "idk", "dunno", "sort", "kind", "of", "i", "think",
+    "guess", "not", "somewhat", "partly", "partially", "possibly", "probably", "well", "so",
+    "some", "it", "s", "its",
+}
+# Only words that are a yes or a no on their own; "do", "did" or "don't" are not answers by themselves
+YES_WORDS = {"yes", "yeah", "yep", "yup", "yea", "ya", "sure", "definitely", "absolutely", "correct", "ofcourse"}
+NO_WORDS = {"no", "nope", "nah", "never"}
+# A free-text question asking for more than one thing, e.g. "... and when did you wake up today?"
+MULTI_PART = re.compile(r"\band (?:when|what|where|why|how|who|which|did|do|does|are|is|have)\b")
+# Free-text placeholders inside expected_answer, e.g. "[User's Description]"
+FREE_TEXT_MARKERS = ("user's", "description", "site area", "zone")
+# Words that describe an option, beyond the option's own words
+OPTION_SYNONYMS = {
+    "good": {"good", "great", "fine", "well", "happy", "nice"},
+    "okay": {"okay", "ok", "alright", "fine"},
+    "not well": {"bad", "sick", "unwell", "ill", "terrible", "not well"},
+    "normal": {"normal", "fine", "usual", "same"},
+    "unwell": {"unwell", "sick", "ill", "pain", "fever"},
+    "tired": {"tired", "sleepy", "exhausted", "fatigued"},
+    "stressed": {"stressed", "stress", "anxious", "tense", "worried"},
+    "all good": {"good condition", "all good", "everything", "all my"},
+    "missing": {"missing", "lost", "forgot", "don't have", "dont have"},
+    "needs replacement": {"replace", "replacement", "broken", "torn", "damaged", "worn"},
+    "safe": {"safe", "clear"},
+    "unsafe": {"unsafe", "dangerous", "danger"},
+    "hazard present": {"hazard", "hazards", "risk", "cables", "spill"},
+    "ready": {"ready", "fit", "good to go"},
+    "not ready": {"not ready", "unfit", "unwell"},
+    "unclear": {"unclear", "confused"},
+}
+
+
+def _normalize(text) -> str:
+    return " ".join(re.findall(r"[a-z0-9']+", str(text).lower().replace("\u2019", "'")))
+
+
+def _words(text) -> list:
+    return re.findall(r"[a-z0-9]+", str(text).lower())
+
+
+def _trigrams(text) -> list:
+    padded = f"  {_normalize(text)} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def parse_expected_answer(expected_answer: str):
+    """
+    Splits an expected_answer like "Breakfast Status: [Yes/No]" into its
+    answer kind and options
+
+    Returns:
+        tuple: (kind, options) with kind one of "yes_no", "choice", "free", "ack"
+    """
+    text = str(expected_answer or "")
+    if "acknowledgement" in text.lower():
+        return "ack", []
+    match = re.search(r"[\[(]([^\])]*)[\])]", text)
+    if not match or any(marker in match.group(1).lower() for marker in FREE_TEXT_MARKERS):
+        return "free", []
+    options = [_normalize(option) for option in match.group(1).split("/") if option.strip()]
+    if "yes" in options and "no" in options:
+        return "yes_no", options
+    return "choice", options
+
+
+class QuestionMatcher:
+    """
+    Local, model-free matching of a conversation against the question set.
+
+    Therapist messages are aligned to questions by cosine similarity of
+    character trigram counts, computed for the whole question set at once
+    as one matrix-vector product. User answers are checked against the
+    question's expected_answer shape (yes/no, one of the listed options,
+    free text, acknowledgement) and refusal/hedge phrases. Questions back to
+    the therapist, "I don't know" and answers to multi-part free-text
+    questions are not decided here: like anything else the checks cannot
+    decide, they are reported as AMBIGUOUS so the caller falls back to the
+    LLM.
+    """
+
+    def __init__(self, questions: list, align_threshold: float = PROGRESS_ALIGN_THRESHOLD):
+        self.questions = [item["question"] for item in questions]
+        self.shapes = [parse_expected_answer(item.get("expected_answer")) for item in questions]
+        self.multi_part = [bool(MULTI_PART.search(_normalize(question))) for question in self.questions]
+        self.align_threshold = align_threshold
+
+        vocabulary = {}
+        for question in self.questions:
+            for gram in _trigrams(question):
+                vocabulary.setdefault(gram, len(vocabulary))
+        self.vocabulary = vocabulary
+        matrix = np.zeros((len(self.questions), len(vocabulary)), dtype=np.float32)
+        for row, question in enumerate(self.questions):
+            for gram in _trigrams(question):
+                matrix[row, vocabulary[gram]] += 1
+        self.matrix = matrix
+        self.norms = np.linalg.norm(matrix, axis=1)
+
+    @classmethod
+    def from_file(cls, path: str = None, **kwargs):
+        path = path or os.path.join(BASE_DIR, "questions_flat.json")
+        with open(path, "r", encoding="utf-8") as file:
+            return cls(json.load(file)["questions"], **kwargs)
+
+    def similarities(self, message) -> np.ndarray:
+        """Cosine similarity of `message` to every question"""
+        grams = _trigrams(message)
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for gram in grams:
+            index = self.vocabulary.get(gram)
+            if index is not None:
+                vector[index] += 1
+        # Grams outside the vocabulary still count towards the message's norm
+        counts = {}
+        for gram in grams:
+            counts[gram] = counts.get(gram, 0) + 1
+        norm = np.sqrt(sum(count * count for count in counts.values())) or 1.0
+        return (self.matrix @ vector) / (self.norms * norm)
+
+    def align(self, message):
+        """Index of the question `message` asks, or None if it asks none of them"""
+        scores = self.similarities(message)
+        index = int(np.argmax(scores))
+        return index if scores[index] >= self.align_threshold else None
+
+    def classify(self, index: int, answer) -> str:
+        """
+        Decides whether `answer` completely answers question `index`
+
+        Returns:
+            str: COMPLETE, INCOMPLETE or AMBIGUOUS
+        """
+        normalized = _normalize(answer)
+        words = _words(answer)
+        if not words:
+            return INCOMPLETE
+        padded = f" {normalized} "
+        # A question back ("what do you mean?") is not an answer
+        if "?" in str(answer) or CLARIFY_START.match(normalized) or any(
+                f" {phrase} " in padded for phrase in CLARIFY_PHRASES):
+            return AMBIGUOUS
+        # Declining to answer counts as answered, like in the agents' instructions
+        if SKIP_COMMAND.match(normalized) or any(f" {phrase} " in padded for phrase in SKIP_PHRASES):
+            return COMPLETE
+        if any(f" {phrase} " in padded for phrase in UNSURE_PHRASES):
+            return AMBIGUOUS
+        kind, options = self.shapes[index]
+        if kind == "ack":
+            return COMPLETE
+        if all(word in HEDGE_WORDS for word in words):
+            return INCOMPLETE if len(words) <= 3 else AMBIGUOUS
+
+        if kind == "yes_no":
+            said_yes = any(word in YES_WORDS for word in words)
+            said_no = any(word in NO_WORDS for word in words)
+            if said_yes != said_no:
+                return COMPLETE
+            if any(self._mentions(option, normalized, words) for option in options if option not in ("yes", "no")):
+                return COMPLETE
+            return AMBIGUOUS
+        if kind == "choice":
+            if any(self._mentions(option, normalized, words) for option in options):
+                return COMPLETE
+            return AMBIGUOUS
+        # Free text: whether every part of a multi-part question was answered is for the model
+        if self.multi_part[index]:
+            return AMBIGUOUS
+        # A short non-hedge sentence is an answer, a single word may not be
+        content = [word for word in words if word not in HEDGE_WORDS]
+        return COMPLETE if len(content) >= FREE_TEXT_MIN_WORDS else AMBIGUOUS
+
+    @staticmethod
+    def _mentions(option: str, normalized: str, words: list) -> bool:
+        terms = OPTION_SYNONYMS.get(option, set()) | {option}
+        return any((term in normalized) if " " in term else (term in words) for term in terms)
+
+    def settle(self, new_messages: list, context_messages: list = (), next_index: int = 0):
+        """
+        Works out locally which questions the new messages answer
+
+        Args:
+            new_messages: History entries ({"role", "message"}) after the checkpoint
+            context_messages: Entries right before them, for the question
+                being asked when the new messages start
+            next_index: Index of the first unanswered question, assumed to be
+                the one being asked if no therapist message aligns
+
+        Returns:
+            Optional[list]: The answered question texts, or None if any new
+            user message could not be classified confidently
+        """
+        answered = []
+        current = next_index if next_index < len(self.questions) else None
+        for entry in context_messages:
+            if isinstance(entry, dict) and entry.get("role") != "user":
+                aligned = self.align(entry.get("message", ""))
+                if aligned is not None:
+                    current = aligned
+
+        for entry in new_messages:
+            if not isinstance(entry, dict):
+                return None
+            if entry.get("role") != "user":
+                aligned = self.align(entry.get("message", ""))
+                if aligned is not None:
+                    current = aligned
+                continue
+            if current is None:
+                return None
+            verdict = self.classify(current, entry.get("message", ""))
+            if verdict == AMBIGUOUS:
+                return None
+            if verdict == COMPLETE:
+                answered.append(self.questions[current])
+        return answered
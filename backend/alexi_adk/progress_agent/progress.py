@@ -0,0 +1,142 @@
+import os
+import re
+import json
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Messages before the checkpoint that are resent as context, so an answer
+# right after the checkpoint can be matched to the question it answers
+PROGRESS_CONTEXT_MESSAGES = int(os.getenv("PROGRESS_CONTEXT_MESSAGES", 2))
+
+# Settle progress with the local matcher when it is confident, before calling ProgressAgent
+PROGRESS_LOCAL_MATCHER = os.getenv("PROGRESS_LOCAL_MATCHER", "true").lower() == "true"
+
+# Field on the user document holding the progress checkpoint
+CHECKPOINT_FIELD = "progressCheckpoint"
+
+
+def load_question_list(path: str = None) -> list:
+    """Loads the ordered question texts from questions_flat.json"""
+    path = path or os.path.join(BASE_DIR, "questions_flat.json")
+    with open(path, "r", encoding="utf-8") as file:
+        return [item["question"] for item in json.load(file)["questions"]]
+
+
+def normalize_question(text) -> str:
+    """Lowercased question text without punctuation, for tolerant matching"""
+    return " ".join(re.findall(r"\w+", str(text).lower()))
+
+
+def answered_prefix(answered: list, questions: list) -> list:
+    """
+    Returns the longest run of `questions`, from the first one on, that all
+    appear in `answered`. Questions are asked in order, so anything after the
+    first unanswered question does not count.
+    """
+    answered_set = {normalize_question(question) for question in answered}
+    prefix = []
+    for question in questions:
+        if normalize_question(question) not in answered_set:
+            break
+        prefix.append(question)
+    return prefix
+
+
+def empty_checkpoint() -> dict:
+    return {"messageCount": 0, "answeredQuestions": []}
+
+
+def read_checkpoint(data) -> dict:
+    """Checkpoint stored on a user document, or an empty one"""
+    checkpoint = (data or {}).get(CHECKPOINT_FIELD) or {}
+    return {
+        "messageCount": int(checkpoint.get("messageCount", 0)),
+        "answeredQuestions": list(checkpoint.get("answeredQuestions", [])),
+    }
+
+
+def history_start(checkpoint: dict, full: bool = False) -> int:
+    """
+    First message index a progress update reads decrypted; the messages
+    before it are covered by the checkpoint and only counted
+    """
+    if full:
+        return 0
+    return max(0, checkpoint["messageCount"] - PROGRESS_CONTEXT_MESSAGES)
+
+
+def incremental_query(message_history: list, checkpoint: dict, questions: list) -> str:
+    """
+    Builds the ProgressAgent query for the messages after the checkpoint
+
+    The query carries how many questions are already answered, the next
+    question in line and a few messages of context before the new ones,
+    instead of the whole conversation.
+    """
+    start = checkpoint["messageCount"]
+    context = message_history[max(0, start - PROGRESS_CONTEXT_MESSAGES):start]
+    new_messages = message_history[start:]
+    answered = checkpoint["answeredQuestions"]
+    next_question = questions[len(answered)] if len(answered) < len(questions) else None
+    return f"""
+number of questions already answered: {len(answered)}
+next question to be answered: {json.dumps(next_question, ensure_ascii=False)}
+earlier messages, for context only: {json.dumps(context, ensure_ascii=False)}
+new therapist user conversation: {json.dumps(new_messages, ensure_ascii=False)}
+"""
+
+
+def settle_locally(matcher, message_history: list, checkpoint: dict):
+    """
+    Answered questions for the messages after the checkpoint, decided by the
+    local matcher, or None if any new answer needs the agent
+    """
+    start = checkpoint["messageCount"]
+    return matcher.settle(
+        message_history[start:],
+        context_messages=message_history[max(0, start - PROGRESS_CONTEXT_MESSAGES):start],
+        next_index=len(checkpoint["answeredQuestions"]),
+    )
+
+
+def has_new_answers(message_history: list, checkpoint: dict) -> bool:
+    """Only user messages can answer a question; new therapist messages alone change nothing"""
+    return any(
+        isinstance(entry, dict) and entry.get("role") == "user"
+        for entry in message_history[checkpoint["messageCount"]:]
+    )
+
+
+def full_query(message_history: list) -> str:
+    return f"""
+therapist user conversation: {message_history}
+"""
+
+
+def parse_progress(progress_result):
+    """
+    Answered questions from the agent's reply (a dict or JSON text), or None
+    if there is no reply or it cannot be parsed
+    """
+    if isinstance(progress_result, str):
+        try:
+            progress_result = json.loads(progress_result)
+        except json.JSONDecodeError:
+            return None
+    if not isinstance(progress_result, dict) or not isinstance(progress_result.get("answered_questions"), list):
+        return None
+    return list(progress_result["answered_questions"])
+
+
+def advance_checkpoint(checkpoint: dict, answered: list, message_count: int, questions: list) -> dict:
+    """
+    Applies the agent's answered questions to the checkpoint
+
+    The new prefix only counts questions in order, and never gets shorter
+    than the checkpoint's, so progress is monotonic even if the agent
+    forgets an earlier answer.
+    """
+    prefix = answered_prefix(checkpoint["answeredQuestions"] + answered, questions)
+    if len(prefix) < len(checkpoint["answeredQuestions"]):
+        prefix = checkpoint["answeredQuestions"]
+    return {"messageCount": message_count, "answeredQuestions": prefix}
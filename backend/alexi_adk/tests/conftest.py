@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+# alexi_adk modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.fake_firestore import FakeClient
+
+
+@pytest.fixture(scope="session")
+def question_agent():
+    """
+    next_ques_agent.agent with Firebase replaced by an in-memory client;
+    the package starts Firebase when it is imported
+    """
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    client = FakeClient()
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(firebase_admin, "initialize_app", lambda *args, **kwargs: None)
+        patch.setattr(credentials, "Certificate", lambda path: None)
+        patch.setattr(firestore, "client", lambda *args, **kwargs: client)
+        from next_ques_agent import agent
+    return agent
+
+
+@pytest.fixture
+def fake_db(question_agent):
+    """The question manager's in-memory Firestore, emptied for each test"""
+    client = question_agent.question_manager.db
+    client.documents.clear()
+    client.reads.clear()
+    client.writes.clear()
+    client.on_event_loop.clear()
+    return client
@@ -0,0 +1,83 @@
+"""
+In-memory stand-in for the parts of the sync firestore client that
+FirebaseQuestionManager uses. Documents live in a dict keyed by path.
+Calls made from a running event loop, where a real client would block
+it, are recorded in `on_event_loop`.
+"""
+import asyncio
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class FakeSnapshot:
+    def __init__(self, data):
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocumentReference:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    def collection(self, name):
+        return FakeCollection(self.client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None):
+        self.client.record("get", self.path)
+        self.client.reads.append(self.path)
+        data = self.client.documents.get(self.path)
+        if data is not None and field_paths is not None:
+            data = {field: data[field] for field in field_paths if field in data}
+        return FakeSnapshot(data)
+
+    def set(self, fields, merge=False):
+        self.client.record("set", self.path)
+        self.client.writes.append((self.path, fields))
+        current = self.client.documents.get(self.path) if merge else None
+        self.client.documents[self.path] = {**(current or {}), **fields}
+
+
+class FakeCollection:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    def document(self, document_id):
+        return FakeDocumentReference(self.client, f"{self.path}/{document_id}")
+
+    def order_by(self, field):
+        return self
+
+    def limit(self, count):
+        return self
+
+    def start_after(self, snapshot):
+        return self
+
+    def stream(self):
+        return iter(())
+
+
+class FakeClient:
+    def __init__(self, documents=None):
+        self.documents = documents if documents is not None else {}
+        self.reads = []
+        self.writes = []
+        self.on_event_loop = []
+
+    def record(self, operation, path):
+        if _on_event_loop():
+            self.on_event_loop.append((operation, path))
+
+    def collection(self, name):
+        return FakeCollection(self, name)
@@ -0,0 +1,108 @@
+import asyncio
+
+from google.adk.agents import BaseAgent
+from google.adk.events import Event
+from google.genai import types
+
+from agent_runtime import AgentRuntime
+
+
+class EchoAgent(BaseAgent):
+    """Replies with the session's user and id and the message it got"""
+
+    async def _run_async_impl(self, ctx):
+        text = f"{ctx.session.user_id}|{ctx.session.id}|{ctx.user_content.parts[0].text}"
+        yield Event(
+            author=self.name,
+            invocation_id=ctx.invocation_id,
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+        )
+
+
+def make_runtime(**kwargs):
+    return AgentRuntime(EchoAgent(name="echo_agent"), "AgentRuntimeTest", **kwargs)
+
+
+def session_of(reply):
+    return reply.split("|")[1]
+
+
+async def session_exists(runtime, user_id, session_id):
+    session = await runtime.session_service.get_session(
+        app_name=runtime.app_name, user_id=user_id, session_id=session_id
+    )
+    return session is not None
+
+
+def test_each_user_keeps_their_own_session():
+    runtime = make_runtime()
+
+    async def conversation(user_id):
+        replies = [await runtime.run(user_id, f"message {turn}") for turn in range(3)]
+        return user_id, replies
+
+    async def run_all():
+        return await asyncio.gather(*(conversation(f"user-{index}") for index in range(20)))
+
+    results = asyncio.run(run_all())
+
+    sessions = {}
+    for user_id, replies in results:
+        assert [reply.split("|")[0] for reply in replies] == [user_id] * 3
+        assert [reply.split("|")[2] for reply in replies] == ["message 0", "message 1", "message 2"]
+        assert len({session_of(reply) for reply in replies}) == 1
+        sessions[user_id] = session_of(replies[0])
+    assert len(set(sessions.values())) == 20
+    assert runtime.stats() == {"sessions": 20}
+
+
+def test_session_is_replaced_after_max_session_events():
+    # Every run adds the user's message and the agent's reply
+    runtime = make_runtime(max_session_events=3)
+
+    async def run():
+        replies = [await runtime.run("user", f"message {turn}") for turn in range(3)]
+        first = session_of(replies[0])
+        return replies, await session_exists(runtime, "user", first)
+
+    replies, first_still_exists = asyncio.run(run())
+
+    assert session_of(replies[0]) == session_of(replies[1])
+    assert session_of(replies[2]) != session_of(replies[0])
+    assert not first_still_exists
+    assert runtime.stats() == {"sessions": 1}
+
+
+def test_zero_max_session_events_gives_every_run_a_fresh_session():
+    runtime = make_runtime(max_session_events=0)
+
+    async def run():
+        replies = [await runtime.run("user", f"message {turn}") for turn in range(3)]
+        session = await runtime.session_service.get_session(
+            app_name=runtime.app_name, user_id="user", session_id=session_of(replies[-1])
+        )
+        old = [await session_exists(runtime, "user", session_of(reply)) for reply in replies[:-1]]
+        return replies, session, old
+
+    replies, session, old = asyncio.run(run())
+
+    assert len({session_of(reply) for reply in replies}) == 3
+    # The agent saw only the current message, not earlier turns
+    assert len(session.events) == 2
+    assert old == [False, False]
+
+
+def test_idle_sessions_are_evicted():
+    runtime = make_runtime(idle_seconds=0.2)
+
+    async def run():
+        idle = session_of(await runtime.run("idle-user", "hello"))
+        await asyncio.sleep(0.3)
+        await runtime.run("active-user", "hello")
+        return idle, await session_exists(runtime, "idle-user", idle)
+
+    idle, idle_still_exists = asyncio.run(run())
+
+    assert not idle_still_exists
+    assert runtime.stats() == {"sessions": 1}
+
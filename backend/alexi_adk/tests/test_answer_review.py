@@ -0,0 +1,118 @@
+import asyncio
+import json
+
+import pytest
+
+from answer_review import parse_verdict, verdict_query
+
+BREAKFAST = {"questionTheme": "questions", "questionIndex": 1, "questionText": "Did you have your breakfast today?"}
+
+
+@pytest.mark.parametrize("reply, verdict", [
+    ({"complete": True, "follow_up": ""}, {"complete": True, "follow_up": ""}),
+    ('{"complete": true, "follow_up": ""}', {"complete": True, "follow_up": ""}),
+    ('{"complete": false, "follow_up": " What did you eat? "}', {"complete": False, "follow_up": "What did you eat?"}),
+    ({"complete": True}, {"complete": True, "follow_up": ""}),
+])
+def test_parse_verdict_reads_usable_verdicts(reply, verdict):
+    assert parse_verdict(reply) == verdict
+
+
+@pytest.mark.parametrize("reply", [
+    None,
+    "",
+    "The answer is complete",
+    "[true]",
+    '{"complete": "true", "follow_up": ""}',
+    '{"follow_up": "What did you eat?"}',
+    # Incomplete without a follow-up leaves nothing to ask
+    '{"complete": false, "follow_up": ""}',
+    {"complete": False},
+])
+def test_parse_verdict_rejects_unusable_replies(reply):
+    assert parse_verdict(reply) is None
+
+
+def test_verdict_query_carries_question_expected_answer_and_reply():
+    query = verdict_query(BREAKFAST, "Breakfast Status: [Yes/No]", "I had toast")
+
+    assert "Did you have your breakfast today?" in query
+    assert "Breakfast Status: [Yes/No]" in query
+    assert "I had toast" in query
+
+
+@pytest.fixture
+def review(question_agent, fake_db, monkeypatch):
+    """
+    Replaces both model paths with recorders returning the given replies;
+    mode=None keeps the configured ANSWER_REVIEW_MODE
+    """
+    calls = {"verdict": [], "agent": []}
+
+    def install(verdict_reply, agent_reply="Could you tell me more?", mode="single_shot"):
+        async def run_verdict(user_id, query):
+            calls["verdict"].append(query)
+            return verdict_reply
+
+        async def call_agent(user_id, query):
+            calls["agent"].append(query)
+            return agent_reply
+        monkeypatch.setattr(question_agent.verdict_runtime, "run", run_verdict)
+        monkeypatch.setattr(question_agent, "call_agent", call_agent)
+        if mode is not None:
+            monkeypatch.setattr(question_agent, "ANSWER_REVIEW_MODE", mode)
+        return calls
+    return install
+
+
+def analyze(question_agent, answer):
+    return asyncio.run(question_agent.analyze_user_response("user", answer, current_question=dict(BREAKFAST)))
+
+
+@pytest.mark.parametrize("verdict_reply", [None, "not json", '{"complete": false, "follow_up": ""}'])
+def test_unusable_verdict_falls_back_to_the_agent_loop(question_agent, fake_db, review, verdict_reply):
+    calls = review(verdict_reply, agent_reply="What did you have?")
+
+    assert analyze(question_agent, "what do you mean?") == "What did you have?"
+    assert len(calls["verdict"]) == 1
+    assert len(calls["agent"]) == 1
+    assert "what do you mean?" in calls["agent"][0]
+    # The question is only advanced by the agent loop's own tool call
+    assert fake_db.writes == []
+
+
+def test_complete_verdict_advances_without_the_agent_loop(question_agent, fake_db, review):
+    calls = review(json.dumps({"complete": True, "follow_up": ""}))
+
+    next_question = analyze(question_agent, "I did not skip it")
+
+    assert next_question == question_agent.question_manager.questions_data["questions"][2]["question"]
+    assert calls["agent"] == []
+    assert fake_db.documents["users/user"]["currentQuestion"]["questionIndex"] == 2
+
+
+def test_incomplete_verdict_returns_its_follow_up(question_agent, fake_db, review):
+    calls = review(json.dumps({"complete": False, "follow_up": "Did you eat anything at all?"}))
+
+    assert analyze(question_agent, "I don't know") == "Did you eat anything at all?"
+    assert calls["agent"] == []
+    assert fake_db.writes == []
+
+
+def test_clear_answer_is_advanced_by_the_precheck(question_agent, fake_db, review):
+    calls = review(None)
+
+    analyze(question_agent, "yes")
+
+    assert calls == {"verdict": [], "agent": []}
+    assert fake_db.documents["users/user"]["currentQuestion"]["questionIndex"] == 2
+
+
+
+def test_agent_loop_is_the_default_review_mode(question_agent, fake_db, review):
+    calls = review(json.dumps({"complete": True, "follow_up": ""}), agent_reply="What did you have?", mode=None)
+
+    assert question_agent.ANSWER_REVIEW_MODE == "agent"
+    assert analyze(question_agent, "I did not skip it") == "What did you have?"
+    assert calls["verdict"] == []
+    assert len(calls["agent"]) == 1
@@ -0,0 +1,89 @@
+import pytest
+
+EMAIL = "user@example.com"
+
+
+@pytest.fixture(scope="module")
+def history(question_agent):
+    # The next_ques_agent package starts Firebase when it is imported
+    from next_ques_agent import history
+    return history
+
+
+@pytest.fixture(scope="module")
+def data_key(history):
+    from next_ques_agent.encryption import generate_data_key
+    return generate_data_key()
+
+
+@pytest.fixture
+def message(history, data_key):
+    from next_ques_agent.encryption import encrypt_v2
+
+    def make(index):
+        return {"encryptedMessage": encrypt_v2(f"message {index}", data_key), "role": "user"}
+    return make
+
+
+@pytest.fixture
+def segment(history, data_key):
+    def make(first, count):
+        entries = [{"message": f"message {index}", "role": "user"} for index in range(first, first + count)]
+        return history.pack_segment(entries, data_key, sealed=True)
+    return make
+
+
+@pytest.fixture
+def decrypted(history, monkeypatch):
+    """Records every blob handed to decrypt_many"""
+    blobs = []
+    decrypt_many = history.decrypt_many
+
+    def recording(items, *args, **kwargs):
+        blobs.extend(items)
+        return decrypt_many(items, *args, **kwargs)
+    monkeypatch.setattr(history, "decrypt_many", recording)
+    return blobs
+
+
+def texts(entries):
+    return [entry and entry["message"] for entry in entries]
+
+
+def test_entries_before_start_are_counted_but_not_decrypted(history, data_key, message, decrypted):
+    pages = [[message(0), message(1), message(2)], [message(3), message(4)]]
+
+    entries = list(history.iter_decoded_history(pages, EMAIL, data_key, start=2))
+
+    assert texts(entries) == [None, None, "message 2", "message 3", "message 4"]
+    assert len(decrypted) == 3
+
+
+def test_start_skips_whole_segments_by_their_count(history, data_key, message, segment, monkeypatch):
+    unpacked = []
+    unpack_segment = history.unpack_segment
+
+    def recording(entry, data_key):
+        unpacked.append(entry["count"])
+        return unpack_segment(entry, data_key)
+    monkeypatch.setattr(history, "unpack_segment", recording)
+    pages = [[segment(0, 3), segment(3, 3)], [message(6)]]
+
+    entries = list(history.iter_decoded_history(pages, EMAIL, data_key, start=4))
+
+    # The second segment reaches past start and is decoded as a whole
+    assert texts(entries) == [None] * 3 + ["message 3", "message 4", "message 5", "message 6"]
+    assert unpacked == [3]
+
+
+def test_start_past_the_end_decrypts_nothing(history, data_key, message, decrypted):
+    entries = list(history.iter_decoded_history([[message(0), message(1)]], EMAIL, data_key, start=5))
+
+    assert entries == [None, None]
+    assert decrypted == []
+
+
+def test_without_start_everything_is_decrypted(history, data_key, message, segment):
+    entries = list(history.iter_decoded_history([[message(0)], [segment(1, 2)]], EMAIL, data_key))
+
+    assert texts(entries) == ["message 0", "message 1", "message 2"]
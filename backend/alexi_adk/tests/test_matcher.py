@@ -0,0 +1,79 @@
+import pytest
+
+from progress_agent.matcher import QuestionMatcher, COMPLETE, INCOMPLETE, AMBIGUOUS
+
+FEELING, BREAKFAST, SLEEP, CONDITION, LOCATION, PPE, AWARENESS, HYDRATION, THANKS = 0, 1, 2, 3, 4, 6, 8, 10, 11
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return QuestionMatcher.from_file()
+
+
+@pytest.mark.parametrize("index, answer", [
+    (BREAKFAST, "Yes, I had breakfast"),
+    (BREAKFAST, "No, I skipped it"),
+    (BREAKFAST, "yep"),
+    (FEELING, "I'm feeling good, thanks"),
+    (CONDITION, "A bit tired"),
+    (PPE, "My gloves are missing"),
+    (LOCATION, "Zone B near the substation"),
+    (THANKS, "Thanks, will do"),
+])
+def test_clear_answers_are_complete(matcher, index, answer):
+    assert matcher.classify(index, answer) == COMPLETE
+
+
+@pytest.mark.parametrize("index, answer", [
+    (BREAKFAST, "what do you mean?"),
+    (BREAKFAST, "what do you mean"),
+    (BREAKFAST, "why do you ask"),
+    (HYDRATION, "Sorry, can you repeat the question"),
+    (SLEEP, "can you repeat the question"),
+    (FEELING, "I don't understand"),
+    (THANKS, "what?"),
+])
+def test_questions_back_go_to_the_model(matcher, index, answer):
+    assert matcher.classify(index, answer) == AMBIGUOUS
+
+
+@pytest.mark.parametrize("index, answer", [
+    (BREAKFAST, "I don't know"),
+    (BREAKFAST, "I dont know"),
+    (BREAKFAST, "I don’t remember"),
+    (AWARENESS, "not sure"),
+    (LOCATION, "no idea yet"),
+])
+def test_not_knowing_goes_to_the_model(matcher, index, answer):
+    assert matcher.classify(index, answer) == AMBIGUOUS
+
+
+@pytest.mark.parametrize("answer", ["I did", "I do", "I have", "I didn't", "I did not skip it", "I am"])
+def test_yes_no_needs_a_real_yes_or_no(matcher, answer):
+    assert matcher.classify(BREAKFAST, answer) == AMBIGUOUS
+
+
+@pytest.mark.parametrize("answer", [
+    "skip", "skip this one", "Skip it please", "pass", "next question",
+    "I don't want to answer that", "I'd rather not say",
+])
+def test_refusals_count_as_answered(matcher, answer):
+    assert matcher.classify(SLEEP, answer) == COMPLETE
+
+
+@pytest.mark.parametrize("answer", ["I did skip it", "I did not skip it", "I skipped it today"])
+def test_skip_inside_an_answer_is_not_a_refusal(matcher, answer):
+    assert matcher.classify(BREAKFAST, answer) == AMBIGUOUS
+
+
+@pytest.mark.parametrize("answer", [
+    "went to bed late",
+    "Slept at 11 pm and woke up at 6 am",
+])
+def test_multi_part_free_text_goes_to_the_model(matcher, answer):
+    assert matcher.multi_part[SLEEP]
+    assert matcher.classify(SLEEP, answer) == AMBIGUOUS
+
+
+def test_hedges_are_incomplete(matcher):
+    assert matcher.classify(LOCATION, "hmm maybe") == INCOMPLETE
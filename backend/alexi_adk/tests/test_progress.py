@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+from progress_agent import agent
+from progress_agent.progress import parse_progress, settle_locally
+
+QUESTIONS = agent.questions_list
+
+HISTORY = [
+    {"role": "assistant", "message": QUESTIONS[0]},
+    {"role": "user", "message": "I am good"},
+    {"role": "assistant", "message": QUESTIONS[1]},
+    {"role": "user", "message": "mmm toast"},
+]
+CHECKPOINT = {"messageCount": 2, "answeredQuestions": [QUESTIONS[0]]}
+
+
+@pytest.mark.parametrize("reply", [None, "", "not json", "[]", json.dumps({"count": 2}), json.dumps({"answered_questions": "all"})])
+def test_parse_progress_rejects_unusable_replies(reply):
+    assert parse_progress(reply) is None
+
+
+def test_parse_progress_reads_dicts_and_json():
+    assert parse_progress({"answered_questions": ["a"]}) == ["a"]
+    assert parse_progress(json.dumps({"answered_questions": []})) == []
+
+
+def track(monkeypatch, reply):
+    calls = []
+
+    async def call_agent(user_id, query):
+        calls.append(query)
+        return reply
+    monkeypatch.setattr(agent, "call_agent", call_agent)
+    # Send every answer to the agent
+    monkeypatch.setattr(agent, "settle_locally", lambda *args: None)
+    result = asyncio.run(agent.track_progress_incremental("user", HISTORY, dict(CHECKPOINT)))
+    assert len(calls) == 1
+    return result
+
+
+@pytest.mark.parametrize("reply", [None, "I could not tell", json.dumps({"answered": []})])
+def test_unusable_agent_reply_keeps_the_checkpoint(monkeypatch, reply):
+    progress, checkpoint = track(monkeypatch, reply)
+
+    assert checkpoint == CHECKPOINT
+    assert progress == {"answered_questions": [QUESTIONS[0]]}
+
+
+def test_parsed_agent_reply_advances_the_checkpoint(monkeypatch):
+    progress, checkpoint = track(monkeypatch, json.dumps({"answered_questions": [QUESTIONS[1]]}))
+
+    assert checkpoint == {"messageCount": 4, "answeredQuestions": QUESTIONS[:2]}
+    assert progress == {"answered_questions": QUESTIONS[:2]}
+
+
+def test_parsed_reply_without_new_answers_still_moves_past_the_messages(monkeypatch):
+    _, checkpoint = track(monkeypatch, json.dumps({"answered_questions": []}))
+
+    assert checkpoint == {"messageCount": 4, "answeredQuestions": [QUESTIONS[0]]}
+
+
+def conversation(question_index, answer):
+    return [
+        {"role": "assistant", "message": QUESTIONS[question_index]},
+        {"role": "user", "message": answer},
+    ]
+
+
+@pytest.mark.parametrize("answer", ["what do you mean?", "I don't know", "I did not skip it"])
+def test_settle_leaves_non_answers_to_the_agent(answer):
+    history = conversation(1, answer)
+
+    assert settle_locally(agent.question_matcher, history, {"messageCount": 0, "answeredQuestions": []}) is None
+
+
+def test_settle_counts_clear_answers():
+    history = conversation(0, "I'm good") + conversation(1, "yes")
+
+    answered = settle_locally(agent.question_matcher, history, {"messageCount": 0, "answeredQuestions": []})
+
+    assert answered == QUESTIONS[:2]
+
+
+def test_progress_does_not_advance_on_a_question_back(monkeypatch):
+    checkpoint = {"messageCount": 2, "answeredQuestions": [QUESTIONS[0]]}
+    history = conversation(0, "good") + conversation(1, "why do you ask")
+    calls = []
+
+    async def call_agent(user_id, query):
+        calls.append(query)
+        return json.dumps({"answered_questions": []})
+    monkeypatch.setattr(agent, "call_agent", call_agent)
+
+    progress, new_checkpoint = asyncio.run(agent.track_progress_incremental("user", history, checkpoint))
+
+    assert len(calls) == 1
+    assert new_checkpoint["answeredQuestions"] == [QUESTIONS[0]]
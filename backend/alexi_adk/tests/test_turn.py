@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+import pytest
+
+
+@pytest.fixture
+def models(question_agent, monkeypatch):
+    """Model calls replaced by fixed replies"""
+    async def run_verdict(user_id, query):
+        return json.dumps({"complete": True, "follow_up": ""})
+
+    async def call_agent(user_id, query):
+        return "Could you tell me more?"
+    monkeypatch.setattr(question_agent.verdict_runtime, "run", run_verdict)
+    monkeypatch.setattr(question_agent, "call_agent", call_agent)
+    monkeypatch.setattr(question_agent, "ANSWER_REVIEW_MODE", "single_shot")
+
+
+def set_current_question(fake_db, index):
+    fake_db.documents["users/user"] = {"currentQuestion": {"questionTheme": "questions", "questionIndex": index}}
+
+
+@pytest.mark.parametrize("answer", ["yes", "I did not skip it"])
+def test_answer_review_keeps_firestore_off_the_event_loop(question_agent, fake_db, models, answer):
+    # "yes" is advanced by the precheck, the other answer by the single-shot verdict
+    set_current_question(fake_db, 1)
+
+    asyncio.run(question_agent.analyze_user_response("user", answer))
+
+    assert fake_db.reads and fake_db.writes
+    assert fake_db.on_event_loop == []
+    assert fake_db.documents["users/user"]["currentQuestion"]["questionIndex"] == 2
+
+
+@pytest.fixture
+def client(question_agent, monkeypatch):
+    pytest.importorskip("asgiref")
+    import main
+
+    def initialize_question_manager():
+        main.question_manager = question_agent.question_manager
+    monkeypatch.setattr(main, "initialize_question_manager", initialize_question_manager)
+    return main.app.test_client()
+
+
+def test_turn_keeps_firestore_off_the_event_loop(client, fake_db, models):
+    fake_db.documents["users/user"] = {"email": "user@example.com"}
+
+    response = client.post("/api/turn/user", json={"user_response": ""})
+
+    assert response.status_code == 200
+    assert response.get_json()["data"]["next_question"] == "Hello! How are you feeling today?"
+    assert fake_db.documents["users/user"]["currentQuestion"]["questionIndex"] == 0
+    # getTurnState reads before the review and progress are gathered
+    assert [call for call in fake_db.on_event_loop if call[0] == "set"] == []
+
+
+@pytest.fixture
+def history_reads(client, question_agent, monkeypatch):
+    """getMessageHistory replaced by a history of the given length; records each start"""
+    import main
+    starts = []
+
+    def install(length):
+        def getMessageHistory(user_id, user_data=None, start=0):
+            starts.append(start)
+            return [None] * start + [{"role": "user", "message": "hi"}] * (length - start)
+        monkeypatch.setattr(question_agent.question_manager, "getMessageHistory", getMessageHistory)
+        main.question_manager = question_agent.question_manager
+        return main.read_progress_history
+    return install, starts
+
+
+def test_progress_history_starts_at_the_checkpoint_context(history_reads):
+    install, starts = history_reads
+    read_progress_history = install(12)
+
+    history = read_progress_history("user", {"messageCount": 10, "answeredQuestions": []})
+
+    assert starts == [8]
+    assert len(history) == 12
+
+
+def test_full_progress_history_is_read_from_the_start(history_reads):
+    install, starts = history_reads
+    read_progress_history = install(12)
+
+    read_progress_history("user", {"messageCount": 10, "answeredQuestions": []}, full=True)
+
+    assert starts == [0]
+
+
+def test_rewritten_history_is_read_again_in_full(history_reads):
+    install, starts = history_reads
+    read_progress_history = install(6)
+
+    history = read_progress_history("user", {"messageCount": 10, "answeredQuestions": []})
+
+    assert starts == [8, 0]
+    assert None not in history
+
+
+@pytest.mark.parametrize("value, full", [
+    (True, True), ("true", True), ("1", True), (1, True),
+    (False, False), ("false", False), ("0", False), ("no", False), (None, False),
+])
+def test_track_progress_parses_full_strictly(client, monkeypatch, value, full):
+    import main
+    calls = []
+
+    def read_progress_history(user_id, checkpoint, user_data=None, full=False):
+        calls.append(full)
+        return []
+    monkeypatch.setattr(main, "read_progress_history", read_progress_history)
+
+    response = client.post("/track_progress", json={"user_id": "user", "full": value})
+
+    assert response.status_code == 404
+    assert calls == [full]
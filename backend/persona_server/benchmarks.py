@@ -0,0 +1,924 @@
+"""
+Micro-benchmarks for the persona server hot paths.
+
+Run from the persona_server directory, e.g.:
+    python benchmarks.py decrypt --messages 200
+"""
+import argparse
+import json
+import time
+
+
+def bench_decrypt(messages=200, repeats=3):
+    """
+    Compares decrypt() throughput with a cold and a warm derived-key cache.
+
+    The cold pass mirrors the old behaviour (one PBKDF2 run per message), the
+    warm passes mirror a report being regenerated over the same history.
+    """
+    from encryption import encrypt, decrypt, key_cache
+
+    password = "user@example.com"
+    plaintexts = [f"message {i}: how are you feeling today?" for i in range(messages)]
+    blobs = [encrypt(text, password) for text in plaintexts]
+
+    key_cache.clear()
+    start = time.perf_counter()
+    cold = [decrypt(blob, password) for blob in blobs]
+    cold_seconds = time.perf_counter() - start
+
+    warm_seconds = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        warm = [decrypt(blob, password) for blob in blobs]
+        warm_seconds = min(warm_seconds, time.perf_counter() - start)
+
+    assert cold == plaintexts and warm == plaintexts, "decrypt output changed"
+
+    print(f"decrypt x{messages}")
+    print(f"  cold cache: {cold_seconds:.3f}s ({messages / cold_seconds:.1f} msg/s)")
+    print(f"  warm cache: {warm_seconds:.4f}s ({messages / warm_seconds:.1f} msg/s)")
+    print(f"  speedup:    {cold_seconds / warm_seconds:.0f}x")
+    print(f"  cache:      {key_cache.stats()}")
+
+
+def bench_decrypt_many(messages=200):
+    """
+    Compares a serial decrypt() loop with decrypt_many() on a cold key cache.
+    """
+    from encryption import encrypt, decrypt, decrypt_many, key_cache, DECRYPT_POOL_WORKERS
+
+    password = "user@example.com"
+    plaintexts = [f"message {i}: how are you feeling today?" for i in range(messages)]
+    blobs = [encrypt(text, password) for text in plaintexts]
+    blobs.append("not-a-valid-blob")
+
+    key_cache.clear()
+    start = time.perf_counter()
+    serial = []
+    for blob in blobs:
+        try:
+            serial.append(decrypt(blob, password))
+        except Exception:
+            serial.append("[ENCRYPTED_DATA_COULD_NOT_DECRYPT]")
+    serial_seconds = time.perf_counter() - start
+
+    # Warm the pool up with a throwaway key so worker start-up isn't counted
+    decrypt_many([encrypt("warm-up", "warm-up")] * 16, "warm-up")
+
+    key_cache.clear()
+    start = time.perf_counter()
+    parallel = decrypt_many(blobs, password)
+    parallel_seconds = time.perf_counter() - start
+
+    assert serial == parallel, "decrypt_many output differs from decrypt()"
+
+    print(f"decrypt_many x{messages} ({DECRYPT_POOL_WORKERS} workers)")
+    print(f"  serial decrypt(): {serial_seconds:.3f}s")
+    print(f"  decrypt_many():   {parallel_seconds:.3f}s")
+    print(f"  speedup:          {serial_seconds / parallel_seconds:.1f}x")
+
+
+def bench_envelope(sizes=(10, 100, 1000)):
+    """
+    Compares decrypt cost for legacy v1 blobs and v2 envelopes on a cold key
+    cache. v2 pays one PBKDF2 run to unwrap the data key, then AES-GCM only.
+    """
+    from encryption import (
+        encrypt, encrypt_v2, decrypt_many, generate_data_key,
+        wrap_data_key, get_user_data_key, key_cache,
+    )
+
+    password = "user@example.com"
+    data_key = generate_data_key()
+    user_data = {"wrappedDataKey": wrap_data_key(data_key, password)}
+
+    print("messages       v1 (s)       v2 (s)   speedup")
+    for size in sizes:
+        plaintexts = [f"message {i}: how are you feeling today?" for i in range(size)]
+        v1_blobs = [encrypt(text, password) for text in plaintexts]
+        v2_blobs = [encrypt_v2(text, data_key) for text in plaintexts]
+
+        key_cache.clear()
+        start = time.perf_counter()
+        v1 = decrypt_many(v1_blobs, password)
+        v1_seconds = time.perf_counter() - start
+
+        key_cache.clear()
+        start = time.perf_counter()
+        v2 = decrypt_many(v2_blobs, password, data_key=get_user_data_key(user_data, password))
+        v2_seconds = time.perf_counter() - start
+
+        assert v1 == plaintexts and v2 == plaintexts, "envelope round trip failed"
+        print(f"{size:>8} {v1_seconds:>12.3f} {v2_seconds:>12.4f} {v1_seconds / v2_seconds:>8.0f}x")
+
+
+def bench_segments(messages=500):
+    """
+    Compares userHistory size and decode time for per-message v1 blobs,
+    per-message v2 envelopes and packed compressed segments.
+    """
+    import json
+    from encryption import encrypt, encrypt_v2, generate_data_key, key_cache
+    from history import decode_history, pack_history, HISTORY_SEGMENT_MAX_MESSAGES
+
+    password = "user@example.com"
+    data_key = generate_data_key()
+    plain = [
+        {"message": f"Message {i}: I slept around eleven and woke up at six, feeling a bit tired but okay.",
+         "role": "user" if i % 2 else "assistant"}
+        for i in range(messages)
+    ]
+    layouts = {
+        "v1 per-message": [{"encryptedMessage": encrypt(m["message"], password), "role": m["role"]} for m in plain],
+        "v2 per-message": [{"encryptedMessage": encrypt_v2(m["message"], data_key), "role": m["role"]} for m in plain],
+    }
+    layouts["packed segments"] = pack_history(layouts["v2 per-message"], password, data_key)
+
+    print(f"userHistory x{messages} ({HISTORY_SEGMENT_MAX_MESSAGES} messages/segment)")
+    print("layout               entries      bytes   decode (s)")
+    for name, history in layouts.items():
+        size = len(json.dumps(history, separators=(",", ":")))
+        key_cache.clear()
+        start = time.perf_counter()
+        decoded = decode_history(history, password, data_key)
+        seconds = time.perf_counter() - start
+        assert [entry["message"] for entry in decoded] == [m["message"] for m in plain], name
+        print(f"{name:<18} {len(history):>9} {size:>10} {seconds:>12.4f}")
+
+
+class _InMemoryWatch:
+    def __init__(self, registry, callback):
+        self.registry = registry
+        self.callback = callback
+        self.is_active = True
+        registry.append(self)
+
+    def unsubscribe(self):
+        self.is_active = False
+        self.registry.remove(self)
+
+
+class _InMemoryDoc:
+    def __init__(self, data):
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class _InMemoryRepository:
+    """Local stand-in for UserRepository: dict-backed documents, simulated RTT"""
+
+    def __init__(self, rtt_seconds=0.02):
+        self.rtt_seconds = rtt_seconds
+        self.users = {}
+        self.personas = {}
+        self.round_trips = 0
+        self.user_watches = {}
+        self.persona_watches = {}
+
+    def load_user_snapshot(self, authId):
+        from repository import UserSnapshot
+
+        self.round_trips += 1
+        time.sleep(self.rtt_seconds)
+        return UserSnapshot(authId, dict(self.users[authId]) if authId in self.users else None, self.personas.get(authId))
+
+    def watch_user(self, authId, callback):
+        return _InMemoryWatch(self.user_watches.setdefault(authId, []), callback)
+
+    def watch_persona(self, authId, callback):
+        return _InMemoryWatch(self.persona_watches.setdefault(authId, []), callback)
+
+    def write_user(self, authId, fields):
+        self.users[authId] = {**self.users.get(authId, {}), **fields}
+        for watch in list(self.user_watches.get(authId, [])):
+            watch.callback([_InMemoryDoc(self.users[authId])], [], None)
+
+    def write_persona(self, authId, info):
+        self.personas[authId] = {"Info": info}
+        for watch in list(self.persona_watches.get(authId, [])):
+            watch.callback([_InMemoryDoc(self.personas[authId])], [], None)
+
+
+def bench_persona_cache(users=50, requests=500, rtt_ms=20.0):
+    """
+    Drives PersonaCache against an in-memory stand-in of the repository to
+    check push invalidation and measure the /getReport cache-hit path.
+    """
+    import random
+    from persona_cache import PersonaCache
+
+    store = _InMemoryRepository(rtt_ms / 1000)
+    cache = PersonaCache(repository=store, max_bytes=10 * 1024 * 1024, ttl_seconds=300)
+    for i in range(users):
+        store.write_user(f"user{i}", {"email": f"user{i}@example.com", "updatePersona": False})
+        store.write_persona(f"user{i}", json.dumps({"Info": {"name": f"user{i}"}, "Graph": {}}))
+
+    # Pushed changes must be visible without another load
+    cache.get("user0")
+    store.write_user("user0", {"updatePersona": True})
+    assert cache.get("user0").update_needed is True, "user doc push not applied"
+    store.write_persona("user0", "new persona")
+    assert cache.get("user0").persona_info == "new persona", "persona push not applied"
+    loads = store.round_trips
+    assert loads == 1, "pushes should not trigger reloads"
+
+    # Dropped listeners fall back to the TTL
+    for watch in list(store.user_watches["user0"]):
+        watch.is_active = False
+    cache.ttl_seconds = 0
+    cache.get("user0")
+    assert store.round_trips == loads + 1, "expired entry was not reloaded"
+    cache.ttl_seconds = 300
+
+    cache.clear()
+    store.round_trips = 0
+    start = time.perf_counter()
+    for _ in range(requests):
+        cache.get(f"user{random.randrange(users)}")
+    seconds = time.perf_counter() - start
+
+    print(f"persona cache: {requests} lookups over {users} users (simulated RTT {rtt_ms:.0f}ms)")
+    print(f"  round trips:   {store.round_trips} (uncached: {requests})")
+    print(f"  wall time:     {seconds:.3f}s (uncached: ~{requests * rtt_ms / 1000:.1f}s)")
+    print(f"  cache:         {cache.stats()}")
+
+
+def bench_concurrency(requests=50, rtt_ms=20.0):
+    """
+    Issues `requests` simultaneous PersonaCache.aget() misses, as concurrent
+    /getReport calls would, through the real AsyncUserRepository over an
+    in-memory Firestore client that either awaits its round trips (async
+    client) or sleeps in them (a sync client called from the handler).
+    """
+    import asyncio
+    from persona_cache import PersonaCache
+    from repository import AsyncUserRepository, UserRepository
+    from tests.fake_firestore import FakeAsyncClient
+
+    documents = {}
+    for i in range(requests):
+        documents[f"users/user{i}"] = {"email": f"user{i}@example.com", "updatePersona": False}
+
+    async def run(blocking):
+        client = FakeAsyncClient(documents, rtt_seconds=rtt_ms / 1000, blocking=blocking)
+        cache = PersonaCache(async_repository=AsyncUserRepository(UserRepository(), client=client),
+                             ttl_seconds=0, listen=False)
+        start = time.perf_counter()
+        snapshots = await asyncio.gather(*(cache.aget(f"user{i}") for i in range(requests)))
+        assert [snapshot.data["email"] for snapshot in snapshots] == [f"user{i}@example.com" for i in range(requests)]
+        return time.perf_counter() - start
+
+    blocking_seconds = asyncio.run(run(blocking=True))
+    async_seconds = asyncio.run(run(blocking=False))
+
+    print(f"concurrency: {requests} simultaneous snapshot loads (simulated RTT {rtt_ms:.0f}ms)")
+    print(f"  blocking client: {blocking_seconds:.3f}s")
+    print(f"  async client:    {async_seconds:.3f}s ({blocking_seconds / async_seconds:.1f}x)")
+
+
+def _document_bytes(data):
+    """Encoded size of `data` as a Firestore Document message, i.e. its wire size"""
+    from google.cloud.firestore_v1 import _helpers
+    from google.cloud.firestore_v1.types import document
+
+    doc = document.Document(fields=_helpers.encode_dict(data))
+    return len(document.Document.serialize(doc)), doc
+
+
+def bench_projection(messages=2000, repeats=20, auth_id=None):
+    """
+    Compares full user document reads with field-projected reads for a user
+    with a large userHistory: encoded bytes and client-side decode time for
+    a synthetic document, and, given --auth-id, live latency against Firestore.
+    """
+    from google.cloud.firestore_v1 import _helpers
+    from encryption import encrypt
+    from repository import USER_SNAPSHOT_FIELDS, HISTORY_FIELDS, project_fields
+
+    email = "bench@example.com"
+    user = {
+        "email": email,
+        "updatePersona": False,
+        "progress": 42,
+        "currentQuestion": {"questionTheme": "Work", "questionIndex": 3, "questionText": "How was your week?"},
+        "userHistory": [
+            {"encryptedMessage": encrypt(f"message {i} " + "x" * 200, email), "role": "user" if i % 2 else "model"}
+            for i in range(messages)
+        ],
+    }
+
+    print(f"projection: user document with {messages} history messages")
+    for label, fields in (
+        ("full document", None),
+        ("snapshot fields", USER_SNAPSHOT_FIELDS),
+        ("currentQuestion", ("currentQuestion",)),
+        ("history fields", HISTORY_FIELDS),
+    ):
+        data = user if fields is None else project_fields(user, fields)
+        size, doc = _document_bytes(data)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            _helpers.decode_dict(doc.fields, None)
+        decode_ms = (time.perf_counter() - start) / repeats * 1000
+        print(f"  {label:<16} {size:>10} bytes  decode {decode_ms:7.3f}ms")
+
+    if auth_id:
+        from repository import repo
+
+        for label, read in (
+            ("full document", lambda: repo.user_ref(auth_id).get()),
+            ("snapshot fields", lambda: repo.get_user_fields(auth_id, USER_SNAPSHOT_FIELDS)),
+        ):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                read()
+            print(f"  live {label:<16} {(time.perf_counter() - start) / repeats * 1000:7.1f}ms per read")
+
+
+def _fake_llm(latency_seconds, fail_on=None):
+    """
+    Blocking stand-in for analyze_with_llm that sleeps for `latency_seconds`
+    and raises for prompts containing `fail_on`
+    """
+    def llm(prompt, system_prompt=None, response_schema=None):
+        time.sleep(latency_seconds)
+        if fail_on and fail_on in prompt:
+            raise RuntimeError("injected LLM failure")
+        if response_schema is not None:
+            return json.dumps({"analysis": "- insight", "summary": "- insight", "emotions": {"Joy": 0.6, "Sadness": 0.1}})
+        if system_prompt and "emotion" in system_prompt:
+            return '```json\n{"Joy": 0.6, "Sadness": 0.1}\n```'
+        return "- insight"
+    return llm
+
+
+def bench_journal_fanout(entries=30, latency_ms=200.0, concurrency=(1, 4, 8, 16)):
+    """
+    Runs the per-entry journal analysis against a latency-injecting fake LLM
+    and reports wall-clock time per concurrency limit.
+    """
+    from journal_analysis import analyze_entries, ANALYSIS_UNAVAILABLE
+
+    records = [
+        {"entry_id": f"entry{i}", "title": f"Day {i}", "date": i, "content": f"journal entry #{i}."}
+        for i in range(entries)
+    ]
+
+    # A failing entry must only degrade itself, and order must hold
+    results = analyze_entries(records[:6], _fake_llm(0.001, fail_on="journal entry #3."), concurrency=4, batch=False)
+    assert [result["date"] for result in results] == list(range(6)), "results out of order"
+    for index, result in enumerate(results):
+        degraded = index == 3
+        assert (result["analysis"] == ANALYSIS_UNAVAILABLE) == degraded, f"entry {index} analysis"
+        assert (result["emotions"].get("Joy") == 0) == degraded, f"entry {index} emotions"
+
+    # Timeouts degrade the entry instead of failing the report
+    results = analyze_entries(records[:2], _fake_llm(0.2), concurrency=2, timeout=0.05, batch=False)
+    assert all(result["analysis"] == ANALYSIS_UNAVAILABLE for result in results), "timeout not applied"
+
+    print(f"journal fan-out: {entries} entries, 3 LLM calls each, {latency_ms:.0f}ms per call")
+    print(f"  sequential estimate: {entries * 3 * latency_ms / 1000:.2f}s")
+    for limit in concurrency:
+        start = time.perf_counter()
+        analyze_entries(records, _fake_llm(latency_ms / 1000), concurrency=limit, structured=False)
+        print(f"  concurrency {limit:>3}: {time.perf_counter() - start:.2f}s")
+
+
+def _estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return max(1, len(text) // 4)
+
+
+def bench_entry_analysis(entries=10, base_ms=300.0, per_token_ms=5.0):
+    """
+    Compares the single structured call per journal entry with the separate
+    analysis/summary/emotion prompts against a fake LLM whose latency grows
+    with the output length, and checks the malformed-output fallback.
+    """
+    import threading
+    from journal_analysis import analyze_entries, EMOTIONS
+
+    analysis = "- Emotional state: calm but tired\n" * 40
+    summary = "- Protect your sleep schedule\n- Keep the evening walks\n"
+
+    def make_llm(malformed=False):
+        usage = {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+        lock = threading.Lock()
+
+        def llm(prompt, system_prompt="", response_schema=None):
+            if response_schema is not None:
+                reply = "not json" if malformed else json.dumps(
+                    {"analysis": analysis, "summary": summary, "emotions": {emotion: 0.2 for emotion in EMOTIONS}}
+                )
+            elif "emotion analysis" in (system_prompt or ""):
+                reply = json.dumps({emotion: 0.2 for emotion in EMOTIONS})
+            elif "Summarize" in prompt:
+                reply = summary
+            else:
+                reply = analysis
+            output_tokens = _estimate_tokens(reply)
+            with lock:
+                usage["calls"] += 1
+                usage["input_tokens"] += _estimate_tokens((system_prompt or "") + prompt)
+                usage["output_tokens"] += output_tokens
+            time.sleep((base_ms + output_tokens * per_token_ms) / 1000)
+            return reply
+        return llm, usage
+
+    records = [
+        {"entry_id": f"entry{i}", "title": f"Day {i}", "date": i, "content": "Long day at work, slept badly. " * 20}
+        for i in range(entries)
+    ]
+
+    # Malformed structured output falls back to the separate prompts
+    llm, usage = make_llm(malformed=True)
+    results = analyze_entries(records[:1], llm, concurrency=1, structured=True, batch=False)
+    assert results[0]["analysis"] == analysis and results[0]["summary"] == summary, "fallback not used"
+    assert usage["calls"] == 4, "fallback should cost one structured call plus three prompts"
+
+    print(f"entry analysis: {entries} entries, fake LLM {base_ms:g}ms + {per_token_ms:g}ms per output token")
+    for label, structured in (("three prompts", False), ("structured call", True)):
+        llm, usage = make_llm()
+        start = time.perf_counter()
+        analyze_entries(records, llm, concurrency=1, structured=structured, batch=False)
+        per_entry_ms = (time.perf_counter() - start) / entries * 1000
+        print(
+            f"  {label:<16} calls/entry {usage['calls'] / entries:.0f}  "
+            f"input tokens/entry {usage['input_tokens'] / entries:6.0f}  "
+            f"output tokens/entry {usage['output_tokens'] / entries:5.0f}  "
+            f"latency/entry {per_entry_ms:6.0f}ms"
+        )
+
+
+def bench_journal_batch(entries=30, base_ms=300.0, per_token_ms=2.0, concurrency=4, token_budget=2000):
+    """
+    Compares per-entry and batched journal analysis for request count, total
+    tokens and wall time, and checks that entries dropped from a batched
+    answer are split off and retried.
+    """
+    import re
+    import threading
+    from journal_analysis import analyze_entries, estimate_tokens, pack_batches, EMOTIONS
+
+    analysis = "- Emotional state: calm but tired\n" * 20
+    summary = "- Protect your sleep schedule\n"
+
+    def make_llm(drop_ids=()):
+        usage = {"requests": 0, "input_tokens": 0, "output_tokens": 0}
+        dropped = set()
+        lock = threading.Lock()
+
+        def item(entry_id=None):
+            result = {"analysis": analysis, "summary": summary, "emotions": {emotion: 0.2 for emotion in EMOTIONS}}
+            return {"entry_id": entry_id, **result} if entry_id is not None else result
+
+        def llm(prompt, system_prompt="", response_schema=None):
+            if response_schema is not None and response_schema.get("type") == "ARRAY":
+                ids = re.findall(r"Entry ID: (\S+)", prompt)
+                with lock:
+                    # Each listed id is left out of the first answer that contains it
+                    kept = [entry_id for entry_id in ids if entry_id not in drop_ids or entry_id in dropped]
+                    dropped.update(ids)
+                reply = json.dumps([item(entry_id) for entry_id in kept])
+            else:
+                reply = json.dumps(item())
+            output_tokens = estimate_tokens(reply)
+            with lock:
+                usage["requests"] += 1
+                usage["input_tokens"] += estimate_tokens((system_prompt or "") + prompt)
+                usage["output_tokens"] += output_tokens
+            time.sleep((base_ms + output_tokens * per_token_ms) / 1000)
+            return reply
+        return llm, usage
+
+    records = [
+        {"entry_id": f"entry{i}", "title": f"Day {i}", "date": i, "content": "Long day at work, slept badly. " * 20}
+        for i in range(entries)
+    ]
+
+    # Entries missing from a batched answer are retried, results keep their order
+    llm, usage = make_llm(drop_ids={"entry1", "entry4"})
+    results = analyze_entries(records[:6], llm, concurrency=2, batch=True, token_budget=10000)
+    assert [result["entry_id"] for result in results] == [f"entry{i}" for i in range(6)], "results out of order"
+    assert all(result["analysis"] == analysis.strip() for result in results), "missing entries were not retried"
+    assert usage["requests"] > 1, "missing entries should cost extra requests"
+
+    batches = len(pack_batches(records, token_budget))
+    print(f"journal batch: {entries} entries in {batches} batches (budget {token_budget} tokens), "
+          f"concurrency {concurrency}, fake LLM {base_ms:g}ms + {per_token_ms:g}ms per output token")
+    for label, batch in (("per-entry", False), ("batched", True)):
+        llm, usage = make_llm()
+        start = time.perf_counter()
+        analyze_entries(records, llm, concurrency=concurrency, batch=batch, token_budget=token_budget)
+        seconds = time.perf_counter() - start
+        print(
+            f"  {label:<10} requests {usage['requests']:>3}  "
+            f"total tokens {usage['input_tokens'] + usage['output_tokens']:>6}  wall {seconds:5.2f}s"
+        )
+
+
+def bench_journal_incremental(entries=30):
+    """
+    Regenerates a report over `entries` journal entries after one new entry
+    and after one edit, counting LLM requests with stored analyses reused.
+    """
+    import threading
+    from encryption import encrypt_v2, generate_data_key
+    from journal_analysis import analyze_entries_incrementally, STORED_ANALYSIS_FIELD
+
+    email = "bench@example.com"
+    data_key = generate_data_key()
+    requests = [0]
+    lock = threading.Lock()
+    base_llm = _fake_llm(0.01)
+
+    def llm(prompt, system_prompt=None, response_schema=None):
+        with lock:
+            requests[0] += 1
+        if response_schema is not None and response_schema.get("type") == "ARRAY":
+            import re
+            item = json.loads(base_llm(prompt, system_prompt, {"type": "OBJECT"}))
+            return json.dumps([{"entry_id": entry_id, **item} for entry_id in re.findall(r"Entry ID: (\S+)", prompt)])
+        return base_llm(prompt, system_prompt, response_schema)
+
+    def make_entry(i, text):
+        entry = {"entry_id": f"entry{i}", "title": f"Day {i}", "date": i, "content": text}
+        data = {"encryptedTitle": encrypt_v2(entry["title"], data_key),
+                "encryptedContent": encrypt_v2(text, data_key), "date": i}
+        return entry, data
+
+    store = {}
+    journal = [make_entry(i, f"journal entry {i}") for i in range(entries)]
+
+    def run():
+        requests[0] = 0
+        entries_list = [entry for entry, _ in journal]
+        data_list = [{**data, **store.get(entry["entry_id"], {})} for entry, data in journal]
+        results = analyze_entries_incrementally(
+            entries_list, data_list, llm, email, data_key, save=store.update
+        )
+        assert [result["entry_id"] for result in results] == [entry["entry_id"] for entry in entries_list]
+        return requests[0]
+
+    first = run()
+    journal.insert(0, make_entry(entries, "a brand new entry"))
+    journal.pop()
+    after_new = run()
+    journal[5] = make_entry(int(journal[5][0]["entry_id"][5:]), "edited text")
+    after_edit = run()
+    unchanged = run()
+    assert after_new == 1 and after_edit == 1 and unchanged == 0, (after_new, after_edit, unchanged)
+    assert all(STORED_ANALYSIS_FIELD in fields for fields in store.values())
+
+    print(f"journal incremental: {entries}-entry report, LLM requests per regeneration")
+    print(f"  first report:           {first}")
+    print(f"  after one new entry:    {after_new}")
+    print(f"  after one edited entry: {after_edit}")
+    print(f"  nothing changed:        {unchanged}")
+
+
+def _self_signed_cert(directory):
+    """Writes a localhost certificate and key for the TLS benchmarks, returns their paths"""
+    import os
+    import datetime
+    import ipaddress
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1)).not_valid_after(now + datetime.timedelta(hours=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+def bench_client_pool(requests=50):
+    """
+    Compares a new HTTP client per call (what a genai.Client per call does)
+    with one pooled keep-alive client, against a local HTTPS endpoint, so the
+    difference is the client setup and TLS handshake cost alone.
+    """
+    import ssl
+    import tempfile
+    import threading
+    import httpx
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            body = b'{"candidates": []}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, key_path = _self_signed_cert(directory)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(cert_path, key_path)
+        server.socket = server_context.wrap_socket(server.socket, server_side=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"https://127.0.0.1:{server.server_address[1]}/v1/models/gemini-2.0-flash:generateContent"
+        limits = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=120)
+
+        try:
+            start = time.perf_counter()
+            for _ in range(requests):
+                # a fresh client builds its own SSL context and connection pool
+                with httpx.Client(verify=ssl.create_default_context(cafile=cert_path), limits=limits) as client:
+                    client.post(url, json={"contents": []}).raise_for_status()
+            per_call_seconds = time.perf_counter() - start
+
+            with httpx.Client(verify=ssl.create_default_context(cafile=cert_path), limits=limits) as client:
+                client.post(url, json={"contents": []}).raise_for_status()  # warm-up
+                start = time.perf_counter()
+                for _ in range(requests):
+                    client.post(url, json={"contents": []}).raise_for_status()
+                pooled_seconds = time.perf_counter() - start
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    print(f"client pool: {requests} sequential requests to a local HTTPS endpoint")
+    print(f"  client per call: {per_call_seconds * 1000 / requests:.2f}ms/request")
+    print(f"  pooled client:   {pooled_seconds * 1000 / requests:.2f}ms/request")
+    print(f"  overhead removed per call: {(per_call_seconds - pooled_seconds) * 1000 / requests:.2f}ms "
+          f"(plus network RTTs of the TCP and TLS handshakes against a real endpoint)")
+
+    try:
+        from google import genai
+    except ImportError:
+        return
+    start = time.perf_counter()
+    for _ in range(requests):
+        genai.Client(api_key="benchmark")
+    print(f"  genai.Client construction: {(time.perf_counter() - start) * 1000 / requests:.2f}ms/client")
+
+
+class _ProviderError(Exception):
+    def __init__(self, code):
+        super().__init__(f"{code} from provider")
+        self.code = code
+
+
+def bench_gateway(requests=60, capacity=4, latency_ms=100.0, error_rate=0.05):
+    """
+    Fires `requests` concurrent LLM calls at a simulated provider that
+    answers 429 once more than `capacity` requests are in flight and 503 at
+    `error_rate`, directly and through the LLM gateway. Then takes the
+    provider down to show the circuit breaker failing fast.
+    """
+    import asyncio
+    import random
+    from llm_gateway import LLMGateway, CircuitOpenError
+
+    in_flight = [0]
+    healthy = [True]
+
+    async def provider_call():
+        if not healthy[0]:
+            await asyncio.sleep(latency_ms / 1000)
+            raise _ProviderError(503)
+        in_flight[0] += 1
+        try:
+            if in_flight[0] > capacity:
+                raise _ProviderError(429)
+            await asyncio.sleep(latency_ms / 1000)
+            if random.random() < error_rate:
+                raise _ProviderError(503)
+            return "ok"
+        finally:
+            in_flight[0] -= 1
+
+    async def direct():
+        results = await asyncio.gather(*(provider_call() for _ in range(requests)), return_exceptions=True)
+        return sum(result == "ok" for result in results)
+
+    direct_start = time.perf_counter()
+    direct_ok = asyncio.run(direct())
+    direct_seconds = time.perf_counter() - direct_start
+
+    gateway = LLMGateway(concurrency=capacity * 2, site_concurrency=capacity, rate=0, max_retries=6,
+                         backoff_base=0.05, backoff_cap=1.0, deadline_seconds=30, breaker_threshold=5,
+                         breaker_reset_seconds=60)
+
+    async def through_gateway():
+        results = await asyncio.gather(
+            *(gateway.call("bench", provider_call) for _ in range(requests)), return_exceptions=True
+        )
+        return sum(result == "ok" for result in results)
+
+    gateway_start = time.perf_counter()
+    gateway_ok = asyncio.run(through_gateway())
+    gateway_seconds = time.perf_counter() - gateway_start
+    retries = gateway.stats()["call_sites"]["bench"]["retries"]
+
+    healthy[0] = False
+
+    async def outage():
+        rejected, failed = 0, 0
+        for _ in range(20):
+            try:
+                await gateway.call("outage", provider_call)
+            except CircuitOpenError:
+                rejected += 1
+            except _ProviderError:
+                failed += 1
+        return rejected, failed
+
+    outage_start = time.perf_counter()
+    rejected, failed = asyncio.run(outage())
+    outage_seconds = time.perf_counter() - outage_start
+    gateway.close()
+
+    print(f"gateway: {requests} concurrent calls, provider capacity {capacity}, "
+          f"{latency_ms:.0f}ms latency, {error_rate:.0%} 503s")
+    print(f"  direct:  {direct_ok}/{requests} succeeded in {direct_seconds:.2f}s")
+    print(f"  gateway: {gateway_ok}/{requests} succeeded in {gateway_seconds:.2f}s ({retries} retries)")
+    print(f"  outage:  20 sequential calls, {failed} reached the provider and failed, "
+          f"{rejected} rejected by the open breaker, {outage_seconds:.2f}s total")
+
+
+def _chat_history(turns, seed=7):
+    """Synthetic decrypted history with questionnaire-length user answers"""
+    import random
+
+    rng = random.Random(seed)
+    words = ("work sleep family stress anxious weekend friends project deadline mother therapy "
+             "walk tired happy manager exercise lonely sister coffee moved city anxious panic").split()
+    history = []
+    for i in range(turns):
+        role = "assistant" if i % 2 == 0 else "user"
+        length = rng.randint(12, 25) if role == "assistant" else rng.randint(15, 80)
+        history.append({
+            "role": role,
+            "message": " ".join(rng.choice(words) for _ in range(length)).capitalize() + ".",
+            "timestamp": f"2025-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}Z",
+        })
+    return history
+
+
+def bench_prompt_budget(sizes=(100, 1000, 5000), budget=24000):
+    """
+    Prompt tokens of the data_chat_extraction history before (indent=2 JSON)
+    and after (compact, recent turns verbatim, older blocks as digests) for
+    histories of the given lengths, and the digest requests a regeneration
+    needs after ten new turns.
+    """
+    import os
+    import tempfile
+    from llm_cache import LLMCache, user_scope
+    from prompt_budget import estimate_tokens, compact, budget_history
+
+    print(f"prompt budget: data_chat_extraction history, {budget} token budget")
+    print(f"  {'turns':>6} {'indent=2':>10} {'compact':>10} {'budgeted':>10} {'digests':>8} {'+10 turns':>10}")
+    for turns in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            cache = LLMCache(path=os.path.join(directory, "cache.sqlite3"))
+            requests = [0]
+
+            def summarize(prompt):
+                def produce():
+                    requests[0] += 1
+                    return " ".join(prompt.split()[-110:])
+                return cache.generate("history_digest", "bench", prompt, produce=produce)
+
+            history = _chat_history(turns)
+            indented = estimate_tokens(json.dumps(history, indent=2))
+            compacted = estimate_tokens(compact(history))
+            with user_scope({"email": "bench@example.com"}):
+                budgeted = estimate_tokens(budget_history(history, budget, summarize=summarize))
+                first = requests[0]
+
+                requests[0] = 0
+                budget_history(history + _chat_history(10, seed=turns), budget, summarize=summarize)
+                after_new = requests[0]
+        print(f"  {turns:>6} {indented:>10} {compacted:>10} {budgeted:>10} {first:>8} {after_new:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    decrypt_parser = subparsers.add_parser("decrypt", help="derived-key cache throughput")
+    decrypt_parser.add_argument("--messages", type=int, default=200)
+    decrypt_parser.add_argument("--repeats", type=int, default=3)
+
+    many_parser = subparsers.add_parser("decrypt-many", help="serial vs pooled bulk decryption")
+    many_parser.add_argument("--messages", type=int, default=200)
+
+    envelope_parser = subparsers.add_parser("envelope", help="v1 vs v2 envelope decrypt cost")
+    envelope_parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+
+    segments_parser = subparsers.add_parser("segments", help="per-message vs packed history layout")
+    segments_parser.add_argument("--messages", type=int, default=500)
+
+    cache_parser = subparsers.add_parser("persona-cache", help="listener-backed persona cache on an in-memory store")
+    cache_parser.add_argument("--users", type=int, default=50)
+    cache_parser.add_argument("--requests", type=int, default=500)
+    cache_parser.add_argument("--rtt-ms", type=float, default=20.0)
+
+    concurrency_parser = subparsers.add_parser("concurrency", help="blocking vs async snapshot loads under concurrency")
+    concurrency_parser.add_argument("--requests", type=int, default=50)
+    concurrency_parser.add_argument("--rtt-ms", type=float, default=20.0)
+
+    projection_parser = subparsers.add_parser("projection", help="full vs field-projected user document reads")
+    projection_parser.add_argument("--messages", type=int, default=2000)
+    projection_parser.add_argument("--repeats", type=int, default=20)
+    projection_parser.add_argument("--auth-id", help="also time live reads of this user against Firestore")
+
+    fanout_parser = subparsers.add_parser("journal-fanout", help="journal analysis wall time per concurrency limit")
+    fanout_parser.add_argument("--entries", type=int, default=30)
+    fanout_parser.add_argument("--latency-ms", type=float, default=200.0)
+    fanout_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+
+    entry_parser = subparsers.add_parser("entry-analysis", help="structured call vs three prompts per journal entry")
+    entry_parser.add_argument("--entries", type=int, default=10)
+    entry_parser.add_argument("--base-ms", type=float, default=300.0)
+    entry_parser.add_argument("--per-token-ms", type=float, default=5.0)
+
+    batch_parser = subparsers.add_parser("journal-batch", help="per-entry vs batched journal analysis")
+    batch_parser.add_argument("--entries", type=int, default=30)
+    batch_parser.add_argument("--base-ms", type=float, default=300.0)
+    batch_parser.add_argument("--per-token-ms", type=float, default=2.0)
+    batch_parser.add_argument("--concurrency", type=int, default=4)
+    batch_parser.add_argument("--token-budget", type=int, default=2000)
+
+    incremental_parser = subparsers.add_parser("journal-incremental", help="LLM requests when regenerating a report")
+    incremental_parser.add_argument("--entries", type=int, default=30)
+
+    pool_parser = subparsers.add_parser("client-pool", help="client per call vs pooled keep-alive client")
+    pool_parser.add_argument("--requests", type=int, default=50)
+
+    gateway_parser = subparsers.add_parser("gateway", help="direct calls vs the LLM gateway under 429s and an outage")
+    gateway_parser.add_argument("--requests", type=int, default=60)
+    gateway_parser.add_argument("--capacity", type=int, default=4)
+    gateway_parser.add_argument("--latency-ms", type=float, default=100.0)
+    gateway_parser.add_argument("--error-rate", type=float, default=0.05)
+
+    budget_parser = subparsers.add_parser("prompt-budget", help="history prompt tokens before and after budgeting")
+    budget_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    budget_parser.add_argument("--budget", type=int, default=24000)
+
+    args = parser.parse_args()
+    if args.command == "decrypt":
+        bench_decrypt(args.messages, args.repeats)
+    elif args.command == "decrypt-many":
+        bench_decrypt_many(args.messages)
+    elif args.command == "envelope":
+        bench_envelope(args.sizes)
+    elif args.command == "segments":
+        bench_segments(args.messages)
+    elif args.command == "persona-cache":
+        bench_persona_cache(args.users, args.requests, args.rtt_ms)
+    elif args.command == "concurrency":
+        bench_concurrency(args.requests, args.rtt_ms)
+    elif args.command == "projection":
+        bench_projection(args.messages, args.repeats, args.auth_id)
+    elif args.command == "journal-fanout":
+        bench_journal_fanout(args.entries, args.latency_ms, args.concurrency)
+    elif args.command == "entry-analysis":
+        bench_entry_analysis(args.entries, args.base_ms, args.per_token_ms)
+    elif args.command == "journal-batch":
+        bench_journal_batch(args.entries, args.base_ms, args.per_token_ms, args.concurrency, args.token_budget)
+    elif args.command == "journal-incremental":
+        bench_journal_incremental(args.entries)
+    elif args.command == "client-pool":
+        bench_client_pool(args.requests)
+    elif args.command == "gateway":
+        bench_gateway(args.requests, args.capacity, args.latency_ms, args.error_rate)
+    elif args.command == "prompt-budget":
+        bench_prompt_budget(args.sizes, args.budget)
+
+
+if __name__ == "__main__":
+    main()
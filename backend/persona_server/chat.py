@@ -1,16 +1,15 @@
 import os
-from google import genai
+import time
 from google.genai import types
+from llm_cache import generate_text
+from llm_clients import get_vertex_client
+from llm_gateway import gateway, genai_stream
 
 # Set credentials for Vertex AI
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "hackathons-423418-ca6c603344c4.json"
-def reflection_chatbot(user_info=None, user_message=None):
-    client = genai.Client(
-        vertexai=True,
-        project="hackathons-423418",
-        location="us-central1",  # Make sure this matches your RAG corpus location
-    )
 
+def _chat_request(user_info=None, user_message=None):
+    """Builds the model, prompt contents and generation config for a chat reply"""
     model = "gemini-2.0-flash"  # Use a supported Gemini model
 
     # Format user inputs into the system prompt
@@ -63,15 +62,63 @@ User Message:
         tools=tools,
     )
 
-    # Collect response from model stream
-    response_text = ""
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        if chunk.candidates and chunk.candidates[0].content:
-            for part in chunk.candidates[0].content.parts:
-                response_text += part.text
-    
-    return response_text
+    return model, contents, generate_content_config
+
+
+def reflection_chatbot(user_info=None, user_message=None):
+    model, contents, generate_content_config = _chat_request(user_info, user_message)
+
+    # Collect response from model stream; chat replies are never cached
+    return generate_text(
+        get_vertex_client(), "reflection_chatbot", model, contents, generate_content_config, stream=True, use_cache=False
+    )
+
+
+# Call site of /chat/stream, whose stream stats /metrics reports as chat_stream
+CHAT_STREAM_CALL_SITE = "reflection_chatbot_stream"
+
+
+async def reflection_chatbot_stream(user_info=None, user_message=None, call_site=CHAT_STREAM_CALL_SITE):
+    """
+    Streams the chat reply as text chunks as soon as the model produces them
+
+    The stream runs through the LLM gateway. Closing the generator early
+    (e.g. when the HTTP client disconnects) closes the upstream model
+    stream, so no further tokens are generated.
+
+    Args:
+        user_info: Persona information for the system prompt
+        user_message: The user's message
+        call_site: Name the gateway reports the request and the stream's
+            outcome, time to first token and duration under
+
+    Yields:
+        str: Reply text chunks in order
+    """
+    model, contents, generate_content_config = _chat_request(user_info, user_message)
+    start = time.perf_counter()
+    ttft = None
+    outcome = "cancelled"
+    chunks = gateway.stream(call_site, genai_stream(get_vertex_client(), model, contents, generate_content_config))
+    try:
+        async for text in chunks:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            yield text
+        outcome = "completed"
+    except Exception:
+        outcome = "errors"
+        raise
+    finally:
+        await chunks.aclose()
+        duration = time.perf_counter() - start if outcome == "completed" else None
+        gateway.record_stream(call_site, outcome, ttft_seconds=ttft, duration_seconds=duration)
+
+
+async def reflection_chatbot_async(user_info=None, user_message=None):
+    """
+    Buffered variant of reflection_chatbot_stream returning the whole reply;
+    reported to the gateway as "reflection_chatbot", apart from /chat/stream
+    """
+    chunks = reflection_chatbot_stream(user_info, user_message, call_site="reflection_chatbot")
+    return "".join([text async for text in chunks])
@@ -6,6 +6,8 @@ import re
 import pandas as pd
 from google import genai
 from google.genai import types
+from llm_cache import generate_text
+from llm_clients import get_api_key_client, get_vertex_client
 
 
 
@@ -15,8 +17,8 @@ load_dotenv()
 # Read the API key from the environment
 api_key = os.getenv("NEXT_PUBLIC_GEMINI_API_KEY")
 
-# Initialize the genai client with the API key
-client = genai.Client(api_key=api_key)
+# Shared genai client with the API key
+client = get_api_key_client()
 # Set credentials for Vertex AI
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "secrets/hackathons-423418-ca6c603344c4.json"
 
@@ -101,12 +103,7 @@ Extract relevant information from the provided JSON and return the data strictly
 
     # Use the correct Gemini model
       
-    response = client.models.generate_content(
-    model="gemini-2.0-flash",
-    contents=prompt,
-      )
-
-    extracted_data=response.text
+    extracted_data = generate_text(client, "extract_information_gemini", "gemini-2.0-flash", prompt)
     if isinstance(extracted_data, str):
             
           extracted_data = re.sub(r"```json\n|\n```", "", extracted_data).strip()
@@ -167,12 +164,7 @@ Extract all relevant information that relates to **self-perception**, **relation
     # Use the correct Gemini model
   
         
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt,
-    )
-
-    extracted_data=response.text
+    extracted_data = generate_text(client, "extract_graph_info", "gemini-2.0-flash", prompt)
     if isinstance(extracted_data, str):
         
         extracted_data = re.sub(r"```json\n|\n```", "", extracted_data).strip()
@@ -188,11 +180,7 @@ Extract all relevant information that relates to **self-perception**, **relation
 
 
 def generate_rag(chat_data=None, journal_analysis=None):
-    client = genai.Client(
-        vertexai=True,
-        project="hackathons-423418",
-        location="us-central1",  # Make sure this matches your RAG corpus location
-    )
+    client = get_vertex_client()
 
     model = "gemini-2.0-flash"  # Use a supported Gemini model
 
@@ -258,15 +246,5 @@ Format the output as JSON with these sections as keys.
         tools=tools,
     )
 
-    # Collect response from model stream
-    response_text = ""
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    ):
-        if chunk.candidates and chunk.candidates[0].content:
-            for part in chunk.candidates[0].content.parts:
-                response_text += part.text
-    
-    return response_text
\ No newline at end of file
+    # Collect response from model stream (cached: same inputs, same seed)
+    return generate_text(client, "generate_rag", model, contents, generate_content_config, stream=True)
\ No newline at end of file
@@ -2,9 +2,6 @@ import os
 from dotenv import load_dotenv
 from google import genai
 import json
-import firebase_admin
-from firebase_admin import credentials
-from google.cloud import firestore
 import re
 import pandas as pd
 from reportlab.lib.units import inch
@@ -21,10 +18,10 @@ from weasyprint import HTML, CSS
 import os
 from dotenv import load_dotenv
 from google import genai
+from google.genai import types
+from llm_cache import generate_text, user_scope
+from llm_clients import get_api_key_client
 import json
-import firebase_admin
-from firebase_admin import credentials
-from google.cloud import firestore
 import re
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -38,24 +35,25 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Page
 from math import pi
 from datetime import datetime
 from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT, TA_JUSTIFY
-from encryption import decrypt
+from encryption import decrypt, decrypt_many, get_user_data_key
+from history import iter_decoded_history
+from prompt_budget import budget_for, budget_history, budget_json, estimate_tokens
 # Load environment variables
 load_dotenv()
 
 # Read the API key from the environment
 api_key = os.getenv("NEXT_PUBLIC_GEMINI_API_KEY")
 
-# Initialize Gemini client with API key from environment
-client = genai.Client(api_key=api_key)
+# Shared Gemini client with API key from environment
+client = get_api_key_client()
 
-# Initialize Firebase Admin
-cred = credentials.Certificate("service.json")
-firebase_admin.initialize_app(cred)
+# Shared Firestore access layer
+from repository import repo, async_repo, HISTORY_FIELDS, USER_SNAPSHOT_FIELDS
+import asyncio
+from journal_analysis import analyze_entries_incrementally, EMOTIONS
 
-# Initialize Firestore client using the same credentials
-db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
-
-EMOTIONS = ["Joy", "Sadness", "Anger", "Fear", "Surprise", "Disgust", "Neutral"]
+# Number of latest journal entries fed into the persona analysis
+PERSONA_JOURNAL_ENTRIES = 5
 
 
 def json_to_md(json_data):
@@ -89,16 +87,14 @@ def json_to_md(json_data):
 
 
 
-    """+ json.dumps(json_data, indent=4)
+    """
+    prompt += budget_json(json_data, budget_for("json_to_md") - estimate_tokens(prompt))
     
 
     
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt,
-        )
-        return response.text if response else "Error generating Markdown."
+        response_text = generate_text(client, "json_to_md", "gemini-2.0-flash", prompt)
+        return response_text if response_text else "Error generating Markdown."
     except Exception as e:
         return f"Error: {str(e)}"
 
@@ -605,7 +601,12 @@ def enhance_markdown_content(markdown_content):
 
 
 
-def data_chat_extraction(authId, response_format="json"):
+def summarize_history_block(prompt):
+    """Digest of an older block of chat history; identical blocks are served from the LLM cache"""
+    return generate_text(client, "history_digest", "gemini-2.0-flash", prompt)
+
+
+def data_chat_extraction(authId, response_format="json", snapshot=None, history_data=None, history_pages=None):
     prompt = """
 **#role**  
 You are an advanced data extraction system designed to process therapy questionnaire responses and convert them into structured JSON format. Your goal is to extract key details while maintaining accuracy, completeness, and logical structuring.  
@@ -634,57 +635,44 @@ You are an advanced data extraction system designed to process therapy questionn
 Input:
 """
 
-    document_id = authId
-    doc_ref = db.collection('users').document(document_id)
-    doc = doc_ref.get()
+    # History is not part of the request snapshot, so it is read on its own
+    # (legacy array projected to HISTORY_FIELDS, then the messages
+    # subcollection page by page) unless the caller already did
+    if history_data is not None:
+        data = history_data
+    elif snapshot is not None and not snapshot.exists:
+        data = None
+    else:
+        data = repo.get_user_fields(authId, HISTORY_FIELDS)
 
-    if not doc.exists:
+    if data is None:
         return {"error": "Document not found"}
 
-    data = doc.to_dict()
-    user_history = data.get('userHistory')
     user_email = data.get('email')
 
-    if not user_history:
-        return {"error": "User history not found"}
-    
     if not user_email:
         return {"error": "User email not found - required for decryption"}
 
-    # Decrypt the user history
-    decrypted_user_history = []
-    
-    for entry in user_history:
-        if isinstance(entry, dict):
-            decrypted_entry = {}
-            for key, value in entry.items():
-                # Check if this field contains encrypted data
-                if key == 'encryptedMessage' and value:
-                    try:
-                        # Decrypt using user's email as encryption key
-                        decrypted_message = decrypt(value, user_email)
-                        decrypted_entry['message'] = decrypted_message
-                    except Exception as e:
-                        print(f"Failed to decrypt message: {e}")
-                        # If decryption fails, mark it as encrypted data that couldn't be decrypted
-                        decrypted_entry['message'] = "[ENCRYPTED_DATA_COULD_NOT_DECRYPT]"
-                else:
-                    # Copy other fields as-is
-                    decrypted_entry[key] = value
-            
-            decrypted_user_history.append(decrypted_entry)
-        else:
-            # If entry is not a dict, keep as-is
-            decrypted_user_history.append(entry)
+    if history_pages is None:
+        history_pages = repo.iter_history_pages(authId, user_history=data.get('userHistory') or [])
 
-    prompt += json.dumps(decrypted_user_history, indent=2)
+    # Decrypt legacy messages and packed segments one page at a time
+    # Failed items come back as [ENCRYPTED_DATA_COULD_NOT_DECRYPT]
+    data_key = get_user_data_key(data, user_email)
+    decrypted_user_history = list(iter_decoded_history(history_pages, user_email, data_key))
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt,
-    )
+    if not decrypted_user_history:
+        return {"error": "User history not found"}
+
+    # Recent turns verbatim, older ones as cached block digests
+    with user_scope(data, data_key):
+        prompt += budget_history(
+            decrypted_user_history,
+            budget_for("data_chat_extraction") - estimate_tokens(prompt),
+            summarize=summarize_history_block,
+        )
 
-    response_text = response.candidates[0].content.parts[0].text.strip()
+        response_text = generate_text(client, "data_chat_extraction", "gemini-2.0-flash", prompt).strip()
     response_text = response_text.replace("```json", "").replace("```", "")
 
     if response_format == "json":
@@ -708,156 +696,120 @@ Input:
 
 
 
+async def data_chat_extraction_async(authId, response_format="json", snapshot=None):
+    """
+    Async variant of data_chat_extraction: reads the user document and the
+    message pages through the AsyncClient, then runs decryption and the LLM
+    call in a worker thread.
+    """
+    if snapshot is not None and not snapshot.exists:
+        return {"error": "Document not found"}
+    history_data = await async_repo.get_user_fields(authId, HISTORY_FIELDS)
+    if history_data is None:
+        return {"error": "Document not found"}
+    history_pages = [
+        page async for page in async_repo.iter_history_pages(authId, user_history=history_data.get('userHistory') or [])
+    ]
+    return await asyncio.to_thread(
+        data_chat_extraction, authId, response_format, snapshot, history_data, history_pages
+    )
+
+
 import pandas as pd
 import json
-from google.cloud import firestore
 
 
-def analyze_with_llm(prompt, system_prompt="You are an expert psychologist analyzing journal entries."):
+def decrypt_journal_docs(docs, user_email, default_title="", data_key=None):
+    """
+    Decrypts the title and content of journal entry snapshots in two batched calls.
+    `data_key` is the user's unwrapped data key, needed for v2 envelopes.
+
+    Returns one (doc_id, entry_data, title, content) tuple per snapshot, in order.
+    Unencrypted entries fall back to their plain "title"/"content" fields.
+    """
+    entries_data = [doc.to_dict() for doc in docs]
+
+    encrypted_titles = [data["encryptedTitle"] for data in entries_data if data.get("encryptedTitle")]
+    encrypted_contents = [data["encryptedContent"] for data in entries_data if data.get("encryptedContent")]
+    titles = iter(decrypt_many(encrypted_titles, user_email, "[ENCRYPTED_TITLE_COULD_NOT_DECRYPT]", data_key))
+    contents = iter(decrypt_many(encrypted_contents, user_email, "[ENCRYPTED_CONTENT_COULD_NOT_DECRYPT]", data_key))
+
+    decrypted = []
+    for doc, data in zip(docs, entries_data):
+        if data.get("encryptedTitle"):
+            title = next(titles)
+        else:
+            title = data.get("title", default_title)
+
+        if data.get("encryptedContent"):
+            content = next(contents)
+        else:
+            content = data.get("content", "")
+
+        decrypted.append((doc.id, data, title, content))
+    return decrypted
+
+
+def analyze_with_llm(prompt, system_prompt="You are an expert psychologist analyzing journal entries.", response_schema=None):
     full_prompt = f"{system_prompt}\n\n{prompt}"
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=[full_prompt],  # <-- must be a list of strings or Part instances
-       
-    )
+    # With a response schema the reply is JSON matching it
+    config = None
+    if response_schema is not None:
+        config = types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=response_schema,
+        )
 
-    return response.text
+    # <-- contents must be a list of strings or Part instances
+    return generate_text(client, "analyze_with_llm", "gemini-2.0-flash", [full_prompt], config)
 
 
 # Your analysis pipeline
-def analyze_journal_entries(authId):
+def analyze_journal_entries(authId, snapshot=None, journal_docs=None):
     try:
-        # Firestore client
-        db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
-
         # First, get the user's email for decryption
-        user_doc_ref = db.collection("users").document(authId)
-        user_doc = user_doc_ref.get()
+        user_data = snapshot.data if snapshot is not None else repo.get_user_fields(authId, USER_SNAPSHOT_FIELDS)
         
-        if not user_doc.exists:
+        if user_data is None:
             print(f"User document not found for {authId}")
             return {"entries": [], "analysis": "User not found."}
         
-        user_data = user_doc.to_dict()
         user_email = user_data.get('email')
         
         if not user_email:
             print(f"User email not found for {authId}")
             return {"entries": [], "analysis": "User email not found - required for decryption."}
 
-        # Fetch latest 10 journal entries for the user
-        journal_ref = db.collection("users").document(authId).collection("journalEntries")
-        
-        # Check if the collection exists by trying to get the first document
-        first_doc = next(journal_ref.limit(1).stream(), None)
-        if not first_doc:
+        # Fetch latest journal entries for the user, unless the caller already did
+        if journal_docs is None:
+            journal_docs = repo.latest_journal_entries(authId, PERSONA_JOURNAL_ENTRIES)
+        if not journal_docs:
             print(f"No journal entries found for user {authId}")
             return {"entries": [], "analysis": "No journal entries available for analysis."}
-
-        # If collection exists, proceed with fetching entries
-        query = journal_ref.order_by("date", direction=firestore.Query.DESCENDING).limit(5)
-        snapshot = query.stream()
         
         # Process entries and handle encryption
+        data_key = get_user_data_key(user_data, user_email)
         entries = []
-        for doc in snapshot:
-            entry_data = doc.to_dict()
-            
-            # Initialize variables for title and content
-            title = "Untitled"
-            content = ""
-            
-            # Handle encrypted or unencrypted title
-            if "encryptedTitle" in entry_data and entry_data["encryptedTitle"]:
-                try:
-                    title = decrypt(entry_data["encryptedTitle"], user_email)
-                except Exception as e:
-                    print(f"Failed to decrypt title for entry {doc.id}: {e}")
-                    title = "[ENCRYPTED_TITLE_COULD_NOT_DECRYPT]"
-            elif "title" in entry_data:
-                title = entry_data.get("title", "Untitled")
-            
-            # Handle encrypted or unencrypted content
-            if "encryptedContent" in entry_data and entry_data["encryptedContent"]:
-                try:
-                    content = decrypt(entry_data["encryptedContent"], user_email)
-                except Exception as e:
-                    print(f"Failed to decrypt content for entry {doc.id}: {e}")
-                    content = "[ENCRYPTED_CONTENT_COULD_NOT_DECRYPT]"
-            elif "content" in entry_data:
-                content = entry_data.get("content", "")
-            
+        entries_data = []
+        for entry_id, entry_data, title, content in decrypt_journal_docs(journal_docs, user_email, "Untitled", data_key):
             entries.append({
-                "entry_id": doc.id,
+                "entry_id": entry_id,
                 "title": title,
                 "content": content,
                 "date": entry_data.get("date", datetime.now())
             })
+            entries_data.append(entry_data)
 
         if not entries:
             return {"entries": [], "analysis": "No journal entries available for analysis."}
 
-        # Convert entries to DataFrame for analysis
-        entries_df = pd.DataFrame(entries)
-        
-        # Rest of your existing analysis code...
-        analysis_results = []
-        for _, entry in entries_df.iterrows():
-            analysis_prompt = f"""
-            Analyze this journal entry as a psychologist. Focus on key insights and actionable takeaways:
-
-            Title: {entry['title']}
-            Date: {entry['date']}
-            Content: {entry['content']}
-
-            Provide a concise yet comprehensive analysis covering:
-            1. Emotional state (primary and secondary emotions)
-            2. Cognitive patterns (positive/negative, rational/irrational)
-            3. Stress indicators and coping mechanisms
-            4. Notable behavioral patterns
-            5. Key concerns or growth opportunities
-            6. Specific recommendations for improvement
-
-            Format your response with clear bullet points for each category.
-            """
-            analysis_text = analyze_with_llm(analysis_prompt)
-
-            summary_prompt = f"""
-            Summarize this psychological analysis into 1-2 key actionable insights from the journal entry:
-            {analysis_text}
-
-            Focus on the most important takeaways that the journal writer should pay attention to.
-            Format as bullet points.
-            """
-            summary_text = analyze_with_llm(summary_prompt)
-
-            emotion_prompt = f"""
-            Analyze this journal entry and quantify the emotional content:
-            {entry['content']}
-
-            Return ONLY a JSON dictionary with values between 0-1 for these emotions: 
-            {EMOTIONS}
-            Example: {{"Joy": 0.5, "Sadness": 0.3, ...}}
-            """
-            try:
-                emotion_json = analyze_with_llm(
-                    emotion_prompt,
-                    system_prompt="You are an emotion analysis tool. Return ONLY valid JSON.",
-                )
-                emotion_data = json.loads(emotion_json.strip("`").replace("json\n", ""))
-            except:
-                emotion_data = {e: 0 for e in EMOTIONS}
-
-            analysis_results.append({
-                "entry_id": entry["entry_id"],
-                "date": entry["date"],
-                "title": entry["title"],
-                "content": entry["content"],
-                "analysis": analysis_text,
-                "summary": summary_text,
-                "emotions": emotion_data,
-            })
+        # Analyze new or edited entries concurrently, results keep the query's date order
+        with user_scope(user_data, data_key):
+            analysis_results = analyze_entries_incrementally(
+                entries, entries_data, analyze_with_llm, user_email, data_key,
+                save=lambda updates: repo.save_journal_fields(authId, updates),
+            )
 
         analysis_df = pd.DataFrame(analysis_results)
         print("Analysis complete.")
@@ -879,20 +831,40 @@ def analyze_journal_entries(authId):
         return {"entries": [], "analysis": "Error analyzing journal entries."}
 
 
+async def analyze_journal_entries_async(authId, snapshot=None):
+    """
+    Async variant of analyze_journal_entries: Firestore reads go through the
+    AsyncClient and the analysis itself runs in a worker thread.
+    """
+    if snapshot is None:
+        snapshot = await async_repo.load_user_snapshot(authId)
+    journal_docs = None
+    if snapshot.exists:
+        try:
+            journal_docs = await async_repo.latest_journal_entries(authId, PERSONA_JOURNAL_ENTRIES)
+        except Exception as e:
+            print(f"Error analyzing journal entries for user {authId}: {str(e)}")
+            return {"entries": [], "analysis": "Error analyzing journal entries."}
+    return await asyncio.to_thread(analyze_journal_entries, authId, snapshot, journal_docs)
+
+
 # Set modern visualization style
 plt.style.use('seaborn-v0_8-whitegrid')
 sns.set_palette("viridis")
 
-def analyze_with_llm_1(prompt, system_prompt="You are an expert psychologist analyzing journal entries."):
+def analyze_with_llm_1(prompt, system_prompt="You are an expert psychologist analyzing journal entries.", response_schema=None):
     full_prompt = f"{system_prompt}\n\n{prompt}"
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=[full_prompt],  # <-- must be a list of strings or Part instances
-       
-    )
+    # With a response schema the reply is JSON matching it
+    config = None
+    if response_schema is not None:
+        config = types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=response_schema,
+        )
 
-    return response.text
+    # <-- contents must be a list of strings or Part instances
+    return generate_text(client, "analyze_with_llm_1", "gemini-2.0-flash", [full_prompt], config)
 
 def generate_visualizations(analysis_df,filename):
     """Generate professional visualizations with proper error handling"""
@@ -1681,7 +1653,7 @@ def format_text_for_pdf(text):
     
     return text
 
-def gen_worklogpdf(authId, numdays, filename):
+def gen_worklogpdf(authId, numdays, filename, snapshot=None, journal_docs=None):
     """
     Main function to generate psychological journal analysis PDF report
     
@@ -1689,6 +1661,8 @@ def gen_worklogpdf(authId, numdays, filename):
         authId (str): User authentication ID for Firestore query
         numdays (int): Number of days/entries to analyze
         filename (str): Base filename for generated files
+        snapshot (UserSnapshot): Request-scoped user snapshot, loaded if omitted
+        journal_docs (list): Pre-fetched journal entry snapshots, queried if omitted
         
     Returns:
         dict: Result containing either success with path or error information
@@ -1699,13 +1673,10 @@ def gen_worklogpdf(authId, numdays, filename):
     try:
         # Step 1: Retrieve journal entries from Firestore
         print("Step 1/4: Retrieving journal entries...")
-        # Use the already initialized db from your setup
-        
         # First, get the user's email for decryption
-        user_doc_ref = db.collection("users").document(authId)
-        user_doc = user_doc_ref.get()
+        user_data = snapshot.data if snapshot is not None else repo.get_user_fields(authId, USER_SNAPSHOT_FIELDS)
         
-        if not user_doc.exists:
+        if user_data is None:
             print(f"User document not found for {authId}")
             return {
                 "success": False,
@@ -1713,7 +1684,6 @@ def gen_worklogpdf(authId, numdays, filename):
                 "error_code": "USER_NOT_FOUND"
             }
         
-        user_data = user_doc.to_dict()
         user_email = user_data.get('email')
         
         if not user_email:
@@ -1724,45 +1694,21 @@ def gen_worklogpdf(authId, numdays, filename):
                 "error_code": "EMAIL_NOT_FOUND"
             }
         
-        journal_ref = db.collection("users").document(authId).collection("journalEntries")
-        query = journal_ref.order_by("date", direction=firestore.Query.DESCENDING).limit(numdays)
-        snapshot = query.stream()
+        if journal_docs is None:
+            journal_docs = repo.latest_journal_entries(authId, numdays)
 
         # Convert to DataFrame-compatible structure and handle encryption
+        data_key = get_user_data_key(user_data, user_email)
         records = []
-        for doc in snapshot:
-            data = doc.to_dict()
-            
-            # Initialize variables for title and content
-            title = ""
-            content = ""
-            
-            # Handle encrypted or unencrypted title
-            if "encryptedTitle" in data and data["encryptedTitle"]:
-                try:
-                    title = decrypt(data["encryptedTitle"], user_email)
-                except Exception as e:
-                    print(f"Failed to decrypt title for entry {doc.id}: {e}")
-                    title = "[ENCRYPTED_TITLE_COULD_NOT_DECRYPT]"
-            elif "title" in data:
-                title = data.get("title", "")
-            
-            # Handle encrypted or unencrypted content
-            if "encryptedContent" in data and data["encryptedContent"]:
-                try:
-                    content = decrypt(data["encryptedContent"], user_email)
-                except Exception as e:
-                    print(f"Failed to decrypt content for entry {doc.id}: {e}")
-                    content = "[ENCRYPTED_CONTENT_COULD_NOT_DECRYPT]"
-            elif "content" in data:
-                content = data.get("content", "")
-            
+        records_data = []
+        for entry_id, data, title, content in decrypt_journal_docs(journal_docs, user_email, data_key=data_key):
             records.append({
-                "entry_id": doc.id,
+                "entry_id": entry_id,
                 "title": title,
                 "date": data.get("date"),
                 "content": content
             })
+            records_data.append(data)
 
         # Check if we have enough entries
         if not records:
@@ -1786,69 +1732,11 @@ def gen_worklogpdf(authId, numdays, filename):
 
         # Step 2: Analyze entries with LLM
         print("Step 2/4: Analyzing entries...")
-        analysis_results = []
-        
-        for _, entry in entries_df.iterrows():
-            # Comprehensive psychological analysis
-            analysis_prompt = f"""
-            Analyze this journal entry as a psychologist. Focus on key insights and actionable takeaways:
-
-            Title: {entry['title']}
-            Date: {entry['date']}
-            Content: {entry['content']}
-
-            Provide a concise yet comprehensive analysis covering:
-            1. Emotional state (primary and secondary emotions)
-            2. Cognitive patterns (positive/negative, rational/irrational)
-            3. Stress indicators and coping mechanisms
-            4. Notable behavioral patterns
-            5. Key concerns or growth opportunities
-            6. Specific recommendations for improvement
-
-            Format your response with clear bullet points for each category.
-            """
-            analysis_text = analyze_with_llm_1(analysis_prompt)
-
-            # Generate summary
-            summary_prompt = f"""
-            Summarize this psychological analysis into 1-2 key actionable insights from the journal entry:
-            {analysis_text}
-
-            Focus on the most important takeaways that the journal writer should pay attention to.
-            Format as bullet points.
-            """
-            summary_text = analyze_with_llm_1(summary_prompt)
-
-            # Emotion quantification
-            emotion_prompt = f"""
-            Analyze this journal entry and quantify the emotional content:
-            {entry['content']}
-
-            Return ONLY a JSON dictionary with values between 0-1 for these emotions: 
-            {EMOTIONS}
-            Example: {{"Joy": 0.5, "Sadness": 0.3, "Anger": 0.1, "Fear": 0.2, "Surprise": 0.0, "Disgust": 0.0, "Trust": 0.4, "Anticipation": 0.3}}
-            """
-            try:
-                emotion_json = analyze_with_llm_1(
-                    emotion_prompt,
-                    system_prompt="You are an emotion analysis tool. Return ONLY valid JSON.",
-                )
-                # Clean the JSON response
-                emotion_json_clean = emotion_json.strip().strip('`').replace('json\n', '').replace('json', '')
-                emotion_data = json.loads(emotion_json_clean)
-            except Exception as e:
-                print(f"Error parsing emotion data: {e}")
-                emotion_data = {e: 0 for e in EMOTIONS}
-
-            analysis_results.append({
-                "entry_id": entry["entry_id"],
-                "date": entry["date"],
-                "title": entry["title"],
-                "content": entry["content"],
-                "analysis": analysis_text,
-                "summary": summary_text,
-                "emotions": emotion_data,
-            })
+        with user_scope(user_data, data_key):
+            analysis_results = analyze_entries_incrementally(
+                records, records_data, analyze_with_llm_1, user_email, data_key,
+                save=lambda updates: repo.save_journal_fields(authId, updates),
+            )
 
         analysis_df = pd.DataFrame(analysis_results)
         print("Analysis complete.")
@@ -1878,6 +1766,27 @@ def gen_worklogpdf(authId, numdays, filename):
 
 
 
+async def gen_worklogpdf_async(authId, numdays, filename, snapshot=None):
+    """
+    Async variant of gen_worklogpdf: Firestore reads go through the
+    AsyncClient and analysis/PDF generation run in a worker thread.
+    """
+    if snapshot is None:
+        snapshot = await async_repo.load_user_snapshot(authId)
+    journal_docs = None
+    if snapshot.exists:
+        try:
+            journal_docs = await async_repo.latest_journal_entries(authId, numdays)
+        except Exception as e:
+            print(f"Error generating report: {e}")
+            return {
+                "success": False,
+                "error": f"An error occurred while generating the report: {str(e)}",
+                "error_code": "GENERATION_ERROR"
+            }
+    return await asyncio.to_thread(gen_worklogpdf, authId, numdays, filename, snapshot, journal_docs)
+
+
 def create_pdf_from_json_chat(json_data, output_filename="psychological_assessment.pdf"):
     """
     Generate a PDF report from psychological assessment JSON data.
@@ -1,81 +1,97 @@
 import asyncio
-from data import data_chat_extraction, analyze_journal_entries
+from data import data_chat_extraction_async, analyze_journal_entries_async
 from conv import extract_information_gemini, generate_rag, extract_graph_info
 
-import firebase_admin
-from firebase_admin import credentials
-from google.cloud import firestore
+from repository import repo, async_repo
+from llm_cache import user_scope
 import json
 
-# Initialize Firebase Admin
-cred = credentials.Certificate("service.json")
-
-def isPersonaUpdateNeeded(authId=None, updateRequired=None):
-    db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
-
+def isPersonaUpdateNeeded(authId=None, updateRequired=None, snapshot=None):
     if updateRequired is not None:
         # If updated is provided, update the user's persona update status
-        user_ref = db.collection("users").document(authId)
-        user_ref.set({"updatePersona": updateRequired}, merge=True)
+        repo.set_user_fields(authId, {"updatePersona": updateRequired})
+        if snapshot is not None and snapshot.data is not None:
+            snapshot.data["updatePersona"] = updateRequired
         return updateRequired
 
-    user_ref = db.collection("users").document(authId)
-    user_doc = user_ref.get()
-    if user_doc.exists:
-        updateNeeded = user_doc.to_dict().get("updatePersona", True)
+    if snapshot is not None:
+        return snapshot.update_needed
+
+    user_data = repo.get_user_fields(authId, ["updatePersona"])
+    if user_data is not None:
+        updateNeeded = user_data.get("updatePersona", True)
         return updateNeeded
     return True
 
-def personaInfo(authId=None, newInfo=None):
-    db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
-
-    user_ref = db.collection("users").document(authId)
-    persona_ref = user_ref.collection("persona")
-    doc_snapshots = persona_ref.get()
-    
+def personaInfo(authId=None, newInfo=None, snapshot=None):
     if(newInfo is not None):
-        # If newInfo is provided, update or create the document
-        if doc_snapshots:
-            # Update the first document if it exists
-            first_doc = doc_snapshots[0]
-            first_doc.reference.set({"Info": newInfo, "Date": firestore.SERVER_TIMESTAMP}, merge=True)
-        else:
-            # Create a new document with the provided info
-            persona_ref.add({"Info": newInfo, "Date": firestore.SERVER_TIMESTAMP})
+        # If newInfo is provided, update or create the persona document
+        repo.save_persona_info(authId, newInfo)
+        if snapshot is not None:
+            snapshot.persona = {**(snapshot.persona or {}), "Info": newInfo}
+        return newInfo
 
     # If no newInfo is provided, just retrieve the existing info
-    # Initialize persona_info_value to None
-    # Retrieve the "Info" field from the first document in the collection
-
-    persona_info_value = None
-    if doc_snapshots: 
-        first_doc_data = doc_snapshots[0].to_dict()
-        if first_doc_data: # Check if to_dict() returned a dictionary (it should if doc exists)
-            persona_info_value = first_doc_data.get("Info") # Get the "Info" field
+    if snapshot is not None:
+        return snapshot.persona_info
+
+    persona_data = repo.get_persona(authId)
+    persona_info_value = persona_data.get("Info") if persona_data else None # Get the "Info" field
     # print(f"Persona Info Value: {persona_info_value}")  # Debugging line to check the value
     return persona_info_value
     
-async def updatePersona(authId=None, user_message=None):
-    db = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
+async def isPersonaUpdateNeededAsync(authId=None, updateRequired=None, snapshot=None):
+    """Async variant of isPersonaUpdateNeeded built on the AsyncClient"""
+    if updateRequired is not None:
+        await async_repo.set_user_fields(authId, {"updatePersona": updateRequired})
+        if snapshot is not None and snapshot.data is not None:
+            snapshot.data["updatePersona"] = updateRequired
+        return updateRequired
+
+    if snapshot is None:
+        snapshot = await async_repo.load_user_snapshot(authId)
+    return snapshot.update_needed
+
+async def personaInfoAsync(authId=None, newInfo=None, snapshot=None):
+    """Async variant of personaInfo built on the AsyncClient"""
+    if newInfo is not None:
+        await async_repo.save_persona_info(authId, newInfo)
+        if snapshot is not None:
+            snapshot.persona = {**(snapshot.persona or {}), "Info": newInfo}
+        return newInfo
+
+    if snapshot is not None:
+        return snapshot.persona_info
+
+    persona_data = await async_repo.get_persona(authId)
+    return persona_data.get("Info") if persona_data else None
+
+async def updatePersona(authId=None, user_message=None, snapshot=None):
+    if snapshot is None:
+        snapshot = await async_repo.load_user_snapshot(authId)
 
-    # Step 1: Extract chat + journal data using authId
-    chat_data = data_chat_extraction(authId, "json")
-    journal_json = analyze_journal_entries(authId)
+    # Responses to prompts built from this user's data are cached under their key
+    with user_scope(snapshot.data):
+        # Step 1: Extract chat + journal data using authId
+        chat_data, journal_json = await asyncio.gather(
+            data_chat_extraction_async(authId, "json", snapshot=snapshot),
+            analyze_journal_entries_async(authId, snapshot=snapshot),
+        )
 
-    # Step 2: Generate combined RAG result
-    rag_result = generate_rag(chat_data=chat_data, journal_analysis=journal_json)
+        # Step 2: Generate combined RAG result
+        rag_result = await asyncio.to_thread(generate_rag, chat_data=chat_data, journal_analysis=journal_json)
 
-    # Step 3: Extract info + graph in parallel
-    info_task = asyncio.to_thread(extract_information_gemini, rag_result)
-    graph_task = asyncio.to_thread(extract_graph_info, rag_result)
-    info_json, graph_json = await asyncio.gather(info_task, graph_task)
+        # Step 3: Extract info + graph in parallel
+        info_task = asyncio.to_thread(extract_information_gemini, rag_result)
+        graph_task = asyncio.to_thread(extract_graph_info, rag_result)
+        info_json, graph_json = await asyncio.gather(info_task, graph_task)
 
     # Step 4: Store the extracted info and graph in Firestore
     temp = {"Info": info_json, "Graph": graph_json}
     temp_string = json.dumps(temp)
-    personaInfo(authId, newInfo=temp_string)
+    await personaInfoAsync(authId, newInfo=temp_string, snapshot=snapshot)
 
     # Step 5: update the user's persona update status
-    isPersonaUpdateNeeded(authId,updateRequired=False) 
+    await isPersonaUpdateNeededAsync(authId, updateRequired=False, snapshot=snapshot)
 
     return info_json, graph_json
\ No newline at end of file
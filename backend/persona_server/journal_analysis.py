@@ -0,0 +1,541 @@
+"""
+Per-entry LLM analysis of journal entries, fanned out with bounded concurrency.
+
+Used by analyze_journal_entries() and gen_worklogpdf() in data.py. The LLM is
+passed in as a blocking callable, llm(prompt, system_prompt=..., response_schema=None) -> str,
+so the fan-out can be exercised without Gemini (see benchmarks.py).
+Analyses are stored encrypted on their entries and reused until the entry
+changes (analyze_entries_incrementally).
+"""
+import os
+import re
+import json
+import asyncio
+import contextvars
+import hashlib
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+
+from encryption import decrypt_many, encrypt, encrypt_v2, DECRYPT_FAILED_MARKER
+from prompt_budget import estimate_tokens
+
+EMOTIONS = ["Joy", "Sadness", "Anger", "Fear", "Surprise", "Disgust", "Neutral"]
+
+# Journal analysis fan-out configuration
+JOURNAL_ANALYSIS_CONCURRENCY = int(os.getenv('JOURNAL_ANALYSIS_CONCURRENCY', 8))
+JOURNAL_LLM_TIMEOUT_SECONDS = float(os.getenv('JOURNAL_LLM_TIMEOUT_SECONDS', 60))
+JOURNAL_STRUCTURED_ANALYSIS = os.getenv('JOURNAL_STRUCTURED_ANALYSIS', 'true').lower() == 'true'
+JOURNAL_BATCH_ANALYSIS = os.getenv('JOURNAL_BATCH_ANALYSIS', 'true').lower() == 'true'
+# Estimated prompt tokens of entry text packed into one batched request
+JOURNAL_BATCH_TOKEN_BUDGET = int(os.getenv('JOURNAL_BATCH_TOKEN_BUDGET', 8000))
+ANALYSIS_UNAVAILABLE = "Analysis unavailable for this entry."
+
+# Journal entry field holding the stored analysis ({"contentHash", "encryptedAnalysis"}).
+# Bump ENTRY_ANALYSIS_VERSION when the prompts or schema change so that
+# stored analyses are redone.
+STORED_ANALYSIS_FIELD = "entryAnalysis"
+ENTRY_ANALYSIS_VERSION = 1
+
+ANALYSIS_SYSTEM_PROMPT = "You are an expert psychologist analyzing journal entries."
+EMOTION_SYSTEM_PROMPT = "You are an emotion analysis tool. Return ONLY valid JSON."
+
+# Response schema for the single structured call (Gemini OpenAPI subset)
+ENTRY_ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "analysis": {"type": "STRING"},
+        "summary": {"type": "STRING"},
+        "emotions": {
+            "type": "OBJECT",
+            "properties": {emotion: {"type": "NUMBER"} for emotion in EMOTIONS},
+            "required": EMOTIONS,
+        },
+    },
+    "required": ["analysis", "summary", "emotions"],
+    "propertyOrdering": ["analysis", "summary", "emotions"],
+}
+
+# Response schema for a batched request: one analysis object per entry_id
+BATCH_ANALYSIS_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"entry_id": {"type": "STRING"}, **ENTRY_ANALYSIS_SCHEMA["properties"]},
+        "required": ["entry_id"] + ENTRY_ANALYSIS_SCHEMA["required"],
+        "propertyOrdering": ["entry_id"] + ENTRY_ANALYSIS_SCHEMA["propertyOrdering"],
+    },
+}
+
+
+def _parse_emotions(emotion_json):
+    """Parses the emotion prompt's reply, tolerating markdown code fences"""
+    emotion_json_clean = emotion_json.strip().strip('`').replace('json\n', '').replace('json', '')
+    return json.loads(emotion_json_clean)
+
+
+def _emotion_vector(emotions) -> dict:
+    """Keeps the EMOTIONS keys, clamped to 0-1; missing or invalid values become 0"""
+    vector = {}
+    for emotion in EMOTIONS:
+        try:
+            vector[emotion] = min(1.0, max(0.0, float((emotions or {}).get(emotion, 0))))
+        except (TypeError, ValueError):
+            vector[emotion] = 0
+    return vector
+
+
+def _load_json(response_text, pattern):
+    text = (response_text or "").strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        # Schema-less models sometimes wrap the JSON in prose or code fences
+        match = re.search(pattern, text)
+        if not match:
+            raise ValueError("No JSON in structured analysis")
+        try:
+            return json.loads(match.group(0))
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Malformed structured analysis: {e}")
+
+
+def parse_entry_analysis(response_text) -> dict:
+    """
+    Parses the structured reply into analysis, summary and emotions
+
+    Raises:
+        ValueError: If the reply is not a JSON object with a non-empty analysis and summary
+    """
+    parsed = response_text if isinstance(response_text, dict) else _load_json(response_text, r"{[\s\S]*}")
+    if not isinstance(parsed, dict):
+        raise ValueError("Structured analysis is not a JSON object")
+    analysis = parsed.get("analysis")
+    summary = parsed.get("summary")
+    if not isinstance(analysis, str) or not analysis.strip() or not isinstance(summary, str) or not summary.strip():
+        raise ValueError("Structured analysis is missing analysis or summary")
+
+    emotions = parsed.get("emotions")
+    return {
+        "analysis": analysis.strip(),
+        "summary": summary.strip(),
+        "emotions": _emotion_vector(emotions if isinstance(emotions, dict) else None),
+    }
+
+
+def parse_batch_analysis(response_text) -> dict:
+    """
+    Parses a batched reply into {entry_id: parsed analysis}
+
+    Items that are malformed or lack an entry_id are skipped, so their
+    entries count as missing from the answer.
+
+    Raises:
+        ValueError: If the reply is not a JSON array
+    """
+    parsed = _load_json(response_text, r"\[[\s\S]*\]")
+    if not isinstance(parsed, list):
+        raise ValueError("Batched analysis is not a JSON array")
+
+    results = {}
+    for item in parsed:
+        if not isinstance(item, dict) or item.get("entry_id") is None:
+            continue
+        try:
+            results[str(item["entry_id"])] = parse_entry_analysis(item)
+        except ValueError:
+            continue
+    return results
+
+
+def entry_content_hash(entry, entry_data, user_email) -> str:
+    """
+    Hash of what an analysis depends on: the entry's decrypted title and
+    content, its stored date and ENTRY_ANALYSIS_VERSION. Ciphertext changes
+    on every re-encryption (a new nonce, or the v2 migration), so hashing
+    the stored blobs would throw away analyses of unchanged entries. The
+    hash is keyed with the user's email so it cannot be matched against
+    guessed plaintexts without it.
+    """
+    payload = json.dumps([
+        ENTRY_ANALYSIS_VERSION,
+        entry.get("title"),
+        entry.get("content"),
+        str(entry_data.get("date")),
+    ], default=str)
+    return hmac.new(user_email.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def is_degraded(result) -> bool:
+    """True if an entry's analysis fell back to ANALYSIS_UNAVAILABLE"""
+    return result["analysis"] == ANALYSIS_UNAVAILABLE or result["summary"] == ANALYSIS_UNAVAILABLE
+
+
+def _entry_block(entry) -> str:
+    return f"""
+            Entry ID: {entry['entry_id']}
+            Title: {entry['title']}
+            Date: {entry['date']}
+            Content: {entry['content']}
+            """
+
+
+def pack_batches(entries, token_budget=None) -> list:
+    """
+    Groups entries, in order, into batches whose estimated prompt tokens fit
+    `token_budget`; an entry larger than the budget gets a batch of its own
+    """
+    token_budget = token_budget or JOURNAL_BATCH_TOKEN_BUDGET
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for entry in entries:
+        tokens = estimate_tokens(_entry_block(entry))
+        if batch and batch_tokens + tokens > token_budget:
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(entry)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def batch_prompt(entries) -> str:
+    blocks = "".join(_entry_block(entry) for entry in entries)
+    return f"""
+            Analyze each of the following journal entries separately as a psychologist. Focus on key insights and actionable takeaways:
+            {blocks}
+            Return a JSON array with one object per entry, each with:
+            - "entry_id": the entry's ID exactly as given
+            - "analysis": a concise yet comprehensive analysis with clear bullet points covering
+              1. Emotional state (primary and secondary emotions)
+              2. Cognitive patterns (positive/negative, rational/irrational)
+              3. Stress indicators and coping mechanisms
+              4. Notable behavioral patterns
+              5. Key concerns or growth opportunities
+              6. Specific recommendations for improvement
+            - "summary": 1-2 key actionable insights the journal writer should pay attention to, as bullet points
+            - "emotions": values between 0-1 for each of these emotions: {EMOTIONS}
+            """
+
+
+def structured_prompt(entry) -> str:
+    return f"""
+            Analyze this journal entry as a psychologist. Focus on key insights and actionable takeaways:
+
+            Title: {entry['title']}
+            Date: {entry['date']}
+            Content: {entry['content']}
+
+            Return a JSON object with:
+            - "analysis": a concise yet comprehensive analysis with clear bullet points covering
+              1. Emotional state (primary and secondary emotions)
+              2. Cognitive patterns (positive/negative, rational/irrational)
+              3. Stress indicators and coping mechanisms
+              4. Notable behavioral patterns
+              5. Key concerns or growth opportunities
+              6. Specific recommendations for improvement
+            - "summary": 1-2 key actionable insights the journal writer should pay attention to, as bullet points
+            - "emotions": values between 0-1 for each of these emotions: {EMOTIONS}
+            """
+
+
+def _entry_result(entry, analysis_text, summary_text, emotion_data) -> dict:
+    return {
+        "entry_id": entry["entry_id"],
+        "date": entry["date"],
+        "title": entry["title"],
+        "content": entry["content"],
+        "analysis": analysis_text,
+        "summary": summary_text,
+        "emotions": emotion_data,
+    }
+
+
+async def _analyze_entry_structured(entry, call):
+    """One schema-constrained call; raises ValueError if the reply is malformed"""
+    response_text = await call(
+        structured_prompt(entry),
+        system_prompt=ANALYSIS_SYSTEM_PROMPT,
+        response_schema=ENTRY_ANALYSIS_SCHEMA,
+    )
+    parsed = parse_entry_analysis(response_text)
+    return _entry_result(entry, parsed["analysis"], parsed["summary"], parsed["emotions"])
+
+
+async def _analyze_entry_prompts(entry, call):
+    """
+    Separate analysis, summary and emotion prompts. The analysis and emotion
+    prompts run concurrently and the summary follows the analysis; a failed
+    call only degrades its own field.
+    """
+    analysis_prompt = f"""
+            Analyze this journal entry as a psychologist. Focus on key insights and actionable takeaways:
+
+            Title: {entry['title']}
+            Date: {entry['date']}
+            Content: {entry['content']}
+
+            Provide a concise yet comprehensive analysis covering:
+            1. Emotional state (primary and secondary emotions)
+            2. Cognitive patterns (positive/negative, rational/irrational)
+            3. Stress indicators and coping mechanisms
+            4. Notable behavioral patterns
+            5. Key concerns or growth opportunities
+            6. Specific recommendations for improvement
+
+            Format your response with clear bullet points for each category.
+            """
+
+    emotion_prompt = f"""
+            Analyze this journal entry and quantify the emotional content:
+            {entry['content']}
+
+            Return ONLY a JSON dictionary with values between 0-1 for these emotions:
+            {EMOTIONS}
+            Example: {{"Joy": 0.5, "Sadness": 0.3, ...}}
+            """
+
+    analysis_text, emotion_json = await asyncio.gather(
+        call(analysis_prompt, system_prompt=ANALYSIS_SYSTEM_PROMPT),
+        call(emotion_prompt, system_prompt=EMOTION_SYSTEM_PROMPT),
+        return_exceptions=True,
+    )
+
+    if isinstance(analysis_text, BaseException):
+        print(f"Error analyzing journal entry {entry['entry_id']}: {analysis_text!r}")
+        analysis_text = summary_text = ANALYSIS_UNAVAILABLE
+    else:
+        summary_prompt = f"""
+            Summarize this psychological analysis into 1-2 key actionable insights from the journal entry:
+            {analysis_text}
+
+            Focus on the most important takeaways that the journal writer should pay attention to.
+            Format as bullet points.
+            """
+        try:
+            summary_text = await call(summary_prompt, system_prompt=ANALYSIS_SYSTEM_PROMPT)
+        except Exception as e:
+            print(f"Error summarizing journal entry {entry['entry_id']}: {e!r}")
+            summary_text = ANALYSIS_UNAVAILABLE
+
+    try:
+        if isinstance(emotion_json, BaseException):
+            raise emotion_json
+        emotion_data = _parse_emotions(emotion_json)
+    except Exception as e:
+        print(f"Error parsing emotion data: {e!r}")
+        emotion_data = {emotion: 0 for emotion in EMOTIONS}
+
+    return _entry_result(entry, analysis_text, summary_text, emotion_data)
+
+
+def _make_call(llm, executor, timeout):
+    loop = asyncio.get_running_loop()
+
+    async def call(prompt, call_timeout=None, **kwargs):
+        # Run in a copy of the caller's context so the LLM cache sees its user_scope()
+        context = contextvars.copy_context()
+        return await asyncio.wait_for(
+            loop.run_in_executor(executor, lambda: context.run(llm, prompt, **kwargs)), call_timeout or timeout
+        )
+    return call
+
+
+async def _analyze_entry(entry, call, structured):
+    if not structured:
+        return await _analyze_entry_prompts(entry, call)
+
+    try:
+        return await _analyze_entry_structured(entry, call)
+    except ValueError as e:
+        print(f"Structured analysis of journal entry {entry['entry_id']} failed ({e}), using separate prompts")
+        return await _analyze_entry_prompts(entry, call)
+    except Exception as e:
+        print(f"Error analyzing journal entry {entry['entry_id']}: {e!r}")
+        return _entry_result(entry, ANALYSIS_UNAVAILABLE, ANALYSIS_UNAVAILABLE, {emotion: 0 for emotion in EMOTIONS})
+
+
+async def _analyze_batch(batch, call, timeout):
+    """
+    Analyzes a batch of entries in one request. Entries the answer left out
+    (or all of them, if the answer is malformed) are split in halves and
+    retried; a single entry goes through the per-entry path. If the request
+    itself fails (timeout, open circuit, API error) the entries fall back to
+    the per-entry path once instead of being split, so an outage costs one
+    call per entry rather than 2N-1.
+
+    Returns:
+        list: One result per entry, in the same order as `batch`
+    """
+    if len(batch) == 1:
+        return [await _analyze_entry(batch[0], call, structured=True)]
+
+    try:
+        response_text = await call(
+            batch_prompt(batch),
+            call_timeout=timeout * len(batch),
+            system_prompt=ANALYSIS_SYSTEM_PROMPT,
+            response_schema=BATCH_ANALYSIS_SCHEMA,
+        )
+    except Exception as e:
+        print(f"Batched analysis of {len(batch)} journal entries failed: {e!r}, analyzing them one by one")
+        return list(await asyncio.gather(*(_analyze_entry(entry, call, structured=True) for entry in batch)))
+
+    try:
+        results = parse_batch_analysis(response_text)
+    except ValueError as e:
+        print(f"Batched analysis of {len(batch)} journal entries was malformed: {e}")
+        results = {}
+
+    analyzed = []
+    missing = []
+    for entry in batch:
+        parsed = results.get(str(entry["entry_id"]))
+        if parsed is None:
+            missing.append(entry)
+        else:
+            analyzed.append(_entry_result(entry, parsed["analysis"], parsed["summary"], parsed["emotions"]))
+
+    if missing:
+        if len(missing) < len(batch):
+            print(f"Batched analysis missed {len(missing)} of {len(batch)} journal entries, retrying them")
+        middle = len(missing) // 2
+        halves = [half for half in (missing[:middle], missing[middle:]) if half]
+        for retried in await asyncio.gather(*(_analyze_batch(half, call, timeout) for half in halves)):
+            analyzed.extend(retried)
+
+    # Keep the input order
+    by_id = {result["entry_id"]: result for result in analyzed}
+    return [by_id[entry["entry_id"]] for entry in batch]
+
+
+async def analyze_entry_async(entry, llm, executor, timeout=None, structured=None):
+    """
+    Analyzes one journal entry
+
+    With `structured` (default JOURNAL_STRUCTURED_ANALYSIS) the analysis,
+    summary and emotion vector come from a single call constrained by
+    ENTRY_ANALYSIS_SCHEMA. If that reply is malformed the entry falls back to
+    the separate analysis/summary/emotion prompts. A timeout or API error
+    degrades the entry instead of retrying it three more times.
+
+    Args:
+        entry (dict): Decrypted entry with entry_id, title, date and content
+        llm (callable): Blocking llm(prompt, system_prompt=..., response_schema=None) -> str
+        executor (Executor): Pool the blocking calls run on
+        timeout (float): Per-call timeout, defaults to JOURNAL_LLM_TIMEOUT_SECONDS
+        structured (bool): Use the single structured call
+
+    Returns:
+        dict: The entry with its analysis, summary and emotions
+    """
+    timeout = timeout or JOURNAL_LLM_TIMEOUT_SECONDS
+    structured = JOURNAL_STRUCTURED_ANALYSIS if structured is None else structured
+    return await _analyze_entry(entry, _make_call(llm, executor, timeout), structured)
+
+
+async def analyze_entries_async(entries, llm, concurrency=None, timeout=None, structured=None, batch=None,
+                                token_budget=None):
+    """
+    Analyzes journal entries concurrently, at most `concurrency` requests at a time
+
+    With `batch` (default JOURNAL_BATCH_ANALYSIS, requires `structured`)
+    entries are packed into requests of up to `token_budget` estimated
+    tokens (see pack_batches) that return one analysis per entry_id;
+    otherwise each entry gets its own request(s).
+
+    Returns:
+        list: One result per entry, in the same (date) order as `entries`
+    """
+    concurrency = concurrency or JOURNAL_ANALYSIS_CONCURRENCY
+    timeout = timeout or JOURNAL_LLM_TIMEOUT_SECONDS
+    structured = JOURNAL_STRUCTURED_ANALYSIS if structured is None else structured
+    batch = JOURNAL_BATCH_ANALYSIS if batch is None else batch
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # Two calls per entry can be in flight at once (analysis and emotions)
+    executor = ThreadPoolExecutor(max_workers=concurrency * 2, thread_name_prefix="journal-llm")
+    call = _make_call(llm, executor, timeout)
+
+    async def limited(prompt, **kwargs):
+        async with semaphore:
+            return await call(prompt, **kwargs)
+
+    try:
+        if batch and structured:
+            batches = pack_batches(entries, token_budget)
+            results = await asyncio.gather(*(_analyze_batch(group, limited, timeout) for group in batches))
+            return [result for group in results for result in group]
+        return await asyncio.gather(*(_analyze_entry(entry, limited, structured) for entry in entries))
+    finally:
+        # Don't wait for calls that already timed out
+        executor.shutdown(wait=False)
+
+
+def analyze_entries(entries, llm, concurrency=None, timeout=None, structured=None, batch=None, token_budget=None):
+    """Blocking wrapper around analyze_entries_async(), for use outside the event loop"""
+    return asyncio.run(analyze_entries_async(entries, llm, concurrency, timeout, structured, batch, token_budget))
+
+
+def analyze_entries_incrementally(entries, entries_data, llm, user_email, data_key=None, save=None):
+    """
+    Analyzes journal entries, reusing the analyses stored on the entries
+
+    Each entry's analysis, summary and emotions are stored encrypted on the
+    entry (STORED_ANALYSIS_FIELD) together with its entry_content_hash().
+    Only entries without a stored analysis, or edited since, go to the LLM;
+    their results are handed to `save` in one call.
+
+    Args:
+        entries (list): Decrypted entries with entry_id, title, date and content
+        entries_data (list): The entries' raw Firestore data, in the same order
+        llm (callable): Blocking LLM callable passed to analyze_entries()
+        user_email (str): Encryption key for v1 blobs
+        data_key (bytes): The user's data key, used for v2 blobs if present
+        save (callable): Persists {entry_id: {STORED_ANALYSIS_FIELD: ...}} updates
+
+    Returns:
+        list: One result per entry, in the same order as `entries`
+    """
+    hashes = {entry["entry_id"]: entry_content_hash(entry, data, user_email) for entry, data in zip(entries, entries_data)}
+
+    # Stored analyses whose hash still matches the entry
+    candidates = []
+    for entry, data in zip(entries, entries_data):
+        stored = data.get(STORED_ANALYSIS_FIELD)
+        if isinstance(stored, dict) and stored.get("encryptedAnalysis") and stored.get("contentHash") == hashes[entry["entry_id"]]:
+            candidates.append((entry, stored["encryptedAnalysis"]))
+
+    reused = {}
+    plaintexts = decrypt_many([blob for _, blob in candidates], user_email, data_key=data_key)
+    for (entry, _), plaintext in zip(candidates, plaintexts):
+        if plaintext == DECRYPT_FAILED_MARKER:
+            continue
+        try:
+            reused[entry["entry_id"]] = {**entry, **parse_entry_analysis(plaintext)}
+        except ValueError:
+            continue
+
+    fresh = [entry for entry in entries if entry["entry_id"] not in reused]
+    print(f"Reusing {len(reused)} stored journal analyses, analyzing {len(fresh)} entries")
+    results = analyze_entries(fresh, llm=llm) if fresh else []
+
+    updates = {}
+    for result in results:
+        if is_degraded(result):
+            continue
+        payload = json.dumps({key: result[key] for key in ("analysis", "summary", "emotions")})
+        encrypted = encrypt_v2(payload, data_key) if data_key is not None else encrypt(payload, user_email)
+        updates[result["entry_id"]] = {
+            STORED_ANALYSIS_FIELD: {"contentHash": hashes[result["entry_id"]], "encryptedAnalysis": encrypted}
+        }
+    if updates and save is not None:
+        try:
+            save(updates)
+        except Exception as e:
+            print(f"Failed to store journal analyses: {e}")
+
+    by_id = {**reused, **{result["entry_id"]: result for result in results}}
+    return [by_id[entry["entry_id"]] for entry in entries]
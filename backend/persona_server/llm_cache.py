@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import sqlite3
+import hmac
+import hashlib
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import namedtuple
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from encryption import derive_key, get_user_data_key, encrypt_v2, decrypt_v2_bytes
+from llm_gateway import gateway, genai_request, genai_stream
+
+# LLM response cache configuration
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', 'llm_cache.sqlite3')
+LLM_CACHE_TTL_SECONDS = float(os.getenv('LLM_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# PBKDF2 salt for the cache key of users without a data key
+LLM_CACHE_KEY_SALT = b'llm-cache-v1'
+
+# Per-user keys of the request being served: `index` turns a prompt into a
+# row key, `seal` encrypts the stored response. Set by user_scope().
+UserCacheKeys = namedtuple("UserCacheKeys", ["index", "seal"])
+_user_keys = contextvars.ContextVar("llm_cache_user_keys", default=None)
+
+
+def _canonical(value):
+    """Turns prompts and genai config objects into plain JSON-able data"""
+    if hasattr(value, "model_dump"):
+        return _canonical(value.model_dump(mode="json", exclude_none=True))
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def cache_key(model, contents, config=None, index_key: bytes = None) -> str:
+    """
+    Content address of a request: sha256 over model, prompt contents and
+    generation config, or an HMAC under `index_key` so that rows cannot be
+    matched against guessed prompts or across users
+    """
+    payload = json.dumps(
+        {"model": model, "contents": _canonical(contents), "config": _canonical(config)},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    ).encode("utf-8")
+    if index_key is not None:
+        return hmac.new(index_key, payload, hashlib.sha256).hexdigest()
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _subkey(base_key: bytes, purpose: bytes) -> bytes:
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"llm-cache:" + purpose).derive(base_key)
+
+
+def user_cache_keys(user_data: dict, data_key: bytes = None):
+    """
+    Cache keys of a user, derived from their data key or, for users not yet
+    migrated to v2, from their email like v1 blobs
+
+    Args:
+        user_data: The user document (needs "email", and "wrappedDataKey" if migrated)
+        data_key: The already unwrapped data key, if the caller has it
+
+    Returns:
+        UserCacheKeys, or None if the user has no email
+    """
+    email = (user_data or {}).get("email")
+    if not email:
+        return None
+    base_key = data_key or get_user_data_key(user_data, email) or derive_key(email, LLM_CACHE_KEY_SALT)
+    return UserCacheKeys(index=_subkey(base_key, b"index"), seal=_subkey(base_key, b"seal"))
+
+
+@contextmanager
+def user_scope(user_data: dict, data_key: bytes = None):
+    """
+    Caches the Gemini responses of the enclosed calls for this user, encrypted
+    with their key. Prompts built from user data must run inside a scope; calls
+    outside one are never cached. Worker threads only see the scope if they
+    run in a copy of the caller's context (asyncio.to_thread does this).
+    """
+    token = _user_keys.set(user_cache_keys(user_data, data_key))
+    try:
+        yield
+    finally:
+        _user_keys.reset(token)
+
+
+class LLMCache:
+    """
+    SQLite-backed cache of Gemini responses, shared by every call site in
+    conv.py, data.py and chat.py so that regenerating a report without new
+    data does not re-run identical prompts.
+
+    Entries expire `ttl_seconds` after they were written. Once the stored
+    responses exceed `max_bytes`, the least recently read entries are
+    evicted. Hits and misses are counted per call site.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl_seconds: float = LLM_CACHE_TTL_SECONDS,
+                 max_bytes: int = LLM_CACHE_MAX_BYTES, enabled: bool = LLM_CACHE_ENABLED):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._conn = None
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def _connection(self) -> sqlite3.Connection:
+        # Called with the lock held
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Earlier versions stored plaintext responses in llm_cache
+            conn.execute("DROP TABLE IF EXISTS llm_cache")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache_sealed ("
+                " key TEXT PRIMARY KEY, call_site TEXT, response TEXT NOT NULL,"
+                " size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_sealed_accessed ON llm_cache_sealed (accessed_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _count(self, call_site: str, outcome: str) -> None:
+        counters = self._counters.setdefault(call_site, {"hits": 0, "misses": 0, "bypassed": 0})
+        counters[outcome] += 1
+
+    def get(self, key: str):
+        """Returns the stored (sealed) response, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT response, created_at FROM llm_cache_sealed WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] >= self.ttl_seconds:
+                conn.execute("DELETE FROM llm_cache_sealed WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE llm_cache_sealed SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return row[0]
+
+    def put(self, key: str, call_site: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache_sealed (key, call_site, response, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, call_site, response, size, now, now),
+            )
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM llm_cache_sealed WHERE created_at <= ?", (now - self.ttl_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache_sealed").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently read entries until the cache fits again
+        excess = total - self.max_bytes
+        for key, size in conn.execute("SELECT key, size FROM llm_cache_sealed ORDER BY accessed_at").fetchall():
+            conn.execute("DELETE FROM llm_cache_sealed WHERE key = ?", (key,))
+            excess -= size
+            if excess <= 0:
+                break
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM llm_cache_sealed")
+            conn.commit()
+            self._counters.clear()
+
+    def stats(self) -> dict:
+        """Returns per-call-site hit rates and the size of the cache file's contents"""
+        with self._lock:
+            entries, total = 0, 0
+            if self.enabled:
+                entries, total = self._connection().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache_sealed"
+                ).fetchone()
+            call_sites = {}
+            for call_site, counters in self._counters.items():
+                lookups = counters["hits"] + counters["misses"]
+                call_sites[call_site] = {**counters, "hit_rate": counters["hits"] / lookups if lookups else 0.0}
+            return {"entries": entries, "bytes": total, "max_bytes": self.max_bytes, "call_sites": call_sites}
+
+    def generate(self, call_site: str, model: str, contents, config=None, produce=None, use_cache: bool = True) -> str:
+        """
+        Returns the response text for a request, calling `produce()` on a miss
+
+        Args:
+            call_site: Name the hit-rate counters are kept under, e.g. "json_to_md"
+            model: Model name, part of the cache key
+            contents: Prompt contents, part of the cache key
+            config: Generation config, part of the cache key
+            produce: Callable doing the actual request and returning its text
+            use_cache: False for non-deterministic calls such as chat replies;
+                calls outside a user_scope() are not cached either
+
+        Returns:
+            str: The (possibly cached) response text
+        """
+        user_keys = _user_keys.get()
+        if not (self.enabled and use_cache and user_keys is not None):
+            with self._lock:
+                self._count(call_site, "bypassed")
+            return produce()
+
+        key = cache_key(model, contents, config, index_key=user_keys.index)
+        try:
+            sealed = self.get(key)
+            cached = decrypt_v2_bytes(sealed, user_keys.seal).decode("utf-8") if sealed is not None else None
+        except (sqlite3.Error, ValueError, InvalidTag) as e:
+            print(f"LLM cache read failed for {call_site}: {e}")
+            cached = None
+        with self._lock:
+            self._count(call_site, "hits" if cached is not None else "misses")
+        if cached is not None:
+            return cached
+
+        response = produce()
+        if response:
+            try:
+                self.put(key, call_site, encrypt_v2(response, user_keys.seal))
+            except sqlite3.Error as e:
+                print(f"LLM cache write failed for {call_site}: {e}")
+        return response
+
+
+def generate_text(client, call_site: str, model: str, contents, config=None, stream: bool = False,
+                  use_cache: bool = True) -> str:
+    """
+    Runs a Gemini request through the shared response cache; misses go
+    through the LLM gateway (limits, retries, circuit breaker, deadline)
+
+    Args:
+        client: genai.Client to use on a miss
+        call_site: Name for the hit-rate counters
+        model: Model name
+        contents: Prompt contents
+        config: Optional types.GenerateContentConfig
+        stream: Use generate_content_stream and join the chunks' text
+        use_cache: False to always call the model
+
+    Returns:
+        str: The response text
+    """
+    def produce():
+        if not stream:
+            return gateway.call_sync(call_site, genai_request(client, model, contents, config))
+        open_stream = genai_stream(client, model, contents, config)
+
+        async def request():
+            return "".join([text async for text in await open_stream()])
+        return gateway.call_sync(call_site, request)
+
+    return llm_cache.generate(call_site, model, contents, config, produce, use_cache)
+
+
+# Shared instance used by conv.py, data.py and chat.py
+llm_cache = LLMCache()
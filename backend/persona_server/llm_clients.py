@@ -0,0 +1,120 @@
+import os
+import time
+import threading
+
+import httpx
+from google import genai
+from google.genai import types
+
+from llm_gateway import gateway as llm_gateway
+
+# Gemini client pool configuration
+VERTEX_PROJECT = os.getenv('VERTEX_PROJECT', 'hackathons-423418')
+VERTEX_LOCATION = os.getenv('VERTEX_LOCATION', 'us-central1')
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv('LLM_POOL_MAX_CONNECTIONS', 32))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv('LLM_POOL_MAX_KEEPALIVE', 16))
+LLM_POOL_KEEPALIVE_SECONDS = float(os.getenv('LLM_POOL_KEEPALIVE_SECONDS', 120))
+LLM_HTTP_TIMEOUT_SECONDS = float(os.getenv('LLM_HTTP_TIMEOUT_SECONDS', 120))
+LLM_WARMUP_MODEL = os.getenv('LLM_WARMUP_MODEL', 'gemini-2.0-flash')
+LLM_WARMUP_ON_STARTUP = os.getenv('LLM_WARMUP_ON_STARTUP', 'true').lower() == 'true'
+
+
+def pool_limits(max_connections: int = LLM_POOL_MAX_CONNECTIONS, max_keepalive: int = LLM_POOL_MAX_KEEPALIVE,
+                keepalive_seconds: float = LLM_POOL_KEEPALIVE_SECONDS) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=keepalive_seconds,
+    )
+
+
+def http_options(limits: httpx.Limits = None, timeout_seconds: float = LLM_HTTP_TIMEOUT_SECONDS) -> types.HttpOptions:
+    """HTTP options giving the SDK's sync and async httpx clients a bounded keep-alive pool"""
+    limits = limits or pool_limits()
+    return types.HttpOptions(
+        timeout=int(timeout_seconds * 1000),
+        client_args={"limits": limits},
+        async_client_args={"limits": limits},
+    )
+
+
+class ClientRegistry:
+    """
+    One genai.Client per kind and process.
+
+    Creating a client loads credentials and builds a fresh HTTP pool, so a
+    client per call pays credential loading and a TLS handshake every time
+    and throws the connection away afterwards. The registry creates the
+    Vertex client and the API-key client lazily on first use and hands the
+    same instance to every caller afterwards; genai clients are thread-safe.
+    """
+
+    def __init__(self, options: types.HttpOptions = None):
+        self.options = options
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.created = {}
+        self.warmup_seconds = {}
+
+    def _get(self, kind: str, factory) -> genai.Client:
+        client = self._clients.get(kind)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(kind)
+            if client is None:
+                client = factory()
+                self._clients[kind] = client
+                self.created[kind] = self.created.get(kind, 0) + 1
+            return client
+
+    def vertex(self) -> genai.Client:
+        """Vertex AI client, authenticated through GOOGLE_APPLICATION_CREDENTIALS"""
+        return self._get("vertex", lambda: genai.Client(
+            vertexai=True,
+            project=VERTEX_PROJECT,
+            location=VERTEX_LOCATION,
+            http_options=self.options or http_options(),
+        ))
+
+    def api_key(self) -> genai.Client:
+        """Gemini API client using NEXT_PUBLIC_GEMINI_API_KEY"""
+        return self._get("api_key", lambda: genai.Client(
+            api_key=os.getenv("NEXT_PUBLIC_GEMINI_API_KEY"),
+            http_options=self.options or http_options(),
+        ))
+
+    def warm_up(self, model: str = LLM_WARMUP_MODEL, gateway=None) -> None:
+        """
+        Creates both clients and opens a pooled connection for each with a
+        metadata request, so the first user request skips the handshake.
+        The request goes through the aio interface on the LLM gateway's event
+        loop, which serves every later request, so the warmed connection is
+        the one they reuse. Failures are logged; the clients are then still
+        created on first use.
+        """
+        gateway = gateway or llm_gateway
+        for kind, get_client in (("vertex", self.vertex), ("api_key", self.api_key)):
+            start = time.perf_counter()
+            try:
+                client = get_client()
+                gateway.run_sync(client.aio.models.get(model=model))
+            except Exception as e:
+                print(f"Gemini {kind} client warm-up failed: {e}")
+                continue
+            self.warmup_seconds[kind] = time.perf_counter() - start
+
+    def stats(self) -> dict:
+        return {"created": dict(self.created), "warmup_seconds": dict(self.warmup_seconds)}
+
+
+# Shared instance used by conv.py, data.py and chat.py
+clients = ClientRegistry()
+
+
+def get_vertex_client() -> genai.Client:
+    return clients.vertex()
+
+
+def get_api_key_client() -> genai.Client:
+    return clients.api_key()
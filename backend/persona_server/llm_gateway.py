@@ -0,0 +1,475 @@
+import os
+import time
+import random
+import asyncio
+import threading
+
+# LLM gateway configuration
+LLM_GATEWAY_CONCURRENCY = int(os.getenv('LLM_GATEWAY_CONCURRENCY', 16))
+LLM_GATEWAY_SITE_CONCURRENCY = int(os.getenv('LLM_GATEWAY_SITE_CONCURRENCY', 8))
+# Per-call-site overrides, e.g. "json_to_md=2,analyze_with_llm=8"
+LLM_GATEWAY_SITE_LIMITS = os.getenv('LLM_GATEWAY_SITE_LIMITS', '')
+LLM_GATEWAY_RATE_PER_SECOND = float(os.getenv('LLM_GATEWAY_RATE_PER_SECOND', 10))
+LLM_GATEWAY_BURST = int(os.getenv('LLM_GATEWAY_BURST', 20))
+LLM_GATEWAY_MAX_RETRIES = int(os.getenv('LLM_GATEWAY_MAX_RETRIES', 4))
+LLM_GATEWAY_BACKOFF_BASE_SECONDS = float(os.getenv('LLM_GATEWAY_BACKOFF_BASE_SECONDS', 0.5))
+LLM_GATEWAY_BACKOFF_MAX_SECONDS = float(os.getenv('LLM_GATEWAY_BACKOFF_MAX_SECONDS', 16))
+LLM_GATEWAY_DEADLINE_SECONDS = float(os.getenv('LLM_GATEWAY_DEADLINE_SECONDS', 120))
+LLM_GATEWAY_BREAKER_THRESHOLD = int(os.getenv('LLM_GATEWAY_BREAKER_THRESHOLD', 5))
+LLM_GATEWAY_BREAKER_RESET_SECONDS = float(os.getenv('LLM_GATEWAY_BREAKER_RESET_SECONDS', 30))
+
+RETRYABLE_STATUS_CODES = {408, 429}
+
+
+class GatewayError(Exception):
+    """Base class for requests the gateway gave up on"""
+
+
+class CircuitOpenError(GatewayError):
+    """The provider failed repeatedly; requests are rejected until the breaker resets"""
+
+
+class DeadlineExceededError(GatewayError):
+    """The request (including queueing and retries) did not finish within its deadline"""
+
+
+class _StreamInterrupted(Exception):
+    # A stream failed after emitting text; it cannot be replayed, so never retried
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+
+
+def parse_site_limits(spec: str) -> dict:
+    """Parses "site=limit,site=limit" into a dict"""
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            site, limit = item.split("=", 1)
+            limits[site.strip()] = int(limit)
+    return limits
+
+
+def status_code(error):
+    """HTTP status of a genai APIError / httpx error, or None"""
+    for attr in ("code", "status_code"):
+        code = getattr(error, attr, None)
+        if isinstance(code, int):
+            return code
+    response = getattr(error, "response", None)
+    code = getattr(response, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(error) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are retried"""
+    code = status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS_CODES or code >= 500
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(error, httpx.TransportError)
+
+
+def backoff_delay(attempt: int, base: float = LLM_GATEWAY_BACKOFF_BASE_SECONDS,
+                  cap: float = LLM_GATEWAY_BACKOFF_MAX_SECONDS) -> float:
+    """Exponential backoff with full jitter for the given 0-based retry attempt"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average with bursts of up to `burst`"""
+
+    def __init__(self, rate: float = LLM_GATEWAY_RATE_PER_SECOND, burst: int = LLM_GATEWAY_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.waited_seconds = 0.0
+
+    async def acquire(self) -> None:
+        # Only used from the gateway loop, so no lock is needed
+        if self.rate <= 0:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            wait = (1 - self.tokens) / self.rate
+            self.waited_seconds += wait
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failed requests and rejects calls for
+    `reset_seconds`; then lets a single probe through (half-open) and closes
+    again once a request succeeds.
+    """
+
+    def __init__(self, threshold: int = LLM_GATEWAY_BREAKER_THRESHOLD,
+                 reset_seconds: float = LLM_GATEWAY_BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def cancel_probe(self) -> None:
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+            self.opened_at = time.monotonic()
+            self.opened += 1
+        self.probing = False
+
+
+class LLMGateway:
+    """
+    Single path for every Gemini request in persona_server.
+
+    Requests run on the SDK's `aio` interface on one gateway event loop in a
+    background thread, so the concurrency limits, rate limiter and breaker
+    hold across FastAPI handlers, worker threads and the journal fan-out
+    alike (and the aio HTTP pool is only ever used from one loop). Each
+    request:
+
+    - waits for a global and a per-call-site concurrency slot,
+    - takes a token from the rate limiter before every attempt,
+    - is retried with jittered exponential backoff on 429/5xx and
+      transport errors,
+    - is rejected immediately while the circuit breaker is open,
+    - fails with DeadlineExceededError once its deadline (queueing and
+      retries included) has passed.
+    """
+
+    def __init__(self, concurrency: int = LLM_GATEWAY_CONCURRENCY,
+                 site_concurrency: int = LLM_GATEWAY_SITE_CONCURRENCY, site_limits: dict = None,
+                 rate: float = LLM_GATEWAY_RATE_PER_SECOND, burst: int = LLM_GATEWAY_BURST,
+                 max_retries: int = LLM_GATEWAY_MAX_RETRIES, backoff_base: float = LLM_GATEWAY_BACKOFF_BASE_SECONDS,
+                 backoff_cap: float = LLM_GATEWAY_BACKOFF_MAX_SECONDS,
+                 deadline_seconds: float = LLM_GATEWAY_DEADLINE_SECONDS,
+                 breaker_threshold: int = LLM_GATEWAY_BREAKER_THRESHOLD,
+                 breaker_reset_seconds: float = LLM_GATEWAY_BREAKER_RESET_SECONDS):
+        self.concurrency = concurrency
+        self.site_concurrency = site_concurrency
+        self.site_limits = parse_site_limits(LLM_GATEWAY_SITE_LIMITS) if site_limits is None else site_limits
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.deadline_seconds = deadline_seconds
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_seconds)
+        self._semaphore = None
+        self._site_semaphores = {}
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        self._stream_stats = {}
+
+    # -- gateway loop ----------------------------------------------------
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is not None:
+            return self._loop
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True)
+                thread.start()
+                self._thread = thread
+                self._loop = loop
+        return self._loop
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def run_sync(self, coro):
+        """
+        Runs a coroutine on the gateway loop and waits for its result, without
+        limits, retries or stats; for setup work such as warming the clients'
+        async connection pools, which belong to this loop
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("run_sync() cannot be used from the gateway loop")
+        return self._submit(coro).result()
+
+    def close(self) -> None:
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=5)
+            loop.close()
+
+    # -- stats -----------------------------------------------------------
+
+    def _count(self, call_site: str, key: str, amount=1) -> None:
+        with self._stats_lock:
+            stats = self._stats.setdefault(call_site, {
+                "requests": 0, "succeeded": 0, "failed": 0, "retries": 0,
+                "rejected": 0, "deadline_exceeded": 0, "total_ms": 0.0, "max_ms": 0.0,
+            })
+            if key == "latency":
+                stats["total_ms"] += amount * 1000
+                stats["max_ms"] = max(stats["max_ms"], amount * 1000)
+            else:
+                stats[key] += amount
+
+    def record_stream(self, call_site: str, outcome: str, ttft_seconds: float = None,
+                      duration_seconds: float = None) -> None:
+        """
+        Records how a stream consumed by the caller ended
+
+        Args:
+            call_site: The call site the stream ran under
+            outcome: "completed", "cancelled" or "errors"
+            ttft_seconds: Time to the first chunk, if one arrived
+            duration_seconds: Time until the stream ended
+        """
+        with self._stats_lock:
+            stats = self._stream_stats.setdefault(call_site, {
+                "streams": 0, "completed": 0, "cancelled": 0, "errors": 0,
+            })
+            stats["streams"] += 1
+            stats[outcome] += 1
+            for name, seconds in (("ttft", ttft_seconds), ("duration", duration_seconds)):
+                if seconds is None:
+                    continue
+                timing = stats.setdefault(name, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0})
+                timing["calls"] += 1
+                timing["total_ms"] += seconds * 1000
+                timing["max_ms"] = max(timing["max_ms"], seconds * 1000)
+
+    def stream_stats(self) -> dict:
+        """Returns stream outcomes and time to first chunk / duration per call site"""
+        with self._stats_lock:
+            return {
+                call_site: {
+                    name: {**value, "mean_ms": value["total_ms"] / value["calls"]} if isinstance(value, dict) else value
+                    for name, value in stats.items()
+                }
+                for call_site, stats in self._stream_stats.items()
+            }
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            call_sites = {
+                call_site: {**stats, "mean_ms": stats["total_ms"] / stats["requests"] if stats["requests"] else 0.0}
+                for call_site, stats in self._stats.items()
+            }
+        return {
+            "breaker": {"state": self.breaker.state, "opened": self.breaker.opened},
+            "rate_limit_wait_seconds": self.bucket.waited_seconds,
+            "call_sites": call_sites,
+            "streams": self.stream_stats(),
+        }
+
+    # -- request handling (runs on the gateway loop) ---------------------
+
+    def _site_semaphore(self, call_site: str) -> asyncio.Semaphore:
+        semaphore = self._site_semaphores.get(call_site)
+        if semaphore is None:
+            limit = self.site_limits.get(call_site, self.site_concurrency)
+            semaphore = self._site_semaphores[call_site] = asyncio.Semaphore(limit)
+        return semaphore
+
+    async def _attempts(self, call_site: str, request):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._site_semaphore(call_site), self._semaphore:
+            attempt = 0
+            while True:
+                await self.bucket.acquire()
+                try:
+                    return await request()
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        raise
+                    delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+                    print(f"LLM request for {call_site} failed ({e}); retrying in {delay:.2f}s")
+                    self._count(call_site, "retries")
+                    attempt += 1
+                    await asyncio.sleep(delay)
+
+    async def _call(self, call_site: str, request, deadline_seconds: float = None):
+        self._count(call_site, "requests")
+        if not self.breaker.allow():
+            self._count(call_site, "rejected")
+            raise CircuitOpenError(f"LLM circuit open, rejecting {call_site}")
+
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self._attempts(call_site, request),
+                                            deadline_seconds or self.deadline_seconds)
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            self._count(call_site, "deadline_exceeded")
+            raise DeadlineExceededError(f"LLM request for {call_site} exceeded its deadline") from None
+        except asyncio.CancelledError:
+            # The caller went away; that says nothing about the provider
+            self.breaker.cancel_probe()
+            raise
+        except _StreamInterrupted:
+            self.breaker.record_failure()
+            self._count(call_site, "failed")
+            raise
+        except Exception as e:
+            # Only provider-side failures count towards opening the breaker;
+            # a client error neither counts nor proves the provider healthy
+            if is_retryable(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.cancel_probe()
+            self._count(call_site, "failed")
+            raise
+        finally:
+            self._count(call_site, "latency", time.perf_counter() - start)
+        self.breaker.record_success()
+        self._count(call_site, "succeeded")
+        return result
+
+    # -- public API ------------------------------------------------------
+
+    async def call(self, call_site: str, request, deadline_seconds: float = None):
+        """
+        Runs `request` through the gateway from any event loop
+
+        Args:
+            call_site: Name the limits and stats are kept under, e.g. "json_to_md"
+            request: Zero-argument coroutine function doing one attempt
+            deadline_seconds: Overall deadline, defaults to LLM_GATEWAY_DEADLINE_SECONDS
+
+        Returns:
+            The result of the first successful attempt
+        """
+        return await asyncio.wrap_future(self._submit(self._call(call_site, request, deadline_seconds)))
+
+    def call_sync(self, call_site: str, request, deadline_seconds: float = None):
+        """Blocking variant of call() for worker threads"""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("call_sync() cannot be used from the gateway loop")
+        return self._submit(self._call(call_site, request, deadline_seconds)).result()
+
+    async def stream(self, call_site: str, open_stream, deadline_seconds: float = None):
+        """
+        Streams text chunks through the gateway to the calling event loop
+
+        Failures before the first chunk are retried like any other request;
+        once text has been emitted the stream cannot be replayed, so a
+        failure is raised to the caller. Closing the generator cancels the
+        upstream stream.
+
+        Args:
+            call_site: Name the limits and stats are kept under
+            open_stream: Zero-argument coroutine function returning an async
+                iterator of text chunks
+            deadline_seconds: Deadline for the whole stream
+
+        Yields:
+            str: Text chunks in order
+        """
+        caller_loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        def emit(item):
+            caller_loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        async def pump():
+            emitted = False
+            try:
+                async for text in await open_stream():
+                    emitted = True
+                    emit(text)
+            except Exception as e:
+                if emitted:
+                    raise _StreamInterrupted(e)
+                raise
+
+        async def produce():
+            try:
+                await self._call(call_site, pump, deadline_seconds)
+                emit(done)
+            except _StreamInterrupted as e:
+                emit(e.error)
+            except Exception as e:
+                emit(e)
+
+        future = self._submit(produce())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+
+def genai_request(client, model: str, contents, config=None):
+    """Request factory for one generate_content call on the client's aio interface"""
+    async def request():
+        response = await client.aio.models.generate_content(model=model, contents=contents, config=config)
+        return response.text
+    return request
+
+
+def genai_stream(client, model: str, contents, config=None):
+    """Stream factory yielding the text parts of a generate_content_stream call"""
+    async def open_stream():
+        chunks = await client.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+
+        async def texts():
+            try:
+                async for chunk in chunks:
+                    if chunk.candidates and chunk.candidates[0].content:
+                        for part in chunk.candidates[0].content.parts:
+                            if part.text:
+                                yield part.text
+            finally:
+                if hasattr(chunks, "aclose"):
+                    await chunks.aclose()
+        return texts()
+    return open_stream
+
+
+# Shared instance used by llm_cache.generate_text and chat.py
+gateway = LLMGateway()
@@ -1,7 +1,7 @@
 from datetime import datetime
 import uuid
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
 import os
@@ -9,15 +9,20 @@ import json
 from tempfile import NamedTemporaryFile
 import base64
 from fastapi.responses import JSONResponse
-from data import data_chat_extraction, analyze_journal_entries,gen_worklogpdf,json_to_md,save_to_pdf
+from data import data_chat_extraction_async, gen_worklogpdf_async, json_to_md, save_to_pdf
 from conv import extract_information_gemini, generate_rag, extract_graph_info
 from mail import create_pdf_from_json, sendEmail
 import base64
 from tempfile import NamedTemporaryFile
 from fastapi.responses import JSONResponse
 from data import create_pdf_from_json_chat
-from chat import reflection_chatbot
+from chat import reflection_chatbot_async, reflection_chatbot_stream, CHAT_STREAM_CALL_SITE
 from dataSync import isPersonaUpdateNeeded, personaInfo, updatePersona
+from repository import repo
+from persona_cache import persona_cache
+from llm_cache import llm_cache, user_scope
+from llm_gateway import gateway as llm_gateway
+from llm_clients import clients as llm_clients, LLM_WARMUP_ON_STARTUP
 from email_queue import email_queue
 import json
 
@@ -48,10 +53,33 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     await email_queue.start()
+    if LLM_WARMUP_ON_STARTUP:
+        # warm the pooled Gemini clients in the background so startup is not delayed
+        asyncio.create_task(asyncio.to_thread(llm_clients.warm_up))
 
 @app.on_event("shutdown")
 async def shutdown_event():
     await email_queue.stop()
+    persona_cache.clear()
+    llm_gateway.close()
+
+# count Firestore document reads per endpoint so read regressions show up in /metrics
+@app.middleware("http")
+async def track_firestore_reads(request: Request, call_next):
+    with repo.track_reads(request.url.path):
+        return await call_next(request)
+
+@app.get("/metrics")
+async def metrics():
+    return JSONResponse(content={
+        "firestore_reads": repo.read_stats(),
+        "firestore_latency": repo.latency_stats(),
+        "persona_cache": persona_cache.stats(),
+        "llm_cache": llm_cache.stats(),
+        "llm_clients": llm_clients.stats(),
+        "llm_gateway": llm_gateway.stats(),
+        "chat_stream": llm_gateway.stream_stats().get(CHAT_STREAM_CALL_SITE, {}),
+    }, status_code=200)
 
 @app.post("/getReport")
 async def get_report(request: Request):
@@ -63,9 +91,15 @@ async def get_report(request: Request):
         if not authId:
             return JSONResponse(content={"error": "Missing authId or email in request"}, status_code=400)
 
+        # Read the user and persona documents once for the whole request;
+        # cached snapshots are kept fresh by Firestore listeners
+        snapshot = await persona_cache.aget(authId)
+
         # If update is needed → update and return, skip further processing
-        if isPersonaUpdateNeeded(authId):
-            info_json, graph_json = await updatePersona(authId)
+        if isPersonaUpdateNeeded(authId, snapshot=snapshot):
+            info_json, graph_json = await updatePersona(authId, snapshot=snapshot)
+            # The update went to this request's copy; don't serve the old persona until a listener push
+            persona_cache.invalidate(authId)
             # Step: Generate PDF report from saved persona data
             data = {
                 "info": info_json,
@@ -79,7 +113,7 @@ async def get_report(request: Request):
             }, status_code=200)
 
         # Otherwise, fetch stored persona info and proceed to report/email
-        persona_raw = personaInfo(authId)
+        persona_raw = personaInfo(authId, snapshot=snapshot)
         if not persona_raw:
             return JSONResponse(content={"error": "Stored persona data not found"}, status_code=404)
 
@@ -115,9 +149,15 @@ async def get_report(request: Request):
         if not authId or not user_email:
             return JSONResponse(content={"error": "Missing authId or email in request"}, status_code=400)
 
+        # Read the user and persona documents once for the whole request;
+        # cached snapshots are kept fresh by Firestore listeners
+        snapshot = await persona_cache.aget(authId)
+
         # If update is needed → update and return, skip further processing
-        if isPersonaUpdateNeeded(authId):
-            info_json, graph_json = await updatePersona(authId)
+        if isPersonaUpdateNeeded(authId, snapshot=snapshot):
+            info_json, graph_json = await updatePersona(authId, snapshot=snapshot)
+            # The update went to this request's copy; don't serve the old persona until a listener push
+            persona_cache.invalidate(authId)
             # Step: Generate PDF report from saved persona data
             data = {
                 "info": info_json,
@@ -142,7 +182,7 @@ async def get_report(request: Request):
             }, status_code=200)
 
         # Otherwise, fetch stored persona info and proceed to report/email
-        persona_raw = personaInfo(authId)
+        persona_raw = personaInfo(authId, snapshot=snapshot)
         if not persona_raw:
             return JSONResponse(content={"error": "Stored persona data not found"}, status_code=404)
 
@@ -179,24 +219,37 @@ async def get_report(request: Request):
     except Exception as e:
         return JSONResponse(content={"error": f"Internal server error: {str(e)}"}, status_code=500)
 
+async def chat_user_info(authId, user_message):
+    snapshot = await persona_cache.aget(authId)
+    user_info = personaInfo(authId, snapshot=snapshot)
+
+    if isPersonaUpdateNeeded(authId, snapshot=snapshot) and user_info is None:
+        # Update persona before generating the RAG response; without one the
+        # reply is still generated, just without persona information
+        try:
+            await updatePersona(authId, user_message, snapshot=snapshot)
+            persona_cache.invalidate(authId)
+            user_info = personaInfo(authId, snapshot=snapshot)
+        except Exception as e:
+            print(f"Failed to build persona for {authId}: {e}")
+    return user_info
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.post("/chat")
 async def chat(request: Request):
     try:
         payload = await request.json()
         authId = payload.get("authId")
         user_message = payload.get("userMessage")
-        user_info = personaInfo(authId)
 
         if not authId or not user_message:
             return JSONResponse(content={"error": "Missing authId or userMessage in request"}, status_code=400)
 
-        if not isPersonaUpdateNeeded(authId) or not user_info is None:
-            # Generate RAG response
-            rag_response = reflection_chatbot(user_message=user_message, user_info=user_info)
-        else:
-            # Update persona and then generate RAG response
-            updatePersona(authId, user_message)
-            rag_response = reflection_chatbot(user_message=user_message, user_info=user_info)
+        user_info = await chat_user_info(authId, user_message)
+        # Buffered wrapper around the streamed reply
+        rag_response = await reflection_chatbot_async(user_message=user_message, user_info=user_info)
         if not rag_response:
             return JSONResponse(content={"error": "No response generated"}, status_code=404)
 
@@ -205,6 +258,46 @@ async def chat(request: Request):
     except Exception as e:
         return JSONResponse(content={"error": f"Internal server error: {str(e)}"}, status_code=500)
 
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """
+    Streams the chat reply as server-sent events: one `chunk` event per
+    text chunk as the model produces it, then `done`, or `error` on failure.
+    The model stream is closed as soon as the client disconnects.
+    """
+    try:
+        payload = await request.json()
+        authId = payload.get("authId")
+        user_message = payload.get("userMessage")
+
+        if not authId or not user_message:
+            return JSONResponse(content={"error": "Missing authId or userMessage in request"}, status_code=400)
+
+        user_info = await chat_user_info(authId, user_message)
+    except Exception as e:
+        return JSONResponse(content={"error": f"Internal server error: {str(e)}"}, status_code=500)
+
+    async def events():
+        chunks = reflection_chatbot_stream(user_message=user_message, user_info=user_info)
+        try:
+            async for text in chunks:
+                if await request.is_disconnected():
+                    break
+                yield sse_event("chunk", {"text": text})
+            else:
+                yield sse_event("done", {})
+        except Exception as e:
+            yield sse_event("error", {"error": f"Internal server error: {str(e)}"})
+        finally:
+            # Stops generation upstream when the client went away mid-reply
+            await chunks.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 
 
@@ -225,7 +318,8 @@ async def get_report(request: Request):
         filename = f"worklog_{authId}_{timestamp}_{unique_id}"
         
         # Generate the report
-        result = gen_worklogpdf(authId, numdays, filename)
+        snapshot = await persona_cache.aget(authId)
+        result = await gen_worklogpdf_async(authId, numdays, filename, snapshot=snapshot)
         
         # Check if report generation was successful
         if not result["success"]:
@@ -304,8 +398,10 @@ async def get_report(request: Request):
         user_email = payload.get("email")
 
         # Step 1: Extract chat + journal data
-        chat_data = data_chat_extraction(authId, "json")
-        md_data = json_to_md(chat_data)
+        snapshot = await persona_cache.aget(authId)
+        chat_data = await data_chat_extraction_async(authId, "json", snapshot=snapshot)
+        with user_scope(snapshot.data):
+            md_data = await asyncio.to_thread(json_to_md, chat_data)
 
         # Step 2: Generate PDF into a temp file
         with NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
@@ -0,0 +1,294 @@
+"""
+Re-encrypts a user's chat history (the legacy `userHistory` array and the
+`messages` subcollection) and `journalEntries` from legacy v1 blobs
+(per-message PBKDF2) into v2 envelopes under a per-user data key.
+
+Usage:
+    python migrate_envelope.py <authId> [<authId> ...] [--batch-size 100] [--pack-history] [--dry-run]
+
+With --pack-history, history is stored as compressed segments of
+HISTORY_SEGMENT_MAX_MESSAGES messages (see history.py) instead of one v2
+envelope per message. In the messages subcollection only full runs are
+packed, each into one sealed segment document; the messages after the last
+full run are re-encrypted one by one and packed by a later run. Segments
+are always zlib, the codec the web client's getMessageHistory can read,
+whatever HISTORY_SEGMENT_CODEC says.
+
+The web client unwraps the data key and reads v2 envelopes (see
+WebApp/src/lib/crypto/encryption.ts), so deploy it before migrating users.
+"""
+import argparse
+
+from google.cloud import firestore
+
+from encryption import (
+    decrypt_many,
+    encrypt_v2,
+    generate_data_key,
+    get_user_data_key,
+    is_v2,
+    wrap_data_key,
+    DECRYPT_FAILED_MARKER,
+    WRAPPED_DATA_KEY_FIELD,
+)
+from history import pack_history, pack_segment, is_segment, HISTORY_SEGMENT_MAX_MESSAGES
+from repository import repo, MESSAGE_META_FIELDS
+
+JOURNAL_FIELDS = ("encryptedTitle", "encryptedContent")
+WEB_SEGMENT_CODEC = "zlib"
+
+
+def ensure_data_key(user_ref, user_data, user_email, dry_run=False):
+    """Returns the user's data key, creating and storing a wrapped one if needed"""
+    data_key = get_user_data_key(user_data, user_email)
+    if data_key is not None:
+        return data_key
+
+    if user_data.get(WRAPPED_DATA_KEY_FIELD):
+        raise RuntimeError("User has a wrapped data key that cannot be unwrapped")
+
+    data_key = generate_data_key()
+    if not dry_run:
+        user_ref.set({WRAPPED_DATA_KEY_FIELD: wrap_data_key(data_key, user_email)}, merge=True)
+    return data_key
+
+
+def reencrypt_batch(blobs, user_email, data_key):
+    """
+    Re-encrypts a batch of blobs as v2. Returns (new_blobs, migrated, failed);
+    blobs that are already v2 or cannot be decrypted are kept unchanged.
+    """
+    legacy = [index for index, blob in enumerate(blobs) if blob and not is_v2(blob)]
+    plaintexts = decrypt_many([blobs[index] for index in legacy], user_email, data_key=data_key)
+
+    new_blobs = list(blobs)
+    migrated = failed = 0
+    for index, plaintext in zip(legacy, plaintexts):
+        if plaintext == DECRYPT_FAILED_MARKER:
+            failed += 1
+            continue
+        new_blobs[index] = encrypt_v2(plaintext, data_key)
+        migrated += 1
+    return new_blobs, migrated, failed
+
+
+def migrate_user_history(user_ref, user_history, user_email, data_key, batch_size, dry_run=False, pack=False):
+    """Re-encrypts userHistory in batches and writes the array back in one transaction"""
+    if pack:
+        # The web client reads userHistory too and can only inflate zlib segments
+        new_history = pack_history(user_history, user_email, data_key, codec=WEB_SEGMENT_CODEC)
+        packed_before = sum(entry.get("count", 0) for entry in user_history if is_segment(entry))
+        packed_after = sum(entry.get("count", 0) for entry in new_history if is_segment(entry))
+        migrated = packed_after - packed_before
+        failed = sum(1 for entry in new_history if isinstance(entry, dict) and entry.get("encryptedMessage"))
+        if dry_run or not migrated:
+            return migrated, failed
+        _write_user_history(user_ref, user_history, new_history)
+        return migrated, failed
+
+    messages = [
+        entry.get("encryptedMessage") if isinstance(entry, dict) else None
+        for entry in user_history
+    ]
+
+    new_messages = []
+    migrated = failed = 0
+    for start in range(0, len(messages), batch_size):
+        batch, batch_migrated, batch_failed = reencrypt_batch(
+            messages[start:start + batch_size], user_email, data_key
+        )
+        new_messages.extend(batch)
+        migrated += batch_migrated
+        failed += batch_failed
+
+    new_history = []
+    for entry, message in zip(user_history, new_messages):
+        if isinstance(entry, dict) and message:
+            entry = {**entry, "encryptedMessage": message}
+        new_history.append(entry)
+
+    if dry_run or not migrated:
+        return migrated, failed
+
+    _write_user_history(user_ref, user_history, new_history)
+    return migrated, failed
+
+
+def _write_user_history(user_ref, old_history, new_history):
+    """Swaps old_history for new_history, keeping anything appended in the meantime"""
+
+    @firestore.transactional
+    def write(transaction):
+        snapshot = user_ref.get(transaction=transaction)
+        current = (snapshot.to_dict() or {}).get("userHistory") or []
+        if current[:len(old_history)] != old_history:
+            raise RuntimeError("userHistory was rewritten during migration, retry later")
+        transaction.update(user_ref, {"userHistory": new_history + current[len(old_history):]})
+
+    write(repo.client.transaction())
+
+
+def migrate_messages(user_ref, user_email, data_key, batch_size, dry_run=False, pack=False, max_messages=None):
+    """
+    Streams the messages subcollection in `seq` order and re-encrypts it,
+    committing one write batch per page
+
+    With pack, every run of max_messages consecutive messages is replaced by
+    one sealed segment document, which keeps the first message's document
+    and `seq`. Packed segments already in the subcollection end a run.
+
+    Returns:
+        tuple: (messages migrated, messages that could not be decrypted)
+    """
+    max_messages = max_messages or HISTORY_SEGMENT_MAX_MESSAGES
+    migrated = failed = 0
+    pending = []
+
+    def reencrypt():
+        nonlocal migrated, failed
+        blobs = [data["encryptedMessage"] for _, data in pending]
+        new_blobs, batch_migrated, batch_failed = reencrypt_batch(blobs, user_email, data_key)
+        migrated += batch_migrated
+        failed += batch_failed
+
+        write_batch = repo.client.batch()
+        changed = False
+        for (doc_ref, data), new_blob in zip(pending, new_blobs):
+            if new_blob != data["encryptedMessage"]:
+                write_batch.update(doc_ref, {"encryptedMessage": new_blob})
+                changed = True
+        if changed and not dry_run:
+            write_batch.commit()
+
+    def pack_run():
+        nonlocal migrated
+        plaintexts = decrypt_many([data["encryptedMessage"] for _, data in pending], user_email, data_key=data_key)
+        if DECRYPT_FAILED_MARKER in plaintexts:
+            reencrypt()
+            return
+
+        entries = [
+            {"message": plaintext, **{
+                key: value for key, value in data.items()
+                if key != "encryptedMessage" and key not in MESSAGE_META_FIELDS
+            }}
+            for (_, data), plaintext in zip(pending, plaintexts)
+        ]
+        first_ref, first = pending[0]
+        segment = pack_segment(entries, data_key, sealed=True, codec=WEB_SEGMENT_CODEC)
+        segment.update({key: first[key] for key in MESSAGE_META_FIELDS if key in first})
+
+        write_batch = repo.client.batch()
+        write_batch.set(first_ref, segment)
+        for doc_ref, _ in pending[1:]:
+            write_batch.delete(doc_ref)
+        if not dry_run:
+            write_batch.commit()
+        migrated += len(pending)
+
+    def flush():
+        if pending:
+            if pack and len(pending) == max_messages:
+                pack_run()
+            else:
+                reencrypt()
+        pending.clear()
+
+    for doc in user_ref.collection("messages").order_by("seq").stream():
+        data = doc.to_dict() or {}
+        if not data.get("encryptedMessage") or is_segment(data):
+            if pack:
+                flush()
+            continue
+        pending.append((doc.reference, data))
+        if len(pending) >= (max_messages if pack else batch_size):
+            flush()
+    flush()
+
+    return migrated, failed
+
+
+def migrate_journal_entries(user_ref, user_email, data_key, batch_size, dry_run=False):
+    """Streams journalEntries and re-encrypts them, committing one write batch per page"""
+    migrated = failed = 0
+    pending = []
+
+    def flush():
+        nonlocal migrated, failed
+        blobs = [data.get(field) for _, data in pending for field in JOURNAL_FIELDS]
+        new_blobs, batch_migrated, batch_failed = reencrypt_batch(blobs, user_email, data_key)
+        migrated += batch_migrated
+        failed += batch_failed
+
+        write_batch = repo.client.batch()
+        changed = False
+        for position, (doc_ref, data) in enumerate(pending):
+            updates = {}
+            for offset, field in enumerate(JOURNAL_FIELDS):
+                new_blob = new_blobs[position * len(JOURNAL_FIELDS) + offset]
+                if new_blob != data.get(field):
+                    updates[field] = new_blob
+            if updates:
+                write_batch.update(doc_ref, updates)
+                changed = True
+        if changed and not dry_run:
+            write_batch.commit()
+        pending.clear()
+
+    for doc in user_ref.collection("journalEntries").stream():
+        pending.append((doc.reference, doc.to_dict() or {}))
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+
+    return migrated, failed
+
+
+def migrate_user(authId, batch_size=100, dry_run=False, pack=False):
+    user_ref = repo.user_ref(authId)
+    user_doc = user_ref.get()
+    if not user_doc.exists:
+        print(f"User document not found for {authId}")
+        return
+
+    user_data = user_doc.to_dict()
+    user_email = user_data.get("email")
+    if not user_email:
+        print(f"User email not found for {authId} - required for decryption")
+        return
+
+    data_key = ensure_data_key(user_ref, user_data, user_email, dry_run)
+
+    history_migrated, history_failed = migrate_user_history(
+        user_ref, user_data.get("userHistory") or [], user_email, data_key, batch_size, dry_run, pack
+    )
+    messages_migrated, messages_failed = migrate_messages(
+        user_ref, user_email, data_key, batch_size, dry_run, pack
+    )
+    journal_migrated, journal_failed = migrate_journal_entries(
+        user_ref, user_email, data_key, batch_size, dry_run
+    )
+
+    print(
+        f"{authId}: userHistory {history_migrated} migrated, {history_failed} failed; "
+        f"messages {messages_migrated} migrated, {messages_failed} failed; "
+        f"journalEntries {journal_migrated} fields migrated, {journal_failed} failed"
+        + (" (dry run)" if dry_run else "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate users' encrypted data to v2 envelopes")
+    parser.add_argument("auth_ids", nargs="+")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--pack-history", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    for authId in args.auth_ids:
+        migrate_user(authId, args.batch_size, args.dry_run, args.pack_history)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Moves a user's chat history from the `userHistory` array on users/{id} into
+the users/{id}/messages subcollection, one document per entry.
+
+Usage:
+    python migrate_messages.py <authId> [<authId> ...] [--batch-size 200] [--dry-run]
+
+Readers treat the array as older than the subcollection, so entries are moved
+from the tail of the array, each batch taking the `seq` values just below the
+oldest message already in the subcollection. Every batch is one transaction
+that writes the message documents and truncates the array, so the history
+reads in order at any point and an interrupted run can simply be restarted.
+Entries are moved as they are (v1, v2 or packed segments), nothing is
+decrypted.
+"""
+import argparse
+
+from google.cloud import firestore
+
+from repository import repo
+
+db = repo.client
+
+# Firestore allows 500 writes per transaction, one of which truncates the array
+MAX_BATCH_SIZE = 499
+
+
+def move_batch(authId, batch_size):
+    """
+    Moves up to `batch_size` entries from the end of userHistory into the
+    messages subcollection. Returns the number of entries moved.
+    """
+    user_ref = repo.user_ref(authId)
+    messages_ref = repo.messages_ref(authId)
+
+    @firestore.transactional
+    def move(transaction):
+        snapshot = user_ref.get(field_paths=["userHistory"], transaction=transaction)
+        history = (snapshot.to_dict() or {}).get("userHistory") or []
+        batch = history[-batch_size:]
+        if not batch:
+            return 0
+
+        # The oldest message already in the subcollection, 0 if it is empty
+        oldest = list(transaction.get(messages_ref.order_by("seq").limit(1)))
+        start_seq = (oldest[0].get("seq") if oldest else 0) - len(batch)
+        for offset, entry in enumerate(batch):
+            if not isinstance(entry, dict):
+                entry = {"message": entry}
+            transaction.set(messages_ref.document(), {**entry, "seq": start_seq + offset})
+        transaction.update(user_ref, {"userHistory": history[:-len(batch)]})
+        return len(batch)
+
+    return move(db.transaction())
+
+
+def migrate_user(authId, batch_size=200, dry_run=False):
+    user_doc = repo.user_ref(authId).get(field_paths=["userHistory"])
+    if not user_doc.exists:
+        print(f"User document not found for {authId}")
+        return
+
+    total = len((user_doc.to_dict() or {}).get("userHistory") or [])
+    if dry_run:
+        print(f"{authId}: {total} userHistory entries would be moved (dry run)")
+        return
+
+    moved = 0
+    while True:
+        count = move_batch(authId, batch_size)
+        if not count:
+            break
+        moved += count
+
+    print(f"{authId}: moved {moved} userHistory entries to {repo.messages_ref(authId).id}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move users' userHistory arrays into the messages subcollection")
+    parser.add_argument("auth_ids", nargs="+")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    batch_size = min(args.batch_size, MAX_BATCH_SIZE)
+    for authId in args.auth_ids:
+        migrate_user(authId, batch_size, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from repository import repo, async_repo, project_fields, UserSnapshot, USER_SNAPSHOT_FIELDS, PERSONA_FIELDS
+
+# Persona cache configuration
+PERSONA_CACHE_MAX_BYTES = int(os.getenv('PERSONA_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+PERSONA_CACHE_TTL_SECONDS = float(os.getenv('PERSONA_CACHE_TTL_SECONDS', 300))
+# Each listened entry holds two listener streams (and their threads), so the
+# entry count is capped as well as the bytes
+PERSONA_CACHE_MAX_ENTRIES = int(os.getenv('PERSONA_CACHE_MAX_ENTRIES', 500))
+# Listeners deliver the whole user document, legacy userHistory included, on
+# every write to it; users whose document is larger are cached TTL-only
+PERSONA_CACHE_LISTEN_MAX_DOC_BYTES = int(os.getenv('PERSONA_CACHE_LISTEN_MAX_DOC_BYTES', 64 * 1024))
+
+
+def _estimate_size(snapshot: UserSnapshot) -> int:
+    return len(json.dumps([snapshot.data, snapshot.persona], default=str))
+
+
+class _Entry:
+    def __init__(self, snapshot: UserSnapshot):
+        self.snapshot = snapshot
+        self.size = _estimate_size(snapshot)
+        self.refreshed_at = time.monotonic()
+        self.watches = []
+        # Set once listening was given up for this entry; it then lives on the TTL
+        self.ttl_only = False
+
+
+class PersonaCache:
+    """
+    In-process cache of UserSnapshots kept fresh by Firestore listeners.
+
+    Each cached user has an on_snapshot listener on the user document (for
+    the `updatePersona` flag) and one on the persona document; pushed changes
+    are applied to the cached snapshot, and a push showing the user document
+    deleted evicts the entry. Callers get their own copy of the snapshot, so
+    request-scoped changes never leak into the cache. While both listeners are
+    active an entry never expires; if a listener drops, the entry falls back
+    to a TTL of `ttl_seconds` since its last refresh. Entries are evicted in
+    LRU order once their estimated size exceeds `max_bytes` or there are more
+    than `max_entries` of them, which also bounds the open listeners.
+
+    A user document listener streams the full document on every write, so
+    when the first push shows a document over `listen_max_doc_bytes` both
+    listeners are dropped and the entry is served on the TTL instead.
+    """
+
+    def __init__(self, repository=repo, async_repository=async_repo, max_bytes: int = PERSONA_CACHE_MAX_BYTES,
+                 ttl_seconds: float = PERSONA_CACHE_TTL_SECONDS, listen: bool = True,
+                 max_entries: int = PERSONA_CACHE_MAX_ENTRIES,
+                 listen_max_doc_bytes: int = PERSONA_CACHE_LISTEN_MAX_DOC_BYTES):
+        self.repository = repository
+        self.async_repository = async_repository
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.listen_max_doc_bytes = listen_max_doc_bytes
+        self.ttl_seconds = ttl_seconds
+        self.listen = listen
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pushes = 0
+
+    def get(self, authId: str) -> UserSnapshot:
+        """Returns a copy of the user's snapshot, loading it (one batched read) on a miss"""
+        snapshot = self._lookup(authId)
+        if snapshot is not None:
+            return snapshot
+        return self._store(authId, self.repository.load_user_snapshot(authId))
+
+    async def aget(self, authId: str) -> UserSnapshot:
+        """Like get(), but loads misses through the async repository"""
+        snapshot = self._lookup(authId)
+        if snapshot is not None:
+            return snapshot
+        return self._store(authId, await self.async_repository.load_user_snapshot(authId))
+
+    def _lookup(self, authId: str):
+        with self._lock:
+            entry = self._entries.get(authId)
+            if entry is not None and self._is_fresh(entry):
+                self._entries.move_to_end(authId)
+                self.hits += 1
+                return entry.snapshot.copy()
+            self.misses += 1
+            return None
+
+    def _store(self, authId: str, snapshot: UserSnapshot) -> UserSnapshot:
+        if not snapshot.exists:
+            return snapshot
+
+        entry = _Entry(snapshot)
+        with self._lock:
+            previous = self._entries.pop(authId, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[authId] = entry
+            self._bytes += entry.size
+            evicted = self._evict()
+
+        if previous is not None:
+            evicted.append(previous)
+        self._unsubscribe(evicted)
+        if self.listen:
+            self._subscribe(authId, entry)
+        return snapshot.copy()
+
+    def invalidate(self, authId: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(authId, None)
+            if entry is not None:
+                self._bytes -= entry.size
+        if entry is not None:
+            self._unsubscribe([entry])
+
+    def clear(self) -> None:
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._bytes = 0
+        self._unsubscribe(entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "pushes": self.pushes,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "listened": sum(1 for entry in self._entries.values() if entry.watches),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _is_fresh(self, entry: _Entry) -> bool:
+        if not entry.ttl_only and entry.watches and all(getattr(watch, "is_active", False) for watch in entry.watches):
+            return True
+        return time.monotonic() - entry.refreshed_at < self.ttl_seconds
+
+    def _evict(self) -> list:
+        # Called with the lock held; keeps the most recent entry even if oversized
+        evicted = []
+        while len(self._entries) > 1 and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+            evicted.append(entry)
+        return evicted
+
+    def _subscribe(self, authId: str, entry: _Entry) -> None:
+        try:
+            entry.watches = [
+                self.repository.watch_user(authId, lambda docs, changes, read_time: self._on_user_change(entry, docs)),
+                self.repository.watch_persona(authId, lambda docs, changes, read_time: self._on_persona_change(entry, docs)),
+            ]
+        except Exception as e:
+            # Without listeners the entry still expires after ttl_seconds
+            print(f"Failed to attach persona listeners for {authId}: {e}")
+            return
+        if entry.ttl_only:
+            # The first push already showed an oversized or deleted document
+            self._unsubscribe([entry])
+
+    def _unsubscribe(self, entries) -> None:
+        for entry in entries:
+            watches, entry.watches = entry.watches, []
+            for watch in watches:
+                try:
+                    watch.unsubscribe()
+                except Exception as e:
+                    print(f"Failed to detach persona listener: {e}")
+
+    def _apply(self, entry: _Entry, update) -> None:
+        with self._lock:
+            update(entry.snapshot)
+            size = _estimate_size(entry.snapshot)
+            if entry.snapshot.authId in self._entries and self._entries[entry.snapshot.authId] is entry:
+                self._bytes += size - entry.size
+            entry.size = size
+            entry.refreshed_at = time.monotonic()
+            self.pushes += 1
+            evicted = self._evict()
+        self._unsubscribe(evicted)
+
+    def _stop_listening(self, entry: _Entry) -> None:
+        entry.ttl_only = True
+        # Called from the listener's own thread, which unsubscribe() joins
+        threading.Thread(target=self._unsubscribe, args=([entry],), daemon=True).start()
+
+    def _drop(self, entry: _Entry) -> None:
+        # Evicts an entry whose user document is gone, from its listener's thread
+        with self._lock:
+            authId = entry.snapshot.authId
+            if self._entries.get(authId) is entry:
+                del self._entries[authId]
+                self._bytes -= entry.size
+        self._stop_listening(entry)
+
+    def _on_user_change(self, entry: _Entry, docs) -> None:
+        if not docs or entry.ttl_only:
+            return
+        if not docs[0].exists:
+            # Don't serve a snapshot for a deleted user; the next get() reloads
+            self._drop(entry)
+            return
+        # Listeners always deliver the full document; keep the snapshot projection
+        full = docs[0].to_dict()
+        if len(json.dumps(full, default=str)) > self.listen_max_doc_bytes:
+            self._stop_listening(entry)
+            return
+        data = project_fields(full, USER_SNAPSHOT_FIELDS)
+
+        def update(snapshot):
+            snapshot.data = data
+
+        self._apply(entry, update)
+
+    def _on_persona_change(self, entry: _Entry, docs) -> None:
+        # A missing fixed document means the user still has a legacy persona
+        # document, which the initial load already picked up
+        if not docs or not docs[0].exists:
+            return
+        persona = project_fields(docs[0].to_dict(), PERSONA_FIELDS)
+
+        def update(snapshot):
+            snapshot.persona = persona
+
+        self._apply(entry, update)
+
+
+# Shared instance used by the FastAPI handlers
+persona_cache = PersonaCache()
@@ -0,0 +1,193 @@
+import os
+import re
+import json
+import math
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_gateway import parse_site_limits
+
+# Prompt budget configuration
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 24000))
+# Per-call-site overrides, e.g. "data_chat_extraction=24000,json_to_md=8000"
+PROMPT_BUDGET_SITES = os.getenv('PROMPT_BUDGET_SITES', 'json_to_md=8000')
+# Share of the history budget reserved for the most recent turns, kept verbatim
+PROMPT_RECENT_SHARE = float(os.getenv('PROMPT_RECENT_SHARE', 0.6))
+# Older history is summarized in blocks of this many turns; blocks are aligned
+# to the start of the history so a block's digest never changes once written
+HISTORY_DIGEST_BLOCK = int(os.getenv('HISTORY_DIGEST_BLOCK', 40))
+HISTORY_DIGEST_CONCURRENCY = int(os.getenv('HISTORY_DIGEST_CONCURRENCY', 4))
+# Upper estimate of one digest's size; only as many blocks as fit are summarized
+HISTORY_DIGEST_TOKENS = 200
+
+_site_budgets = parse_site_limits(PROMPT_BUDGET_SITES)
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]|\s{2,}|\n", re.UNICODE)
+
+DIGEST_PROMPT = """Summarize this part of a conversation between a user and a therapy assistant.
+Keep every fact the user shared about themselves (personal details, work, relationships,
+health history, events, feelings, goals) and note any question the user declined to answer.
+Drop greetings and filler. Answer in plain text, at most 120 words.
+
+Conversation:
+"""
+
+
+def estimate_tokens(text) -> int:
+    """
+    Local token count estimate, without calling the model's tokenizer
+
+    Counts words, punctuation marks and runs of newlines/indentation, with
+    long words and runs split into four-character pieces the way subword
+    tokenizers do. Close enough to Gemini's counts for budgeting English and
+    JSON text.
+    """
+    text = str(text)
+    if not text:
+        return 1
+    return max(1, sum(math.ceil(len(piece) / 4) for piece in _TOKEN_PATTERN.findall(text)))
+
+
+def compact(value) -> str:
+    """JSON without indentation or padding; about a third fewer tokens than indent=2"""
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def budget_for(call_site: str) -> int:
+    """Token budget of a call site's prompt"""
+    return _site_budgets.get(call_site, PROMPT_TOKEN_BUDGET)
+
+
+def _turn_line(turn) -> str:
+    return compact(turn)
+
+
+def _block_text(turns) -> str:
+    return "\n".join(_turn_line(turn) for turn in turns)
+
+
+def _digest_blocks(blocks, summarize, concurrency: int):
+    """Digests of the blocks in order, None for blocks whose summarize() call failed"""
+    # One copy of the caller's context per block so summarize() sees its LLM cache user_scope()
+    contexts = [contextvars.copy_context() for _ in blocks]
+
+    def digest(context, block):
+        try:
+            return (context.run(summarize, DIGEST_PROMPT + _block_text(block)) or "").strip() or None
+        except Exception as e:
+            print(f"History digest failed, leaving the block out: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(blocks)))) as executor:
+        return list(executor.map(digest, contexts, blocks))
+
+
+def budget_history(turns: list, budget_tokens: int, summarize=None, block_size: int = None,
+                   recent_share: float = None, concurrency: int = None) -> str:
+    """
+    Serializes conversation turns into at most about `budget_tokens` tokens
+
+    Histories that fit are returned verbatim, one compact JSON turn per line.
+    Otherwise the most recent turns are kept verbatim (up to `recent_share`
+    of the budget) and everything before them is summarized block by block.
+    Blocks are aligned to the start of the history, so once a block is old
+    enough to be summarized its prompt never changes and its digest comes
+    from the LLM response cache on every later call. If even the digests do
+    not fit, the oldest ones are left out, as are blocks whose digest
+    request failed.
+
+    Args:
+        turns: Decrypted history entries, oldest first
+        budget_tokens: Token budget for the serialized history
+        summarize: Callable taking a prompt and returning its summary; without
+            it older turns are dropped instead of summarized
+        block_size: Turns per digest block, defaults to HISTORY_DIGEST_BLOCK
+        recent_share: Defaults to PROMPT_RECENT_SHARE
+        concurrency: Parallel digest requests, defaults to HISTORY_DIGEST_CONCURRENCY
+
+    Returns:
+        str: The history text for the prompt
+    """
+    block_size = block_size or HISTORY_DIGEST_BLOCK
+    recent_share = PROMPT_RECENT_SHARE if recent_share is None else recent_share
+    concurrency = concurrency or HISTORY_DIGEST_CONCURRENCY
+
+    lines = [_turn_line(turn) for turn in turns]
+    costs = [estimate_tokens(line) for line in lines]
+    if sum(costs) <= budget_tokens:
+        return "\n".join(lines)
+
+    # Walk back from the newest turn until the recent share is used up, then
+    # move the split forward to the next block boundary so older turns form
+    # whole blocks
+    recent_budget = budget_tokens * recent_share
+    start, used = len(turns), 0
+    while start > 0 and used + costs[start - 1] <= recent_budget:
+        used += costs[start - 1]
+        start -= 1
+    split = math.ceil(start / block_size) * block_size
+    if split >= len(turns):
+        split = (start // block_size) * block_size
+    if split >= len(turns):
+        # The newest turn alone is over the recent budget; keep it anyway
+        split = len(turns) - 1
+    recent_text = "\n".join(lines[split:])
+    remaining = budget_tokens - estimate_tokens(recent_text)
+
+    older = [turns[i:i + block_size] for i in range(0, split, block_size)]
+    # Summarize only the newest blocks whose digests can fit
+    older = older[max(0, len(older) - max(0, remaining) // HISTORY_DIGEST_TOKENS):] if older else []
+    digests = _digest_blocks(older, summarize, concurrency) if (summarize and older) else []
+    kept = []
+    for digest in reversed(digests):
+        if digest is None:
+            # Its turns count as omitted; the other digests are still used
+            continue
+        cost = estimate_tokens(digest)
+        if cost > remaining:
+            break
+        kept.append(digest)
+        remaining -= cost
+    kept.reverse()
+
+    sections = []
+    omitted = split - len(kept) * block_size
+    if omitted > 0:
+        sections.append(f"[{omitted} earlier turns omitted]")
+    if kept:
+        sections.append("Summary of earlier conversation:\n" + "\n".join(f"- {digest}" for digest in kept))
+    sections.append("Recent conversation:\n" + recent_text)
+    return "\n\n".join(sections)
+
+
+def budget_json(value, budget_tokens: int) -> str:
+    """
+    Serializes `value` compactly, shortening its longest string values
+    until it fits `budget_tokens`
+    """
+    text = compact(value)
+    if estimate_tokens(text) <= budget_tokens or not isinstance(value, (dict, list)):
+        return text
+
+    def strings(node, path=()):
+        if isinstance(node, dict):
+            for key, item in node.items():
+                yield from strings(item, path + (key,))
+        elif isinstance(node, list):
+            for index, item in enumerate(node):
+                yield from strings(item, path + (index,))
+        elif isinstance(node, str):
+            yield path, node
+
+    value = json.loads(text)
+    while estimate_tokens(text) > budget_tokens:
+        candidates = sorted(strings(value), key=lambda item: len(item[1]), reverse=True)
+        if not candidates or len(candidates[0][1]) <= 80:
+            break
+        path, longest = candidates[0]
+        parent = value
+        for key in path[:-1]:
+            parent = parent[key]
+        parent[path[-1]] = longest[:len(longest) // 2].rstrip() + " [...]"
+        text = compact(value)
+    return text
@@ -0,0 +1,470 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, List, Optional
+
+import firebase_admin
+from firebase_admin import credentials
+from google.cloud import firestore
+
+SERVICE_ACCOUNT_PATH = "service.json"
+
+# Persona info lives in a fixed document so it can be batched with the user
+# document. Older users may still only have an auto-id document.
+PERSONA_DOC_ID = "current"
+
+# Field projections. The user document carries the whole encrypted
+# userHistory array, so reads that only need a few scalars ask for those
+# field paths instead of downloading the full document.
+USER_SNAPSHOT_FIELDS = ("email", "updatePersona", "wrappedDataKey")
+PERSONA_FIELDS = ("Info", "Date")
+HISTORY_FIELDS = ("userHistory", "email", "wrappedDataKey")
+
+# Chat history lives in users/{id}/messages, one document per userHistory
+# entry ordered by `seq`. Entries still in the legacy userHistory array are
+# always older than the subcollection (see migrate_messages.py).
+MESSAGES_COLLECTION = "messages"
+MESSAGE_META_FIELDS = ("seq", "createdAt")
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 200))
+
+# Per-request document read counter, set by UserRepository.track_reads()
+_request_reads = contextvars.ContextVar("firestore_request_reads", default=None)
+
+
+def _count_reads(count):
+    counter = _request_reads.get()
+    if counter is not None:
+        counter[0] += count
+
+
+def _load_credentials():
+    """Loads the service account and initializes Firebase Admin once per process"""
+    cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(cred)
+    return cred
+
+
+def project_fields(data: Optional[Dict[str, Any]], field_paths) -> Optional[Dict[str, Any]]:
+    """Keeps only the top-level `field_paths` of a document dict, e.g. for listener pushes"""
+    if data is None:
+        return None
+    return {field: data[field] for field in field_paths if field in data}
+
+
+def _message_entry(doc) -> Dict[str, Any]:
+    """Turns a messages document back into a userHistory entry"""
+    return {key: value for key, value in (doc.to_dict() or {}).items() if key not in MESSAGE_META_FIELDS}
+
+
+def _timed(name):
+    """Records the latency of a repository call under `name`"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(self, *args, **kwargs)
+                finally:
+                    self._record(name, time.perf_counter() - start)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self._record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class UserSnapshot:
+    """
+    Request-scoped view of users/{authId} and its persona document, loaded
+    once per request and handed to every helper that needs user data.
+
+    `data` only holds USER_SNAPSHOT_FIELDS and `persona` only PERSONA_FIELDS;
+    code that needs userHistory reads HISTORY_FIELDS on its own.
+    """
+
+    def __init__(self, authId: str, data: Optional[Dict[str, Any]], persona: Optional[Dict[str, Any]]):
+        self.authId = authId
+        self.data = data
+        self.persona = persona
+
+    @property
+    def exists(self) -> bool:
+        return self.data is not None
+
+    @property
+    def email(self) -> Optional[str]:
+        return (self.data or {}).get("email")
+
+    @property
+    def update_needed(self) -> bool:
+        if self.data is None:
+            return True
+        return self.data.get("updatePersona", True)
+
+    @property
+    def persona_info(self) -> Optional[str]:
+        return (self.persona or {}).get("Info")
+
+    def copy(self) -> "UserSnapshot":
+        """Returns a snapshot whose data and persona can be changed without affecting this one"""
+        return UserSnapshot(
+            self.authId,
+            dict(self.data) if self.data is not None else None,
+            dict(self.persona) if self.persona is not None else None,
+        )
+
+
+class UserRepository:
+    """
+    Process-wide access layer for the `users` collection.
+
+    Owns a single long-lived Firestore client so that requests reuse one
+    channel instead of building a client (and doing the auth handshake)
+    per call, and records per-call latency for every method.
+    """
+
+    def __init__(self, client: firestore.Client = None):
+        self._client = client
+        self._client_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._latency = {}
+        self._endpoint_reads = {}
+
+    @property
+    def client(self) -> firestore.Client:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    cred = _load_credentials()
+                    self._client = firestore.Client(credentials=cred.get_credential(), project=cred.project_id)
+        return self._client
+
+    def _record(self, name: str, seconds: float) -> None:
+        with self._stats_lock:
+            stats = self._latency.setdefault(name, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["calls"] += 1
+            stats["total_ms"] += seconds * 1000
+            stats["max_ms"] = max(stats["max_ms"], seconds * 1000)
+
+    def latency_stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns call count, total, mean and max latency (ms) per method"""
+        with self._stats_lock:
+            return {
+                name: {**stats, "mean_ms": stats["total_ms"] / stats["calls"]}
+                for name, stats in self._latency.items()
+            }
+
+    @contextmanager
+    def track_reads(self, endpoint: str):
+        """Counts the documents read inside the block and records them under `endpoint`"""
+        counter = [0]
+        token = _request_reads.set(counter)
+        try:
+            yield counter
+        finally:
+            _request_reads.reset(token)
+            with self._stats_lock:
+                stats = self._endpoint_reads.setdefault(endpoint, {"requests": 0, "total_reads": 0, "max_reads": 0})
+                stats["requests"] += 1
+                stats["total_reads"] += counter[0]
+                stats["max_reads"] = max(stats["max_reads"], counter[0])
+
+    def read_stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns Firestore document reads per endpoint"""
+        with self._stats_lock:
+            return {
+                endpoint: {**stats, "mean_reads": stats["total_reads"] / stats["requests"]}
+                for endpoint, stats in self._endpoint_reads.items()
+            }
+
+    def user_ref(self, authId: str) -> firestore.DocumentReference:
+        return self.client.collection("users").document(authId)
+
+    # User document
+
+    @_timed("get_user")
+    def get_user(self, authId: str) -> Optional[Dict[str, Any]]:
+        """Returns the user document as a dict, or None if it does not exist"""
+        user_doc = self.user_ref(authId).get()
+        _count_reads(1)
+        return user_doc.to_dict() if user_doc.exists else None
+
+    @_timed("get_user_fields")
+    def get_user_fields(self, authId: str, field_paths) -> Optional[Dict[str, Any]]:
+        """
+        Returns only `field_paths` of the user document, or None if it does not exist
+
+        Args:
+            authId: The user's id
+            field_paths: Field paths to fetch, e.g. ("email", "currentQuestion")
+
+        Returns:
+            Optional[Dict[str, Any]]: The projected fields that are set on the document
+        """
+        user_doc = self.user_ref(authId).get(field_paths=list(field_paths))
+        _count_reads(1)
+        return user_doc.to_dict() if user_doc.exists else None
+
+    @_timed("load_user_snapshot")
+    def load_user_snapshot(self, authId: str) -> UserSnapshot:
+        """Reads the projected user and persona documents in one batched get_all"""
+        user_ref = self.user_ref(authId)
+        persona_ref = self.persona_ref(authId)
+        field_paths = list(USER_SNAPSHOT_FIELDS + PERSONA_FIELDS)
+        docs = {doc.reference.path: doc for doc in self.client.get_all([user_ref, persona_ref], field_paths=field_paths)}
+        _count_reads(2)
+
+        user_doc = docs.get(user_ref.path)
+        persona_doc = docs.get(persona_ref.path)
+        user_data = user_doc.to_dict() if user_doc is not None and user_doc.exists else None
+
+        if persona_doc is not None and persona_doc.exists:
+            persona_data = persona_doc.to_dict()
+        elif user_data is not None:
+            persona_data = self._legacy_persona(authId)
+        else:
+            persona_data = None
+        return UserSnapshot(authId, user_data, persona_data)
+
+    @_timed("set_user_fields")
+    def set_user_fields(self, authId: str, fields: Dict[str, Any]) -> None:
+        """Merges `fields` into the user document"""
+        self.user_ref(authId).set(fields, merge=True)
+
+    # Persona subcollection
+
+    def persona_ref(self, authId: str) -> firestore.DocumentReference:
+        return self.user_ref(authId).collection("persona").document(PERSONA_DOC_ID)
+
+    def _legacy_persona(self, authId: str) -> Optional[Dict[str, Any]]:
+        # Users whose persona was written before PERSONA_DOC_ID existed
+        docs = self.user_ref(authId).collection("persona").select(PERSONA_FIELDS).limit(1).get()
+        _count_reads(max(1, len(docs)))
+        return docs[0].to_dict() if docs else None
+
+    @_timed("get_persona")
+    def get_persona(self, authId: str) -> Optional[Dict[str, Any]]:
+        """Returns the persona document as a dict, or None if there is none"""
+        persona_doc = self.persona_ref(authId).get(field_paths=list(PERSONA_FIELDS))
+        _count_reads(1)
+        if persona_doc.exists:
+            return persona_doc.to_dict()
+        return self._legacy_persona(authId)
+
+    @_timed("save_persona_info")
+    def save_persona_info(self, authId: str, info: str) -> None:
+        """Stores persona info in the fixed persona document"""
+        self.persona_ref(authId).set({"Info": info, "Date": firestore.SERVER_TIMESTAMP}, merge=True)
+
+    # Messages subcollection
+
+    def messages_ref(self, authId: str) -> firestore.CollectionReference:
+        return self.user_ref(authId).collection(MESSAGES_COLLECTION)
+
+    def iter_history_pages(self, authId: str, user_history: Optional[list] = None, page_size: int = None):
+        """
+        Yields the user's chat history as pages of raw userHistory entries, oldest first
+
+        Entries left in the legacy userHistory array come first, then the
+        messages subcollection is streamed in `seq` order, `page_size`
+        documents per query (limit/start_after). Pages are fetched lazily,
+        so stopping early skips the remaining reads.
+
+        Args:
+            authId: The user's id
+            user_history: The legacy userHistory array, if the caller already
+                read it; otherwise it is fetched with a projected read
+            page_size: Documents per page; defaults to HISTORY_PAGE_SIZE
+        """
+        page_size = page_size or HISTORY_PAGE_SIZE
+        if user_history is None:
+            user_history = (self.get_user_fields(authId, ["userHistory"]) or {}).get("userHistory") or []
+        if user_history:
+            yield list(user_history)
+
+        query = self.messages_ref(authId).order_by("seq").limit(page_size)
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc is not None else query
+            docs = list(page_query.stream())
+            _count_reads(max(1, len(docs)))
+            if not docs:
+                return
+            yield [_message_entry(doc) for doc in docs]
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+
+    # Listeners
+
+    def watch_user(self, authId: str, callback):
+        """
+        Subscribes to changes of the user document. `callback` receives
+        (doc_snapshots, changes, read_time); the returned watch exposes
+        `is_active` and `unsubscribe()`.
+        """
+        return self.user_ref(authId).on_snapshot(callback)
+
+    def watch_persona(self, authId: str, callback):
+        """Subscribes to changes of the fixed persona document, see watch_user()"""
+        return self.persona_ref(authId).on_snapshot(callback)
+
+    # Journal entries
+
+    @_timed("save_journal_fields")
+    def save_journal_fields(self, authId: str, updates: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Updates fields on several journal entries in one write batch
+
+        Args:
+            authId: The user's id
+            updates: {entry_id: {field: value}}; entries that no longer exist fail the batch
+        """
+        journal_ref = self.user_ref(authId).collection("journalEntries")
+        batch = self.client.batch()
+        for entry_id, fields in updates.items():
+            batch.update(journal_ref.document(entry_id), fields)
+        batch.commit()
+
+    @_timed("latest_journal_entries")
+    def latest_journal_entries(self, authId: str, limit: int) -> List[firestore.DocumentSnapshot]:
+        """Returns up to `limit` journal entries, newest first"""
+        journal_ref = self.user_ref(authId).collection("journalEntries")
+        query = journal_ref.order_by("date", direction=firestore.Query.DESCENDING).limit(limit)
+        docs = list(query.stream())
+        _count_reads(max(1, len(docs)))
+        return docs
+
+
+class AsyncUserRepository:
+    """
+    Async counterpart of UserRepository built on firestore.AsyncClient, for
+    use from the FastAPI handlers so that reads don't block the event loop.
+    Latency is recorded into the sync repository so /metrics sees both.
+    """
+
+    def __init__(self, stats_owner: UserRepository, client: firestore.AsyncClient = None):
+        self.stats_owner = stats_owner
+        self._client = client
+
+    @property
+    def client(self) -> firestore.AsyncClient:
+        # Created on first use so it binds to the running event loop
+        if self._client is None:
+            cred = _load_credentials()
+            self._client = firestore.AsyncClient(credentials=cred.get_credential(), project=cred.project_id)
+        return self._client
+
+    def _record(self, name: str, seconds: float) -> None:
+        self.stats_owner._record(f"{name}_async", seconds)
+
+    def user_ref(self, authId: str):
+        return self.client.collection("users").document(authId)
+
+    def persona_ref(self, authId: str):
+        return self.user_ref(authId).collection("persona").document(PERSONA_DOC_ID)
+
+    @_timed("get_user")
+    async def get_user(self, authId: str) -> Optional[Dict[str, Any]]:
+        user_doc = await self.user_ref(authId).get()
+        _count_reads(1)
+        return user_doc.to_dict() if user_doc.exists else None
+
+    @_timed("get_user_fields")
+    async def get_user_fields(self, authId: str, field_paths) -> Optional[Dict[str, Any]]:
+        user_doc = await self.user_ref(authId).get(field_paths=list(field_paths))
+        _count_reads(1)
+        return user_doc.to_dict() if user_doc.exists else None
+
+    @_timed("load_user_snapshot")
+    async def load_user_snapshot(self, authId: str) -> UserSnapshot:
+        """Reads the projected user and persona documents in one batched get_all"""
+        user_ref = self.user_ref(authId)
+        persona_ref = self.persona_ref(authId)
+        field_paths = list(USER_SNAPSHOT_FIELDS + PERSONA_FIELDS)
+        docs = {}
+        async for doc in self.client.get_all([user_ref, persona_ref], field_paths=field_paths):
+            docs[doc.reference.path] = doc
+        _count_reads(2)
+
+        user_doc = docs.get(user_ref.path)
+        persona_doc = docs.get(persona_ref.path)
+        user_data = user_doc.to_dict() if user_doc is not None and user_doc.exists else None
+
+        if persona_doc is not None and persona_doc.exists:
+            persona_data = persona_doc.to_dict()
+        elif user_data is not None:
+            persona_data = await self._legacy_persona(authId)
+        else:
+            persona_data = None
+        return UserSnapshot(authId, user_data, persona_data)
+
+    @_timed("set_user_fields")
+    async def set_user_fields(self, authId: str, fields: Dict[str, Any]) -> None:
+        await self.user_ref(authId).set(fields, merge=True)
+
+    async def _legacy_persona(self, authId: str) -> Optional[Dict[str, Any]]:
+        docs = await self.user_ref(authId).collection("persona").select(PERSONA_FIELDS).limit(1).get()
+        _count_reads(max(1, len(docs)))
+        return docs[0].to_dict() if docs else None
+
+    @_timed("get_persona")
+    async def get_persona(self, authId: str) -> Optional[Dict[str, Any]]:
+        persona_doc = await self.persona_ref(authId).get(field_paths=list(PERSONA_FIELDS))
+        _count_reads(1)
+        if persona_doc.exists:
+            return persona_doc.to_dict()
+        return await self._legacy_persona(authId)
+
+    @_timed("save_persona_info")
+    async def save_persona_info(self, authId: str, info: str) -> None:
+        await self.persona_ref(authId).set({"Info": info, "Date": firestore.SERVER_TIMESTAMP}, merge=True)
+
+    def messages_ref(self, authId: str):
+        return self.user_ref(authId).collection(MESSAGES_COLLECTION)
+
+    async def iter_history_pages(self, authId: str, user_history: Optional[list] = None, page_size: int = None):
+        """Async generator counterpart of UserRepository.iter_history_pages()"""
+        page_size = page_size or HISTORY_PAGE_SIZE
+        if user_history is None:
+            user_history = (await self.get_user_fields(authId, ["userHistory"]) or {}).get("userHistory") or []
+        if user_history:
+            yield list(user_history)
+
+        query = self.messages_ref(authId).order_by("seq").limit(page_size)
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc is not None else query
+            docs = await page_query.get()
+            _count_reads(max(1, len(docs)))
+            if not docs:
+                return
+            yield [_message_entry(doc) for doc in docs]
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+
+    @_timed("latest_journal_entries")
+    async def latest_journal_entries(self, authId: str, limit: int) -> list:
+        journal_ref = self.user_ref(authId).collection("journalEntries")
+        query = journal_ref.order_by("date", direction=firestore.Query.DESCENDING).limit(limit)
+        docs = await query.get()
+        _count_reads(max(1, len(docs)))
+        return docs
+
+
+# Shared instances used by dataSync.py, data.py and the FastAPI handlers
+repo = UserRepository()
+async_repo = AsyncUserRepository(repo)
@@ -0,0 +1,204 @@
+"""
+In-memory stand-ins for the parts of firestore.AsyncClient that
+AsyncUserRepository uses and of the sync firestore.Client the migration
+tools use. Documents live in a dict keyed by path; every async round trip
+waits `rtt_seconds`, with asyncio.sleep() like a real async client or,
+with blocking=True, with time.sleep() like a sync client called from a
+handler.
+"""
+import asyncio
+import time
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+def _project(data, field_paths):
+    if data is None or field_paths is None:
+        return data
+    return {field: data[field] for field in field_paths if field in data}
+
+
+class FakeDocumentReference:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return FakeQuery(self.client, f"{self.path}/{name}")
+
+    async def get(self, field_paths=None):
+        await self.client.round_trip()
+        return FakeSnapshot(self, _project(self.client.documents.get(self.path), field_paths))
+
+    async def set(self, fields, merge=False):
+        await self.client.round_trip()
+        current = self.client.documents.get(self.path) if merge else None
+        self.client.documents[self.path] = {**(current or {}), **fields}
+
+
+class FakeQuery:
+    def __init__(self, client, path, field_paths=None, order=None, limit=None, after=None):
+        self.client = client
+        self.path = path
+        self.field_paths = field_paths
+        self.order = order
+        self._limit = limit
+        self.after = after
+
+    def _copy(self, **changes):
+        state = dict(field_paths=self.field_paths, order=self.order, limit=self._limit, after=self.after)
+        state.update(changes)
+        return FakeQuery(self.client, self.path, **state)
+
+    def document(self, document_id):
+        return FakeDocumentReference(self.client, f"{self.path}/{document_id}")
+
+    def select(self, field_paths):
+        return self._copy(field_paths=list(field_paths))
+
+    def order_by(self, field, direction=None):
+        return self._copy(order=(field, direction == "DESCENDING"))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot)
+
+    async def get(self):
+        await self.client.round_trip()
+        prefix = self.path + "/"
+        docs = [
+            FakeSnapshot(FakeDocumentReference(self.client, path), data)
+            for path, data in self.client.documents.items()
+            if path.startswith(prefix) and "/" not in path[len(prefix):]
+        ]
+        if self.order is not None:
+            field, descending = self.order
+            docs.sort(key=lambda doc: doc.to_dict().get(field), reverse=descending)
+        if self.after is not None:
+            paths = [doc.reference.path for doc in docs]
+            docs = docs[paths.index(self.after.reference.path) + 1:]
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        return [FakeSnapshot(doc.reference, _project(doc.to_dict(), self.field_paths)) for doc in docs]
+
+
+class FakeAsyncClient:
+    def __init__(self, documents=None, rtt_seconds=0.0, blocking=False):
+        self.documents = documents if documents is not None else {}
+        self.rtt_seconds = rtt_seconds
+        self.blocking = blocking
+        self.round_trips = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def round_trip(self):
+        self.round_trips += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.blocking:
+                time.sleep(self.rtt_seconds)
+            else:
+                await asyncio.sleep(self.rtt_seconds)
+        finally:
+            self.in_flight -= 1
+
+    def collection(self, name):
+        return FakeQuery(self, name)
+
+    async def get_all(self, references, field_paths=None):
+        await self.round_trip()
+        for reference in references:
+            yield FakeSnapshot(reference, _project(self.documents.get(reference.path), field_paths))
+
+
+class FakeSyncDocumentReference:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return FakeSyncQuery(self.client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None):
+        return FakeSnapshot(self, _project(self.client.documents.get(self.path), field_paths))
+
+    def set(self, fields, merge=False):
+        current = self.client.documents.get(self.path) if merge else None
+        self.client.documents[self.path] = {**(current or {}), **fields}
+
+    def update(self, fields):
+        if self.path not in self.client.documents:
+            raise KeyError(f"No document to update: {self.path}")
+        self.set(fields, merge=True)
+
+    def delete(self):
+        self.client.documents.pop(self.path, None)
+
+
+class FakeSyncQuery:
+    def __init__(self, client, path, order=None):
+        self.client = client
+        self.path = path
+        self.order = order
+
+    def document(self, document_id):
+        return FakeSyncDocumentReference(self.client, f"{self.path}/{document_id}")
+
+    def order_by(self, field, direction=None):
+        return FakeSyncQuery(self.client, self.path, order=field)
+
+    def stream(self):
+        prefix = self.path + "/"
+        docs = [
+            FakeSnapshot(FakeSyncDocumentReference(self.client, path), data)
+            for path, data in self.client.documents.items()
+            if path.startswith(prefix) and "/" not in path[len(prefix):]
+        ]
+        if self.order is not None:
+            docs.sort(key=lambda doc: doc.to_dict().get(self.order))
+        return iter(docs)
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+
+    def set(self, reference, fields, merge=False):
+        self.writes.append(lambda: reference.set(fields, merge=merge))
+
+    def update(self, reference, fields):
+        self.writes.append(lambda: reference.update(fields))
+
+    def delete(self, reference):
+        self.writes.append(reference.delete)
+
+    def commit(self):
+        for write in self.writes:
+            write()
+        self.client.commits.append(len(self.writes))
+
+
+class FakeSyncClient:
+    def __init__(self, documents=None):
+        self.documents = documents if documents is not None else {}
+        self.commits = []
+
+    def collection(self, name):
+        return FakeSyncQuery(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
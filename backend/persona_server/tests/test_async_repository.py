@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+
+from persona_cache import PersonaCache
+from repository import AsyncUserRepository, UserRepository, USER_SNAPSHOT_FIELDS
+from tests.fake_firestore import FakeAsyncClient
+
+
+def make_documents(users=1):
+    documents = {}
+    for i in range(users):
+        documents[f"users/user{i}"] = {
+            "email": f"user{i}@example.com",
+            "updatePersona": False,
+            "userHistory": [{"encryptedMessage": "x" * 100, "role": "user"}] * 20,
+        }
+        documents[f"users/user{i}/persona/current"] = {
+            "Info": json.dumps({"Info": {"name": f"user{i}"}, "Graph": {"nodes": []}}),
+            "Date": "2025-01-01",
+        }
+    return documents
+
+
+def make_repository(documents, **kwargs):
+    client = FakeAsyncClient(documents, **kwargs)
+    return client, AsyncUserRepository(UserRepository(), client=client)
+
+
+def test_load_user_snapshot_reads_projected_fields_in_one_round_trip():
+    client, repository = make_repository(make_documents())
+
+    snapshot = asyncio.run(repository.load_user_snapshot("user0"))
+
+    assert client.round_trips == 1
+    assert set(snapshot.data) <= set(USER_SNAPSHOT_FIELDS)
+    assert snapshot.update_needed is False
+    assert json.loads(snapshot.persona_info)["Info"] == {"name": "user0"}
+
+
+def test_load_user_snapshot_falls_back_to_legacy_persona():
+    documents = make_documents()
+    documents["users/user0/persona/legacy-id"] = documents.pop("users/user0/persona/current")
+    client, repository = make_repository(documents)
+
+    snapshot = asyncio.run(repository.load_user_snapshot("user0"))
+
+    assert client.round_trips == 2
+    assert json.loads(snapshot.persona_info)["Info"] == {"name": "user0"}
+
+
+def test_missing_user_has_no_snapshot():
+    _, repository = make_repository({})
+
+    snapshot = asyncio.run(repository.load_user_snapshot("nobody"))
+
+    assert not snapshot.exists and snapshot.persona is None
+
+
+def test_iter_history_pages_yields_legacy_then_paged_messages():
+    documents = make_documents()
+    for seq in range(5):
+        documents[f"users/user0/messages/m{seq}"] = {"seq": seq, "encryptedMessage": f"m{seq}", "role": "user"}
+    _, repository = make_repository(documents)
+
+    async def collect():
+        return [page async for page in repository.iter_history_pages("user0", page_size=2)]
+
+    pages = asyncio.run(collect())
+
+    assert len(pages[0]) == 20
+    assert [[entry["encryptedMessage"] for entry in page] for page in pages[1:]] == [["m0", "m1"], ["m2", "m3"], ["m4"]]
+    assert all("seq" not in entry for page in pages[1:] for entry in page)
+
+
+def test_concurrent_snapshot_loads_overlap_on_the_event_loop():
+    users, rtt = 50, 0.05
+    client, repository = make_repository(make_documents(users), rtt_seconds=rtt)
+    cache = PersonaCache(async_repository=repository, ttl_seconds=0, listen=False)
+
+    async def run():
+        start = time.perf_counter()
+        snapshots = await asyncio.gather(*(cache.aget(f"user{i}") for i in range(users)))
+        return snapshots, time.perf_counter() - start
+
+    snapshots, elapsed = asyncio.run(run())
+
+    assert [snapshot.data["email"] for snapshot in snapshots] == [f"user{i}@example.com" for i in range(users)]
+    assert client.max_in_flight == users
+    # Serialized loads would take users * rtt = 2.5s
+    assert elapsed < 10 * rtt
+
+
+def test_get_report_serves_concurrent_requests_through_async_repository(monkeypatch):
+    httpx = pytest.importorskip("httpx")
+    # Gemini clients are built at import time; no request here reaches them
+    for name in ("GOOGLE_API_KEY", "GEMINI_API_KEY"):
+        if not os.getenv(name):
+            monkeypatch.setenv(name, "test-key")
+    try:
+        import main
+    except (ImportError, OSError) as error:
+        # main.py pulls in the report (WeasyPrint needs system libraries) and LLM dependencies
+        pytest.skip(f"main.py dependencies unavailable: {error}")
+
+    users, rtt = 20, 0.05
+    client, repository = make_repository(make_documents(users), rtt_seconds=rtt)
+    monkeypatch.setattr(main, "persona_cache", PersonaCache(async_repository=repository, ttl_seconds=0, listen=False))
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*(
+                http.post("/getReport", json={"authId": f"user{i}"}) for i in range(users)
+            ))
+
+    responses = asyncio.run(run())
+
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.json()["status"] == "cache used." for response in responses)
+    assert [response.json()["info"] for response in responses] == [{"name": f"user{i}"} for i in range(users)]
+    assert client.max_in_flight > 1
@@ -0,0 +1,96 @@
+import asyncio
+import os
+
+import pytest
+
+import chat
+from chat import reflection_chatbot_async, reflection_chatbot_stream
+from llm_gateway import LLMGateway
+from repository import UserSnapshot
+
+
+class FakeGateway(LLMGateway):
+    """Real stream metrics, canned chunks"""
+
+    def __init__(self, chunks):
+        super().__init__()
+        self.chunks = chunks
+        self.call_sites = []
+
+    def stream(self, call_site, open_stream):
+        self.call_sites.append(call_site)
+
+        async def chunks():
+            for text in self.chunks:
+                yield text
+        return chunks()
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    gateway = FakeGateway(["Hello", ", ", "there"])
+    monkeypatch.setattr(chat, "gateway", gateway)
+    monkeypatch.setattr(chat, "get_vertex_client", lambda: None)
+    monkeypatch.setattr(chat, "genai_stream", lambda *args: None)
+    return gateway
+
+
+def test_stream_records_its_metrics_on_the_gateway(gateway):
+    async def collect():
+        return [text async for text in reflection_chatbot_stream("info", "hi")]
+
+    assert asyncio.run(collect()) == ["Hello", ", ", "there"]
+    recorded = gateway.stream_stats()["reflection_chatbot_stream"]
+    assert (recorded["streams"], recorded["completed"]) == (1, 1)
+    assert recorded["ttft"]["calls"] == recorded["duration"]["calls"] == 1
+    assert gateway.call_sites == ["reflection_chatbot_stream"]
+
+
+def test_closed_stream_is_recorded_as_cancelled(gateway):
+    async def first_chunk():
+        chunks = reflection_chatbot_stream("info", "hi")
+        text = await chunks.__anext__()
+        await chunks.aclose()
+        return text
+
+    assert asyncio.run(first_chunk()) == "Hello"
+    recorded = gateway.stream_stats()["reflection_chatbot_stream"]
+    assert (recorded["cancelled"], recorded["ttft"]["calls"]) == (1, 1)
+    assert "duration" not in recorded
+
+
+def test_buffered_reply_is_kept_out_of_chat_stream_stats(gateway):
+    assert asyncio.run(reflection_chatbot_async("info", "hi")) == "Hello, there"
+    assert list(gateway.stream_stats()) == ["reflection_chatbot"]
+    assert gateway.call_sites == ["reflection_chatbot"]
+
+
+def import_main(monkeypatch):
+    # Gemini clients are built at import time; no request here reaches them
+    for name in ("GOOGLE_API_KEY", "GEMINI_API_KEY"):
+        if not os.getenv(name):
+            monkeypatch.setenv(name, "test-key")
+    try:
+        import main
+    except (ImportError, OSError) as error:
+        # main.py pulls in the report (WeasyPrint needs system libraries) and LLM dependencies
+        pytest.skip(f"main.py dependencies unavailable: {error}")
+    return main
+
+
+def test_missing_persona_is_built_before_the_reply(monkeypatch):
+    main = import_main(monkeypatch)
+    snapshot = UserSnapshot("user", {"email": "user@example.com", "updatePersona": True}, None)
+    built = []
+
+    async def aget(authId):
+        return snapshot
+
+    async def update_persona(authId, user_message, snapshot=None):
+        built.append(authId)
+        snapshot.persona = {"Info": "persona"}
+    monkeypatch.setattr(main.persona_cache, "aget", aget)
+    monkeypatch.setattr(main, "updatePersona", update_persona)
+
+    assert asyncio.run(main.chat_user_info("user", "hi")) == "persona"
+    assert built == ["user"]
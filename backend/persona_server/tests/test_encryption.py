@@ -0,0 +1,229 @@
+import base64
+from types import SimpleNamespace
+
+import pytest
+
+import encryption
+from encryption import (DerivedKeyCache, decrypt, decrypt_many, encrypt, encrypt_v2, generate_data_key,
+                        get_user_data_key, is_v2, unwrap_data_key, wrap_data_key, DECRYPT_FAILED_MARKER,
+                        WRAPPED_DATA_KEY_FIELD)
+
+EMAIL = "user@example.com"
+
+
+@pytest.fixture(autouse=True)
+def fresh_key_cache():
+    encryption.key_cache.clear()
+    yield
+    encryption.key_cache.clear()
+
+
+def test_v2_envelope_round_trips_under_the_data_key():
+    data_key = generate_data_key()
+
+    blob = encrypt_v2("hello", data_key)
+
+    assert is_v2(blob)
+    assert base64.b64decode(blob)[0] == encryption.ENVELOPE_V2
+    assert decrypt(blob, EMAIL, data_key=data_key) == "hello"
+
+
+def test_v2_envelope_needs_the_data_key():
+    blob = encrypt_v2("hello", generate_data_key())
+
+    with pytest.raises(Exception):
+        decrypt(blob, EMAIL)
+    with pytest.raises(Exception):
+        decrypt(blob, EMAIL, data_key=generate_data_key())
+
+
+def test_v1_blobs_still_decrypt_with_or_without_a_data_key():
+    blob = encrypt("hello", EMAIL)
+
+    assert not is_v2(blob)
+    assert decrypt(blob, EMAIL) == "hello"
+    assert decrypt(blob, EMAIL, data_key=generate_data_key()) == "hello"
+
+
+def test_v1_blob_starting_with_the_version_byte_falls_back_to_v1(monkeypatch):
+    # A random v1 salt can begin with the v2 version byte
+    salt = bytes([encryption.ENVELOPE_V2]) + bytes(15)
+    monkeypatch.setattr(encryption.secrets, "token_bytes", lambda size: salt if size == 16 else bytes(size))
+
+    blob = encrypt("hello", EMAIL)
+
+    assert decrypt(blob, EMAIL, data_key=generate_data_key()) == "hello"
+
+
+def test_wrapped_data_key_unwraps_with_the_users_key():
+    data_key = generate_data_key()
+
+    wrapped = wrap_data_key(data_key, EMAIL)
+
+    assert unwrap_data_key(wrapped, EMAIL) == data_key
+    with pytest.raises(Exception):
+        unwrap_data_key(wrapped, "someone-else@example.com")
+
+
+def test_get_user_data_key():
+    data_key = generate_data_key()
+    user_data = {WRAPPED_DATA_KEY_FIELD: wrap_data_key(data_key, EMAIL)}
+
+    assert get_user_data_key(user_data, EMAIL) == data_key
+    # Not migrated, no key to unwrap with, or a key that does not unwrap
+    assert get_user_data_key({}, EMAIL) is None
+    assert get_user_data_key(user_data, None) is None
+    assert get_user_data_key(user_data, "someone-else@example.com") is None
+
+
+@pytest.fixture
+def derivations(monkeypatch):
+    """Cheap stand-in for PBKDF2 that records every derivation"""
+    calls = []
+
+    def derive(password, salt):
+        calls.append((password, bytes(salt)))
+        return (password.encode() + bytes(salt)).ljust(32, b"\0")[:32]
+    monkeypatch.setattr(encryption, "_derive_key_uncached", derive)
+    return calls
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(encryption, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_key_cache_derives_once_per_password_and_salt(derivations):
+    cache = DerivedKeyCache(max_entries=8, idle_seconds=60)
+
+    first = cache.get(EMAIL, b"salt-1")
+
+    assert cache.get(EMAIL, b"salt-1") == first
+    assert cache.get(EMAIL, b"salt-2") != first
+    assert cache.get("other@example.com", b"salt-1") != first
+    assert len(derivations) == 3
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 3
+
+
+def test_key_cache_evicts_the_least_recently_used_key(derivations):
+    cache = DerivedKeyCache(max_entries=2, idle_seconds=60)
+    cache.get(EMAIL, b"a")
+    cache.get(EMAIL, b"b")
+    cache.get(EMAIL, b"a")
+
+    cache.get(EMAIL, b"c")
+
+    assert cache.lookup(EMAIL, b"b") is None
+    assert cache.lookup(EMAIL, b"a") is not None
+    assert cache.lookup(EMAIL, b"c") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 2
+
+
+def test_key_cache_expires_idle_keys(derivations, clock):
+    cache = DerivedKeyCache(max_entries=8, idle_seconds=60)
+    cache.get(EMAIL, b"idle")
+    cache.get(EMAIL, b"busy")
+
+    clock[0] += 45
+    cache.get(EMAIL, b"busy")
+    clock[0] += 45
+
+    assert cache.lookup(EMAIL, b"idle") is None
+    assert cache.lookup(EMAIL, b"busy") is not None
+    cache.get(EMAIL, b"idle")
+    assert derivations.count((EMAIL, b"idle")) == 2
+
+
+def test_disabled_key_cache_always_derives(derivations):
+    cache = DerivedKeyCache(max_entries=0)
+
+    cache.get(EMAIL, b"salt")
+    cache.get(EMAIL, b"salt")
+
+    assert len(derivations) == 2
+    assert cache.stats()["size"] == 0
+
+
+def test_encrypt_leaves_the_key_cache_alone():
+    blob = encrypt("hello", EMAIL)
+
+    assert encryption.key_cache.stats()["size"] == 0
+    assert decrypt(blob, EMAIL) == "hello"
+    assert encryption.key_cache.stats()["size"] == 1
+
+
+class FakePool:
+    """Runs pool tasks in-process and records how many items each map() got"""
+
+    def __init__(self):
+        self.batches = []
+
+    def map(self, function, *iterables, chunksize=1):
+        items = list(zip(*iterables))
+        self.batches.append(len(items))
+        return [function(*item) for item in items]
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    fake = FakePool()
+    monkeypatch.setattr(encryption, "_get_pool", lambda: fake)
+    monkeypatch.setattr(encryption, "DECRYPT_POOL_WORKERS", 4)
+    monkeypatch.setattr(encryption, "DECRYPT_POOL_MIN_BATCH", 3)
+    return fake
+
+
+def test_decrypt_many_keeps_the_input_order(pool):
+    texts = [f"message {index}" for index in range(6)]
+
+    assert decrypt_many([encrypt(text, EMAIL) for text in texts], EMAIL) == texts
+
+
+def test_decrypt_many_substitutes_the_failure_marker(pool):
+    items = [encrypt("first", EMAIL), encrypt("foreign", "someone-else@example.com"), "", "not base64!",
+             encrypt("last", EMAIL)]
+
+    assert decrypt_many(items, EMAIL) == ["first", DECRYPT_FAILED_MARKER, DECRYPT_FAILED_MARKER,
+                                          DECRYPT_FAILED_MARKER, "last"]
+    assert decrypt_many(items[:2], EMAIL, failure_marker=None) == ["first", None]
+
+
+def test_decrypt_many_uses_the_pool_only_for_large_batches(pool):
+    decrypt_many([encrypt(f"small {index}", EMAIL) for index in range(2)], EMAIL)
+    assert pool.batches == []
+
+    decrypt_many([encrypt(f"large {index}", EMAIL) for index in range(3)], EMAIL)
+    assert pool.batches == [3]
+
+
+def test_decrypt_many_derives_cached_keys_in_process(pool):
+    blobs = [encrypt(f"message {index}", EMAIL) for index in range(4)]
+    decrypt_many(blobs, EMAIL)
+
+    # The pool warmed the parent's key cache, so a second pass stays in-process
+    assert decrypt_many(blobs, EMAIL) == [f"message {index}" for index in range(4)]
+    assert pool.batches == [4]
+
+
+def test_single_worker_never_uses_the_pool(pool, monkeypatch):
+    monkeypatch.setattr(encryption, "DECRYPT_POOL_WORKERS", 1)
+
+    decrypt_many([encrypt(f"message {index}", EMAIL) for index in range(4)], EMAIL)
+
+    assert pool.batches == []
+
+
+def test_decrypt_many_reads_mixed_v1_and_v2_batches(pool):
+    data_key = generate_data_key()
+    items = [encrypt_v2("v2 first", data_key), encrypt("v1 a", EMAIL), encrypt_v2("v2 second", data_key),
+             encrypt("v1 b", EMAIL), encrypt("v1 c", EMAIL)]
+
+    assert decrypt_many(items, EMAIL, data_key=data_key) == ["v2 first", "v1 a", "v2 second", "v1 b", "v1 c"]
+    # Only the v1 blobs need a key derivation
+    assert pool.batches == [3]
+    # Without the data key the v2 envelopes cannot be read
+    assert decrypt_many(items[:2], EMAIL) == [DECRYPT_FAILED_MARKER, "v1 a"]
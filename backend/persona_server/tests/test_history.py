@@ -0,0 +1,92 @@
+import base64
+
+import pytest
+
+import history
+from encryption import encrypt_v2, generate_data_key, DECRYPT_FAILED_MARKER
+from history import decode_history, iter_decoded_history, pack_segment, unpack_segment
+
+EMAIL = "user@example.com"
+ENTRIES = [{"message": f"message {index}", "role": "user" if index % 2 else "assistant"} for index in range(5)]
+
+
+@pytest.fixture
+def data_key():
+    return generate_data_key()
+
+
+@pytest.mark.parametrize("sealed", [True, False])
+def test_segment_round_trips(data_key, sealed):
+    segment = pack_segment(ENTRIES, data_key, sealed=sealed, codec="zlib")
+
+    assert segment["codec"] == "zlib"
+    assert segment["count"] == len(ENTRIES)
+    assert segment["sealed"] is sealed
+    assert unpack_segment(segment, data_key) == ENTRIES
+
+
+def test_zstd_segment_round_trips(data_key):
+    pytest.importorskip("zstandard")
+
+    segment = pack_segment(ENTRIES, data_key, codec="zstd")
+
+    assert segment["codec"] == "zstd"
+    assert unpack_segment(segment, data_key) == ENTRIES
+
+
+def test_zstd_falls_back_to_zlib_without_zstandard(data_key, monkeypatch):
+    monkeypatch.setattr(history, "zstandard", None)
+
+    segment = pack_segment(ENTRIES, data_key, codec="zstd")
+
+    assert segment["codec"] == "zlib"
+    assert unpack_segment(segment, data_key) == ENTRIES
+
+
+def test_segment_needs_the_data_key(data_key):
+    segment = pack_segment(ENTRIES, data_key)
+
+    with pytest.raises(Exception):
+        unpack_segment(segment, None)
+    with pytest.raises(Exception):
+        unpack_segment(segment, generate_data_key())
+
+
+def corrupt(segment):
+    # Keep the version byte and nonce, flip the last ciphertext byte
+    blob = bytearray(base64.b64decode(segment[history.SEGMENT_FIELD]))
+    blob[-1] ^= 0xFF
+    return {**segment, history.SEGMENT_FIELD: base64.b64encode(bytes(blob)).decode("utf-8")}
+
+
+def test_corrupt_segment_keeps_message_counts_and_indexes(data_key):
+    user_history = [
+        {"encryptedMessage": encrypt_v2("before", data_key), "role": "user"},
+        corrupt(pack_segment(ENTRIES[:3], data_key, sealed=True)),
+        {"encryptedMessage": encrypt_v2("after", data_key), "role": "user"},
+    ]
+
+    decoded = decode_history(user_history, EMAIL, data_key)
+
+    assert [entry["message"] for entry in decoded] == ["before"] + [DECRYPT_FAILED_MARKER] * 3 + ["after"]
+
+
+def test_corrupt_segment_keeps_start_offsets_aligned(data_key):
+    # The segment straddles start, so it is decoded; the next page must still start at index 4
+    pages = [[{"encryptedMessage": encrypt_v2("message 0", data_key), "role": "user"},
+              corrupt(pack_segment(ENTRIES[1:4], data_key, sealed=True))],
+             [{"encryptedMessage": encrypt_v2("message 4", data_key), "role": "user"}]]
+
+    decoded = list(iter_decoded_history(pages, EMAIL, data_key, start=3))
+
+    assert [entry and entry["message"] for entry in decoded] == [None] + [DECRYPT_FAILED_MARKER] * 3 + ["message 4"]
+
+
+def test_zstd_segment_without_zstandard_reads_as_markers(data_key, monkeypatch):
+    segment = pack_segment(ENTRIES[:2], data_key, codec="zlib")
+    segment["codec"] = "zstd"
+    monkeypatch.setattr(history, "zstandard", None)
+
+    decoded = decode_history([segment], EMAIL, data_key)
+
+    assert decoded == [{"message": DECRYPT_FAILED_MARKER}] * 2
@@ -0,0 +1,327 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import journal_analysis
+from encryption import encrypt_v2, generate_data_key
+from journal_analysis import (analyze_entries, analyze_entries_async, analyze_entries_incrementally, analyze_entry_async,
+                              parse_entry_analysis, STORED_ANALYSIS_FIELD,
+                              BATCH_ANALYSIS_SCHEMA, ENTRY_ANALYSIS_SCHEMA, EMOTION_SYSTEM_PROMPT, EMOTIONS,
+                              ANALYSIS_UNAVAILABLE)
+
+ENTRIES = [
+    {"entry_id": f"e{index}", "title": f"title {index}", "date": f"2024-01-0{index + 1}", "content": f"content {index}"}
+    for index in range(6)
+]
+
+
+def analysis(entry_id):
+    return {"analysis": f"analysis of {entry_id}", "summary": f"summary of {entry_id}",
+            "emotions": {emotion: 0.5 for emotion in EMOTIONS}}
+
+
+def entry_ids(prompt):
+    return [entry["entry_id"] for entry in ENTRIES if f"Title: {entry['title']}\n" in prompt]
+
+
+class FakeLLM:
+    """Blocking llm(prompt, system_prompt=..., response_schema=None) that records its calls"""
+
+    def __init__(self, batch_error=None, leave_out=(), fail=(), delay=0.0):
+        self.batch_error = batch_error
+        self.leave_out = set(leave_out)
+        self.fail = set(fail)
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt, system_prompt=None, response_schema=None):
+        ids = entry_ids(prompt)
+        with self.lock:
+            self.calls.append((response_schema, ids))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # Later entries answer first, so completion order differs from input order
+            time.sleep(self.delay * (len(ENTRIES) - int(ids[0][1:])) if ids else 0)
+            return self.reply(ids, response_schema)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def reply(self, ids, response_schema):
+        if self.fail & set(ids):
+            raise RuntimeError("model unavailable")
+        if response_schema is BATCH_ANALYSIS_SCHEMA:
+            if self.batch_error is not None:
+                raise self.batch_error
+            return json.dumps([{"entry_id": entry_id, **analysis(entry_id)}
+                               for entry_id in ids if entry_id not in self.leave_out])
+        if response_schema is ENTRY_ANALYSIS_SCHEMA:
+            return json.dumps(analysis(ids[0]))
+        return "free text"
+
+    def batched(self):
+        return [ids for schema, ids in self.calls if schema is BATCH_ANALYSIS_SCHEMA]
+
+
+def run(llm, entries=ENTRIES, **kwargs):
+    kwargs.setdefault("structured", True)
+    kwargs.setdefault("batch", True)
+    kwargs.setdefault("token_budget", 100000)
+    return analyze_entries(entries, llm=llm, **kwargs)
+
+
+def test_batch_answers_every_entry_in_one_request():
+    llm = FakeLLM()
+
+    results = run(llm)
+
+    assert len(llm.calls) == 1
+    assert [result["summary"] for result in results] == [f"summary of {entry['entry_id']}" for entry in ENTRIES]
+
+
+def test_entries_left_out_of_the_answer_are_retried_in_halves():
+    llm = FakeLLM(leave_out={"e1", "e2", "e4"})
+
+    results = run(llm)
+
+    assert llm.batched()[0] == [entry["entry_id"] for entry in ENTRIES]
+    # e1/e2/e4 are missing: split into [e1] and [e2, e4]
+    assert ["e2", "e4"] in llm.batched()
+    assert not any(journal_analysis.is_degraded(result) for result in results)
+    assert [result["entry_id"] for result in results] == [entry["entry_id"] for entry in ENTRIES]
+
+
+def test_failed_batch_request_falls_back_to_one_call_per_entry():
+    llm = FakeLLM(batch_error=RuntimeError("503 after retries"))
+
+    results = run(llm)
+
+    # One failed batch, then each entry once; no recursive splitting
+    assert llm.batched() == [[entry["entry_id"] for entry in ENTRIES]]
+    assert len(llm.calls) == 1 + len(ENTRIES)
+    assert [result["summary"] for result in results] == [f"summary of {entry['entry_id']}" for entry in ENTRIES]
+
+
+def test_outage_degrades_entries_without_splitting_the_batch():
+    llm = FakeLLM(fail={entry["entry_id"] for entry in ENTRIES})
+
+    results = run(llm)
+
+    assert len(llm.batched()) == 1
+    assert len(llm.calls) == 1 + len(ENTRIES)
+    assert all(result["analysis"] == ANALYSIS_UNAVAILABLE for result in results)
+
+
+def test_concurrency_caps_the_requests_in_flight():
+    llm = FakeLLM(delay=0.01)
+
+    asyncio.run(analyze_entries_async(ENTRIES, llm, concurrency=2, structured=True, batch=False))
+
+    assert len(llm.calls) == len(ENTRIES)
+    assert llm.max_in_flight == 2
+
+
+def test_results_keep_the_input_order():
+    llm = FakeLLM(delay=0.01)
+
+    results = asyncio.run(analyze_entries_async(ENTRIES, llm, concurrency=len(ENTRIES), structured=True, batch=False))
+
+    assert [result["entry_id"] for result in results] == [entry["entry_id"] for entry in ENTRIES]
+    assert [result["summary"] for result in results] == [f"summary of {entry['entry_id']}" for entry in ENTRIES]
+
+
+def test_one_failing_entry_degrades_alone():
+    llm = FakeLLM(fail={"e3"})
+
+    results = asyncio.run(analyze_entries_async(ENTRIES, llm, concurrency=2, structured=True, batch=False))
+
+    assert [journal_analysis.is_degraded(result) for result in results] == [index == 3 for index in range(len(ENTRIES))]
+    assert results[3]["emotions"] == {emotion: 0 for emotion in EMOTIONS}
+
+
+def test_parse_entry_analysis_reads_a_valid_reply():
+    reply = json.dumps({"analysis": " insight ", "summary": "takeaway", "emotions": {"Joy": 0.7, "Fear": 2, "Anger": "x"}})
+
+    parsed = parse_entry_analysis(reply)
+
+    assert parsed["analysis"] == "insight"
+    assert parsed["summary"] == "takeaway"
+    # Clamped to 0-1; missing or invalid emotions become 0
+    assert parsed["emotions"] == {**{emotion: 0 for emotion in EMOTIONS}, "Joy": 0.7, "Fear": 1.0}
+
+
+def test_parse_entry_analysis_finds_json_wrapped_in_prose():
+    reply = "Here you go:\n```json\n" + json.dumps(analysis("e0")) + "\n```"
+
+    assert parse_entry_analysis(reply)["summary"] == "summary of e0"
+
+
+@pytest.mark.parametrize("reply", [
+    "",
+    "no json here",
+    "{not: valid json}",
+    json.dumps(["analysis", "summary"]),
+    json.dumps({"summary": "takeaway", "emotions": {}}),
+    json.dumps({"analysis": "insight", "summary": "  "}),
+    json.dumps({"analysis": 3, "summary": "takeaway"}),
+])
+def test_parse_entry_analysis_rejects_malformed_or_incomplete_replies(reply):
+    with pytest.raises(ValueError):
+        parse_entry_analysis(reply)
+
+
+def test_missing_emotions_default_to_zero():
+    parsed = parse_entry_analysis(json.dumps({"analysis": "insight", "summary": "takeaway"}))
+
+    assert parsed["emotions"] == {emotion: 0 for emotion in EMOTIONS}
+
+
+class PromptLLM:
+    """Structured calls get `structured_reply`; the separate prompts get plain replies"""
+
+    def __init__(self, structured_reply, emotion_reply='```json\n{"Joy": 0.4}\n```'):
+        self.structured_reply = structured_reply
+        self.emotion_reply = emotion_reply
+        self.schemas = []
+
+    def __call__(self, prompt, system_prompt=None, response_schema=None):
+        self.schemas.append(response_schema)
+        if response_schema is not None:
+            return self.structured_reply
+        if system_prompt == EMOTION_SYSTEM_PROMPT:
+            return self.emotion_reply
+        if prompt.strip().startswith("Summarize"):
+            return "separate summary"
+        return "separate analysis"
+
+
+def analyze_one(llm, structured=True):
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        return asyncio.run(analyze_entry_async(ENTRIES[0], llm, executor, structured=structured))
+    finally:
+        executor.shutdown()
+
+
+def test_valid_structured_reply_needs_one_call():
+    llm = PromptLLM(json.dumps(analysis("e0")))
+
+    result = analyze_one(llm)
+
+    assert llm.schemas == [ENTRY_ANALYSIS_SCHEMA]
+    assert result["summary"] == "summary of e0"
+
+
+@pytest.mark.parametrize("structured_reply", ["not json", json.dumps({"analysis": "insight"})])
+def test_malformed_structured_reply_falls_back_to_separate_prompts(structured_reply):
+    llm = PromptLLM(structured_reply)
+
+    result = analyze_one(llm)
+
+    # The structured call, then analysis + emotions, then the summary
+    assert llm.schemas == [ENTRY_ANALYSIS_SCHEMA, None, None, None]
+    assert result["analysis"] == "separate analysis"
+    assert result["summary"] == "separate summary"
+    assert result["emotions"] == {"Joy": 0.4}
+
+
+def test_separate_prompts_degrade_only_the_failed_field():
+    llm = PromptLLM(None, emotion_reply="not json")
+
+    result = analyze_one(llm, structured=False)
+
+    assert result["analysis"] == "separate analysis"
+    assert result["summary"] == "separate summary"
+    assert result["emotions"] == {emotion: 0 for emotion in EMOTIONS}
+
+
+EMAIL = "user@example.com"
+
+
+class Journal:
+    """Entries stored encrypted, with the analyses analyze_entries_incrementally saves"""
+
+    def __init__(self):
+        self.data_key = generate_data_key()
+        self.entries = [dict(entry) for entry in ENTRIES]
+        self.data = {}
+        self.store = {}
+        for entry in self.entries:
+            self.write(entry)
+
+    def write(self, entry):
+        # Every write encrypts with a fresh nonce, like the web app does
+        self.data[entry["entry_id"]] = {"encryptedTitle": encrypt_v2(entry["title"], self.data_key),
+                                        "encryptedContent": encrypt_v2(entry["content"], self.data_key),
+                                        "date": entry["date"]}
+
+    def analyze(self, llm):
+        entries_data = [{**self.data[entry["entry_id"]], **self.store.get(entry["entry_id"], {})}
+                        for entry in self.entries]
+        return analyze_entries_incrementally(self.entries, entries_data, llm, EMAIL, self.data_key,
+                                             save=self.store.update)
+
+
+def analyzed_ids(llm):
+    return sorted({entry_id for _, ids in llm.calls for entry_id in ids})
+
+
+def test_unchanged_entries_reuse_their_stored_analysis():
+    journal = Journal()
+    journal.analyze(FakeLLM())
+    assert set(journal.store) == {entry["entry_id"] for entry in ENTRIES}
+    assert all(STORED_ANALYSIS_FIELD in fields for fields in journal.store.values())
+
+    llm = FakeLLM()
+    results = journal.analyze(llm)
+
+    assert llm.calls == []
+    assert [result["summary"] for result in results] == [f"summary of {entry['entry_id']}" for entry in ENTRIES]
+
+
+def test_reencrypted_but_unchanged_entries_are_reused():
+    journal = Journal()
+    journal.analyze(FakeLLM())
+    for entry in journal.entries:
+        journal.write(entry)
+
+    llm = FakeLLM()
+    journal.analyze(llm)
+
+    assert llm.calls == []
+
+
+def test_edited_entries_are_analyzed_again():
+    journal = Journal()
+    journal.analyze(FakeLLM())
+    journal.entries[2]["content"] = "edited content"
+    journal.write(journal.entries[2])
+
+    llm = FakeLLM()
+    results = journal.analyze(llm)
+
+    assert analyzed_ids(llm) == ["e2"]
+    assert [result["content"] for result in results][2] == "edited content"
+    # The new analysis is stored, so the next run reuses it
+    llm = FakeLLM()
+    journal.analyze(llm)
+    assert llm.calls == []
+
+
+def test_degraded_analyses_are_not_stored():
+    journal = Journal()
+
+    journal.analyze(FakeLLM(fail={"e4"}))
+
+    assert "e4" not in journal.store
+    llm = FakeLLM()
+    journal.analyze(llm)
+    assert analyzed_ids(llm) == ["e4"]
@@ -0,0 +1,113 @@
+import sqlite3
+
+import pytest
+
+from encryption import generate_data_key, wrap_data_key
+from llm_cache import LLMCache, user_scope
+from prompt_budget import budget_history
+
+PROMPT = "Summarize: I could not sleep after the argument with my sister"
+REPLY = "The user had trouble sleeping after a family conflict"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMCache(path=str(tmp_path / "cache.sqlite3"))
+
+
+def generate(cache, calls, reply=REPLY, prompt=PROMPT):
+    def produce():
+        calls.append(prompt)
+        return reply
+    return cache.generate("history_digest", "model", prompt, produce=produce)
+
+
+def stored_rows(cache):
+    cache.stats()
+    conn = sqlite3.connect(cache.path)
+    try:
+        return conn.execute("SELECT key, response FROM llm_cache_sealed").fetchall()
+    finally:
+        conn.close()
+
+
+def test_calls_outside_a_user_scope_are_not_cached(cache):
+    calls = []
+
+    assert generate(cache, calls) == REPLY
+    assert generate(cache, calls) == REPLY
+
+    assert len(calls) == 2
+    assert stored_rows(cache) == []
+    assert cache.stats()["call_sites"]["history_digest"]["bypassed"] == 2
+
+
+def test_cached_responses_are_encrypted_and_keyed_per_user(cache):
+    calls = []
+
+    with user_scope({"email": "a@example.com"}):
+        assert generate(cache, calls) == REPLY
+        assert generate(cache, calls) == REPLY
+
+    assert len(calls) == 1
+    [(key, response)] = stored_rows(cache)
+    assert REPLY not in response
+    assert "sleep" not in response.lower()
+
+    # Another user's identical prompt neither finds nor reads the first user's row
+    with user_scope({"email": "b@example.com"}):
+        assert generate(cache, calls, reply="other reply") == "other reply"
+
+    assert len(calls) == 2
+    assert len({row[0] for row in stored_rows(cache)}) == 2
+
+
+def test_data_key_users_are_keyed_by_their_data_key(cache):
+    calls = []
+    data_key = generate_data_key()
+    user = {"email": "a@example.com", "wrappedDataKey": wrap_data_key(data_key, "a@example.com")}
+
+    with user_scope(user):
+        generate(cache, calls)
+    # Passing the already unwrapped key gives the same cache keys
+    with user_scope({"email": "a@example.com"}, data_key):
+        generate(cache, calls)
+    # The email-derived key of the same user does not open the entry
+    with user_scope({"email": "a@example.com"}):
+        generate(cache, calls)
+
+    assert len(calls) == 2
+
+
+def test_user_scope_reaches_history_digest_worker_threads(cache):
+    calls = []
+    turns = [{"role": "user", "message": f"turn {i} " + "words " * 50} for i in range(200)]
+
+    def summarize(prompt):
+        return generate(cache, calls, prompt=prompt)
+
+    with user_scope({"email": "a@example.com"}):
+        budget_history(turns, 4000, summarize=summarize, block_size=10, concurrency=4)
+        digests = len(calls)
+        budget_history(turns, 4000, summarize=summarize, block_size=10, concurrency=4)
+
+    assert digests > 0
+    assert len(calls) == digests
+
+
+def test_legacy_plaintext_table_is_dropped(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE llm_cache (key TEXT PRIMARY KEY, response TEXT)")
+    conn.execute("INSERT INTO llm_cache VALUES ('k', ?)", (REPLY,))
+    conn.commit()
+    conn.close()
+
+    LLMCache(path=path).stats()
+
+    conn = sqlite3.connect(path)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+    assert "llm_cache" not in tables
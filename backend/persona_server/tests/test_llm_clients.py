@@ -0,0 +1,63 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from llm_clients import ClientRegistry
+from llm_gateway import LLMGateway
+
+
+class FakeAsyncModels:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.threads = []
+
+    async def get(self, model):
+        self.threads.append(threading.current_thread().name)
+        if self.fail:
+            raise RuntimeError("unavailable")
+        return {"name": model}
+
+
+class FakeSyncModels:
+    def get(self, model):
+        raise AssertionError("warm-up must not use the sync client")
+
+
+def fake_client(fail=False):
+    return SimpleNamespace(models=FakeSyncModels(), aio=SimpleNamespace(models=FakeAsyncModels(fail)))
+
+
+@pytest.fixture
+def gateway():
+    gateway = LLMGateway()
+    yield gateway
+    gateway.close()
+
+
+def registry_with(clients):
+    registry = ClientRegistry()
+    registry._clients.update(clients)
+    return registry
+
+
+def test_warm_up_uses_the_aio_clients_on_the_gateway_loop(gateway):
+    clients = {"vertex": fake_client(), "api_key": fake_client()}
+    registry = registry_with(clients)
+
+    registry.warm_up(gateway=gateway)
+
+    for client in clients.values():
+        assert client.aio.models.threads == ["llm-gateway"]
+    assert set(registry.stats()["warmup_seconds"]) == {"vertex", "api_key"}
+    # Setup work is not a gateway request
+    assert gateway.stats()["call_sites"] == {}
+
+
+def test_warm_up_failure_is_logged_and_skipped(gateway):
+    registry = registry_with({"vertex": fake_client(fail=True), "api_key": fake_client()})
+
+    registry.warm_up(gateway=gateway)
+
+    assert set(registry.stats()["warmup_seconds"]) == {"api_key"}
+    assert gateway.breaker.state == "closed"
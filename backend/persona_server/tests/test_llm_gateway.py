@@ -0,0 +1,185 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_gateway import (CircuitBreaker, CircuitOpenError, DeadlineExceededError, LLMGateway, TokenBucket,
+                         backoff_delay)
+
+
+class APIError(Exception):
+    def __init__(self, code):
+        super().__init__(f"status {code}")
+        self.code = code
+
+
+def fake_request(*outcomes, delay=0.0):
+    """Request raising or returning each outcome in turn; records every attempt"""
+    attempts = []
+
+    async def request():
+        attempts.append(len(attempts))
+        if delay:
+            await asyncio.sleep(delay)
+        outcome = outcomes[min(len(attempts), len(outcomes)) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    request.attempts = attempts
+    return request
+
+
+@pytest.fixture
+def make_gateway():
+    gateways = []
+
+    def make(**kwargs):
+        options = {"rate": 0, "backoff_base": 0.001, "backoff_cap": 0.001, "max_retries": 3,
+                   "breaker_threshold": 3, "breaker_reset_seconds": 60, **kwargs}
+        gateway = LLMGateway(**options)
+        gateways.append(gateway)
+        return gateway
+    yield make
+    for gateway in gateways:
+        gateway.close()
+
+
+def site_stats(gateway, call_site="test"):
+    return gateway.stats()["call_sites"][call_site]
+
+
+def test_retryable_errors_are_retried_until_success(make_gateway):
+    gateway = make_gateway()
+    request = fake_request(APIError(503), APIError(429), "ok")
+
+    assert gateway.call_sync("test", request) == "ok"
+    assert len(request.attempts) == 3
+    stats = site_stats(gateway)
+    assert (stats["retries"], stats["succeeded"], stats["failed"]) == (2, 1, 0)
+
+
+def test_client_errors_are_not_retried(make_gateway):
+    gateway = make_gateway()
+    request = fake_request(APIError(400), "ok")
+
+    with pytest.raises(APIError):
+        gateway.call_sync("test", request)
+    assert len(request.attempts) == 1
+    assert site_stats(gateway)["failed"] == 1
+
+
+def test_retries_stop_after_max_retries(make_gateway):
+    gateway = make_gateway(max_retries=2)
+    request = fake_request(APIError(500))
+
+    with pytest.raises(APIError):
+        gateway.call_sync("test", request)
+    assert len(request.attempts) == 3
+    assert site_stats(gateway)["retries"] == 2
+
+
+def test_backoff_delay_is_jittered_below_the_capped_exponential():
+    for attempt in range(8):
+        for _ in range(20):
+            assert 0 <= backoff_delay(attempt, base=0.5, cap=4) <= min(4, 0.5 * 2 ** attempt)
+
+
+def test_token_bucket_waits_once_the_burst_is_spent():
+    bucket = TokenBucket(rate=50, burst=2)
+
+    async def acquire(count):
+        start = time.monotonic()
+        for _ in range(count):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(acquire(2)) < 0.01
+    assert bucket.waited_seconds == 0
+    assert asyncio.run(acquire(2)) >= 0.03
+    assert bucket.waited_seconds > 0
+
+
+def test_breaker_opens_after_threshold_and_rejects(make_gateway):
+    gateway = make_gateway(max_retries=0)
+
+    for _ in range(3):
+        with pytest.raises(APIError):
+            gateway.call_sync("test", fake_request(APIError(503)))
+    request = fake_request("ok")
+
+    with pytest.raises(CircuitOpenError):
+        gateway.call_sync("test", request)
+    assert request.attempts == []
+    assert gateway.breaker.state == "open"
+    assert site_stats(gateway)["rejected"] == 1
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    # Skip the reset period
+    breaker.opened_at -= breaker.reset_seconds
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker(threshold=2, reset_seconds=60)
+    open_breaker(breaker)
+
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker(threshold=2, reset_seconds=60)
+    open_breaker(breaker)
+
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+
+
+def test_client_error_does_not_close_a_half_open_breaker(make_gateway):
+    gateway = make_gateway()
+    open_breaker(gateway.breaker)
+
+    with pytest.raises(APIError):
+        gateway.call_sync("test", fake_request(APIError(400)))
+
+    assert gateway.breaker.state == "half-open"
+    assert gateway.breaker.failures == 3
+    # The probe slot is free again for the next request
+    assert gateway.call_sync("test", fake_request("ok")) == "ok"
+    assert gateway.breaker.state == "closed"
+
+
+def test_client_error_keeps_earlier_provider_failures(make_gateway):
+    gateway = make_gateway(max_retries=0)
+
+    for outcome in (APIError(503), APIError(503), APIError(400), APIError(503)):
+        with pytest.raises(APIError):
+            gateway.call_sync("test", fake_request(outcome))
+
+    assert gateway.breaker.state == "open"
+
+
+def test_deadline_covers_the_whole_request(make_gateway):
+    gateway = make_gateway()
+    request = fake_request("ok", delay=1)
+
+    with pytest.raises(DeadlineExceededError):
+        gateway.call_sync("test", request, deadline_seconds=0.05)
+    assert site_stats(gateway)["deadline_exceeded"] == 1
+    assert gateway.breaker.failures == 1
+
+
+def test_call_works_from_another_event_loop(make_gateway):
+    gateway = make_gateway()
+
+    async def run():
+        return await asyncio.gather(*(gateway.call("test", fake_request(index)) for index in range(5)))
+
+    assert asyncio.run(run()) == [0, 1, 2, 3, 4]
@@ -0,0 +1,132 @@
+import pytest
+
+import encryption
+import migrate_envelope
+from encryption import decrypt, encrypt, encrypt_v2, generate_data_key, get_user_data_key, is_v2, wrap_data_key
+from history import decode_history, is_segment
+from repository import repo
+from tests.fake_firestore import FakeSyncClient
+
+EMAIL = "user@example.com"
+USER = "users/user"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    client = FakeSyncClient()
+    monkeypatch.setattr(repo, "_client", client)
+    # Keep the few v1 blobs here in-process
+    monkeypatch.setattr(encryption, "DECRYPT_POOL_MIN_BATCH", 1000)
+
+    def write_user_history(user_ref, old_history, new_history):
+        current = user_ref.get().to_dict().get("userHistory") or []
+        assert current[:len(old_history)] == old_history
+        user_ref.update({"userHistory": new_history + current[len(old_history):]})
+    # Firestore transactions need a real client
+    monkeypatch.setattr(migrate_envelope, "_write_user_history", write_user_history)
+    return client
+
+
+def add_user(db, history=(), messages=(), journal=(), **fields):
+    db.documents[USER] = {"email": EMAIL, "userHistory": list(history), **fields}
+    for seq, message in enumerate(messages):
+        db.documents[f"{USER}/messages/m{seq}"] = {"encryptedMessage": message, "role": "user", "seq": seq}
+    for index, (title, content) in enumerate(journal):
+        db.documents[f"{USER}/journalEntries/j{index}"] = {"encryptedTitle": title, "encryptedContent": content}
+
+
+def user_data_key(db):
+    return get_user_data_key(db.documents[USER], EMAIL)
+
+
+def messages(db):
+    docs = [data for path, data in db.documents.items() if path.startswith(f"{USER}/messages/")]
+    return sorted(docs, key=lambda data: data["seq"])
+
+
+def test_ensure_data_key_creates_and_then_reuses_the_wrapped_key(db):
+    add_user(db)
+    user_ref = repo.user_ref("user")
+
+    data_key = migrate_envelope.ensure_data_key(user_ref, db.documents[USER], EMAIL)
+
+    assert user_data_key(db) == data_key
+    assert migrate_envelope.ensure_data_key(user_ref, db.documents[USER], EMAIL) == data_key
+
+
+def test_migrate_user_reencrypts_history_messages_and_journal(db):
+    add_user(
+        db,
+        history=[{"encryptedMessage": encrypt("old", EMAIL), "role": "user"}],
+        messages=[encrypt("first", EMAIL), encrypt("second", EMAIL)],
+        journal=[(encrypt("title", EMAIL), encrypt("content", EMAIL))],
+    )
+
+    migrate_envelope.migrate_user("user")
+
+    data_key = user_data_key(db)
+    blobs = [db.documents[USER]["userHistory"][0]["encryptedMessage"]]
+    blobs += [data["encryptedMessage"] for data in messages(db)]
+    journal = db.documents[f"{USER}/journalEntries/j0"]
+    blobs += [journal["encryptedTitle"], journal["encryptedContent"]]
+    assert all(is_v2(blob) for blob in blobs)
+    assert [decrypt(blob, EMAIL, data_key) for blob in blobs] == ["old", "first", "second", "title", "content"]
+    assert [data["seq"] for data in messages(db)] == [0, 1]
+
+
+def test_messages_written_as_v1_after_a_migration_are_picked_up(db):
+    data_key = generate_data_key()
+    add_user(db, messages=[encrypt_v2("migrated", data_key), encrypt("new", EMAIL)],
+             wrappedDataKey=wrap_data_key(data_key, EMAIL))
+
+    migrate_envelope.migrate_user("user")
+
+    blobs = [data["encryptedMessage"] for data in messages(db)]
+    assert all(is_v2(blob) for blob in blobs)
+    assert [decrypt(blob, EMAIL, data_key) for blob in blobs] == ["migrated", "new"]
+    # The already migrated message is not written again
+    assert db.commits == [1]
+
+
+def test_pack_replaces_full_runs_of_messages_with_segments(db):
+    data_key = generate_data_key()
+    texts = [f"message {index}" for index in range(5)]
+    add_user(db, messages=[encrypt_v2(text, data_key) for text in texts[:4]] + [encrypt(texts[4], EMAIL)],
+             wrappedDataKey=wrap_data_key(data_key, EMAIL))
+
+    migrated, failed = migrate_envelope.migrate_messages(
+        repo.user_ref("user"), EMAIL, data_key, batch_size=100, pack=True, max_messages=2
+    )
+
+    docs = messages(db)
+    assert (migrated, failed) == (5, 0)
+    assert [is_segment(data) for data in docs] == [True, True, False]
+    # Segments keep the seq of their first message, so the order is unchanged
+    assert [data["seq"] for data in docs] == [0, 2, 4]
+    assert all(data.get("sealed") for data in docs[:2])
+    history = decode_history([{key: value for key, value in data.items() if key != "seq"} for data in docs],
+                             EMAIL, data_key)
+    assert [entry["message"] for entry in history] == texts
+    assert all(entry["role"] == "user" for entry in history)
+
+
+def test_undecryptable_messages_are_counted_and_left_alone(db):
+    data_key = generate_data_key()
+    foreign = encrypt("not yours", "someone-else@example.com")
+    add_user(db, messages=[foreign, encrypt("mine", EMAIL)], wrappedDataKey=wrap_data_key(data_key, EMAIL))
+
+    migrated, failed = migrate_envelope.migrate_messages(repo.user_ref("user"), EMAIL, data_key, batch_size=100)
+
+    assert (migrated, failed) == (1, 1)
+    assert messages(db)[0]["encryptedMessage"] == foreign
+
+
+def test_dry_run_writes_nothing(db):
+    add_user(db, history=[{"encryptedMessage": encrypt("old", EMAIL), "role": "user"}],
+             messages=[encrypt("first", EMAIL)])
+    before = {path: dict(data) for path, data in db.documents.items()}
+
+    migrate_envelope.migrate_user("user", dry_run=True, pack=True)
+
+    assert db.documents == before
+    assert db.commits == []
@@ -0,0 +1,183 @@
+import time
+
+from persona_cache import PersonaCache
+from repository import UserSnapshot
+
+
+class FakeWatch:
+    def __init__(self, registry, callback):
+        self.registry = registry
+        self.callback = callback
+        self.is_active = True
+        registry.append(self)
+
+    def unsubscribe(self):
+        self.is_active = False
+        self.registry.remove(self)
+
+
+class FakeDoc:
+    def __init__(self, data):
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeRepository:
+    """Dict-backed stand-in for UserRepository; listeners push the full document like Firestore"""
+
+    def __init__(self):
+        self.users = {}
+        self.personas = {}
+        self.loads = 0
+        self.user_watches = {}
+        self.persona_watches = {}
+
+    def load_user_snapshot(self, authId):
+        self.loads += 1
+        data = self.users.get(authId)
+        return UserSnapshot(authId, {"email": data["email"]} if data else None, self.personas.get(authId))
+
+    def watch_user(self, authId, callback):
+        watch = FakeWatch(self.user_watches.setdefault(authId, []), callback)
+        # Firestore delivers the current document as the first push
+        callback([FakeDoc(self.users.get(authId))], [], None)
+        return watch
+
+    def watch_persona(self, authId, callback):
+        return FakeWatch(self.persona_watches.setdefault(authId, []), callback)
+
+    def write_user(self, authId, fields):
+        self.users[authId] = {**self.users.get(authId, {}), **fields}
+        for watch in list(self.user_watches.get(authId, [])):
+            watch.callback([FakeDoc(self.users[authId])], [], None)
+
+    def listeners(self, authId):
+        return len(self.user_watches.get(authId, [])) + len(self.persona_watches.get(authId, []))
+
+
+def make_cache(users=3, **kwargs):
+    store = FakeRepository()
+    for i in range(users):
+        store.users[f"user{i}"] = {"email": f"user{i}@example.com", "updatePersona": False}
+        store.personas[f"user{i}"] = {"Info": f"persona {i}"}
+    return store, PersonaCache(repository=store, **kwargs)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def test_entry_cap_evicts_lru_and_unsubscribes():
+    store, cache = make_cache(users=3, max_entries=2)
+    cache.get("user0")
+    cache.get("user1")
+    cache.get("user0")  # user1 is now least recently used
+    cache.get("user2")
+
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["evictions"] == 1
+    assert store.listeners("user1") == 0
+    assert store.listeners("user0") == 2 and store.listeners("user2") == 2
+
+
+def test_byte_cap_evicts_and_unsubscribes():
+    store, cache = make_cache(users=3, max_bytes=1)
+    for i in range(3):
+        cache.get(f"user{i}")
+
+    # The newest entry is kept even though it alone is over the cap
+    assert cache.stats()["entries"] == 1
+    assert store.listeners("user0") == 0 and store.listeners("user1") == 0
+    assert store.listeners("user2") == 2
+
+
+def test_invalidate_and_clear_unsubscribe():
+    store, cache = make_cache(users=2)
+    cache.get("user0")
+    cache.get("user1")
+
+    cache.invalidate("user0")
+    assert store.listeners("user0") == 0 and store.listeners("user1") == 2
+
+    cache.clear()
+    assert store.listeners("user1") == 0
+    assert cache.stats()["entries"] == 0
+
+
+def test_push_updates_cached_snapshot_without_reload():
+    store, cache = make_cache(users=1)
+    cache.get("user0")
+    store.write_user("user0", {"updatePersona": True})
+
+    assert cache.get("user0").update_needed is True
+    assert store.loads == 1
+
+
+def test_large_user_document_is_cached_ttl_only():
+    store, cache = make_cache(users=1, listen_max_doc_bytes=1000, ttl_seconds=300)
+    store.users["user0"]["userHistory"] = [{"encryptedMessage": "x" * 100}] * 50
+
+    cache.get("user0")
+    wait_until(lambda: store.listeners("user0") == 0)
+    assert cache.stats()["listened"] == 0
+
+    # Served from the cache until the TTL runs out, then reloaded
+    cache.get("user0")
+    assert store.loads == 1
+    cache.ttl_seconds = 0
+    cache.get("user0")
+    assert store.loads == 2
+
+
+def test_callers_get_their_own_copy_of_the_snapshot():
+    store, cache = make_cache(users=1)
+    first = cache.get("user0")
+
+    # Request-scoped changes, as dataSync makes them, stay out of the cache
+    first.data["updatePersona"] = True
+    first.persona = {"Info": "changed by a request"}
+    second = cache.get("user0")
+
+    assert second is not first
+    assert second.update_needed is False
+    assert second.persona_info == "persona 0"
+    assert store.loads == 1
+
+
+def test_push_for_a_deleted_user_evicts_the_entry():
+    store, cache = make_cache(users=1)
+    cache.get("user0")
+
+    del store.users["user0"]
+    for watch in list(store.user_watches["user0"]):
+        watch.callback([FakeDoc(None)], [], None)
+
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+    wait_until(lambda: store.listeners("user0") == 0)
+    # The next read goes to the repository instead of serving a snapshot without data
+    assert cache.get("user0").exists is False
+    assert store.loads == 2
+
+
+def test_user_missing_on_the_first_push_is_not_listened_to():
+    store, cache = make_cache(users=1)
+    store.users["user0"] = {"email": "user0@example.com"}
+    watch_user = store.watch_user
+
+    def watch_deleted_user(authId, callback):
+        # The document is deleted between the load and the listener attaching
+        store.users.pop(authId, None)
+        return watch_user(authId, callback)
+    store.watch_user = watch_deleted_user
+
+    cache.get("user0")
+
+    wait_until(lambda: store.listeners("user0") == 0)
+    assert cache.stats()["entries"] == 0
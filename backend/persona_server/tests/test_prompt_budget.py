@@ -0,0 +1,28 @@
+from prompt_budget import budget_history
+
+TURNS = [{"role": "user", "message": f"turn {i} " + "words " * 50} for i in range(200)]
+
+
+def summarize_except(failing):
+    def summarize(prompt):
+        if any(f'"turn {i} ' in prompt for i in failing):
+            raise RuntimeError("model unavailable")
+        return "digest " + prompt.split('"turn ')[1].split()[0]
+    return summarize
+
+
+def test_failed_digest_drops_only_its_block():
+    history = budget_history(TURNS, 4000, summarize=summarize_except({120}), block_size=10)
+
+    assert "Recent conversation:" in history
+    assert "- digest 110" in history
+    assert "- digest 120" not in history
+    assert "- digest 130" in history
+
+
+def test_all_digests_failing_still_returns_the_recent_turns():
+    history = budget_history(TURNS, 4000, summarize=summarize_except(range(200)), block_size=10)
+
+    assert "Summary of earlier conversation" not in history
+    assert "earlier turns omitted]" in history
+    assert f'"turn {len(TURNS) - 1} ' in history